@@ -0,0 +1,186 @@
+########################################################################################################################
+#   Batch analysis:
+#
+#   Lexes, parses and generates the DOT graph for many Micro-C files at once. The files are handed out in chunks to
+#   a pool of worker processes and every file's result is written as one JSON line as soon as its chunk is done.
+#   A file that fails only produces an error line, the rest of the batch carries on. When a worker process dies the
+#   pool is started again and the files of the chunks that were in flight run again one by one, with nothing else
+#   in flight, so a file that takes its worker down once more is the one reported as failed. With --dot-dir the
+#   graphs are written below it in a mirror of the absolute source paths, and only for the files that succeed.
+#
+#   python batch.py programs/ 'generated/**/*.mc' --workers 8 --dot-dir dots/
+########################################################################################################################
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from compiler.lexer import FastLexer
+from compiler.parser import Parser
+from genastdot import ASTVisualizer
+
+SOURCE_PATTERN = '*.mc'
+
+
+# Directories are searched for .mc files, anything else is used as a glob pattern (a plain path matches itself)
+def find_sources(sources):
+    for source in sources:
+        if os.path.isdir(source):
+            yield from sorted(glob.glob(os.path.join(source, '**', SOURCE_PATTERN), recursive=True))
+        else:
+            yield from sorted(glob.glob(source, recursive=True))
+
+
+# Where the DOT graph of a source file goes: its absolute path mirrored below dot_dir, with .dot added, so no two
+# source files share one, e.g. /work/a/b.mc -> dot_dir/work/a/b.mc.dot
+def dot_file(dot_dir, path):
+    drive, source = os.path.splitdrive(os.path.abspath(path))
+    return os.path.join(dot_dir, drive.rstrip(':'), source.lstrip(os.sep) + '.dot')
+
+
+def analyze_file(path, dot_dir=None, detect_records=True):
+    result = {'path': path}
+    start = time.perf_counter()
+    try:
+        with open(path, encoding='utf-8') as source:
+            text = source.read()
+
+        lexer = FastLexer(text, detect_records)
+        tokens, error = lexer.make_tokens()
+        if error:
+            raise error
+        result['tokens'] = len(tokens)
+
+        parser = Parser(tokens)
+        # A lexer over the whole text lets error() report a line and column
+        parser.lexer = lexer
+        visualizer = ASTVisualizer(parser)
+        if dot_dir is None:
+            result['dot_bytes'] = len(visualizer.gendot())
+        else:
+            dot_path = dot_file(dot_dir, path)
+            os.makedirs(os.path.dirname(dot_path), exist_ok=True)
+            # Written next to its final name and only renamed to it once the whole graph is there, a file that
+            # fails to parse leaves nothing behind
+            partial = '{}.{}.tmp'.format(dot_path, os.getpid())
+            try:
+                with open(partial, 'w', encoding='utf-8') as dot:
+                    result['dot_bytes'] = visualizer.gendot(stream=dot)
+                os.replace(partial, dot_path)
+            finally:
+                if os.path.exists(partial):
+                    os.remove(partial)
+            result['dot'] = dot_path
+        result['ok'] = True
+    except Exception as error:
+        result['ok'] = False
+        result['error'] = '{}: {}'.format(type(error).__name__, error)
+    result['seconds'] = round(time.perf_counter() - start, 6)
+    return result
+
+
+def analyze_chunk(paths, dot_dir=None, detect_records=True):
+    return [analyze_file(path, dot_dir, detect_records) for path in paths]
+
+
+def failed(path, error):
+    return {'path': path, 'ok': False, 'error': '{}: {}'.format(type(error).__name__, error)}
+
+
+# Yields one result per file, in the order the chunks finish. At most two chunks per worker are in flight, so
+# the list of pending work never grows with the size of the batch.
+def analyze_batch(paths, workers=None, chunk_size=16, dot_dir=None, detect_records=True):
+    workers = workers or os.cpu_count() or 1
+    paths = iter(paths)
+    executor = ProcessPoolExecutor(max_workers=workers)
+    # future -> chunk
+    pending = {}
+    # Files that were in flight when the pool broke, each one runs by itself before any new chunk
+    suspects = deque()
+
+    def submit():
+        if suspects:
+            chunk = [suspects.popleft()]
+        else:
+            chunk = [path for _, path in zip(range(chunk_size), paths)]
+            if not chunk:
+                return False
+        try:
+            future = executor.submit(analyze_chunk, chunk, dot_dir, detect_records)
+        except BrokenProcessPool:
+            suspects.extendleft(reversed(chunk))
+            raise
+        pending[future] = chunk
+        return True
+
+    # Starts a new pool. A file that was in flight by itself took the worker down, otherwise which one did is not
+    # known and every file that was in flight becomes a suspect.
+    def restart(error):
+        nonlocal executor
+        executor.shutdown(cancel_futures=True)
+        executor = ProcessPoolExecutor(max_workers=workers)
+        chunks = list(pending.values())
+        pending.clear()
+        if len(chunks) == 1 and len(chunks[0]) == 1:
+            yield failed(chunks[0][0], error)
+        else:
+            for chunk in chunks:
+                suspects.extend(chunk)
+
+    try:
+        while True:
+            try:
+                # Only one file at a time while there are suspects
+                while len(pending) < (1 if suspects else 2 * workers) and submit():
+                    pass
+            except BrokenProcessPool as error:
+                yield from restart(error)
+                continue
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            broken = None
+            for future in done:
+                error = future.exception()
+                if isinstance(error, BrokenProcessPool):
+                    broken = error
+                    continue
+                chunk = pending.pop(future)
+                if error is None:
+                    yield from future.result()
+                else:
+                    for path in chunk:
+                        yield failed(path, error)
+            if broken is not None:
+                yield from restart(broken)
+    finally:
+        executor.shutdown()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Analyze many Micro-C files in parallel.')
+    argparser.add_argument('sources', nargs='+', help='.mc files, directories or glob patterns')
+    argparser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    argparser.add_argument('--chunk-size', type=int, default=16, help='files handed to a worker at a time')
+    argparser.add_argument('--dot-dir', default=None, help='write the DOT graph of every file into this directory')
+    args = argparser.parse_args()
+
+    if args.dot_dir is not None:
+        os.makedirs(args.dot_dir, exist_ok=True)
+
+    failed = 0
+    for result in analyze_batch(find_sources(args.sources), args.workers, args.chunk_size, args.dot_dir):
+        failed += not result['ok']
+        sys.stdout.write(json.dumps(result) + '\n')
+        sys.stdout.flush()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
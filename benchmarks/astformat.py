@@ -0,0 +1,55 @@
+########################################################################################################################
+#   Binary AST benchmark:
+#
+#   Encodes the tree of a generated Micro-C program with compiler/astformat.py and with pickle, and reports the
+#   size, the time to write it, the time to load all of it back and the time to open a view and read the children
+#   of the root.
+#
+#   Run from the repository root:
+#       python -m benchmarks.astformat --size 4MB
+########################################################################################################################
+import argparse
+import gc
+import pickle
+import time
+
+from compiler import astformat
+from compiler.lexer import FastLexer
+from compiler.parser import Parser
+from benchmarks.pipeline import generate_program, parse_size
+
+
+def timed(function):
+    gc.collect()
+    # Loading builds one object after the other, the cyclic collector is left out of every measurement alike
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        result = function()
+        return result, time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Compare the binary AST format with pickle.')
+    argparser.add_argument('--size', type=parse_size, default=parse_size('1MB'), help='program size, e.g. 4MB')
+    args = argparser.parse_args()
+
+    tree = Parser(FastLexer(generate_program(args.size), detect_records=True)).parse()
+    print('{:<22} {:>12} {:>10} {:>10} {:>10}'.format('format', 'bytes', 'dump s', 'load s', 'view s'))
+
+    for name, offsets in (('astformat', True), ('astformat (no offsets)', False)):
+        data, dump_seconds = timed(lambda: astformat.dumps(tree, offsets))
+        _, load_seconds = timed(lambda: astformat.loads(data))
+        _, view_seconds = timed(lambda: astformat.ASTView(data).root.children)
+        print('{:<22} {:>12} {:>10.4f} {:>10.4f} {:>10.4f}'.format(
+            name, len(data), dump_seconds, load_seconds, view_seconds))
+
+    data, dump_seconds = timed(lambda: pickle.dumps(tree, pickle.HIGHEST_PROTOCOL))
+    _, load_seconds = timed(lambda: pickle.loads(data))
+    print('{:<22} {:>12} {:>10.4f} {:>10.4f} {:>10}'.format('pickle', len(data), dump_seconds, load_seconds, '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+########################################################################################################################
+#   Incremental re-parsing benchmark:
+#
+#   Times Document.edit (compiler/incremental.py) against parsing the whole program again, on generated programs
+#   of the requested sizes. Two kinds of edit sessions:
+#       typing      edits one after the other at the same place: a number is typed over, a statement is inserted
+#       scattered   every edit at a random statement of the program, so the gap of the token offsets travels
+#   Each edit either changes a number or inserts a statement after a ';'. --check compares the tree and the tokens
+#   with a full parse of the final text.
+#
+#   Run from the repository root:
+#       python -m benchmarks.incremental --sizes 10KB,1MB --edits 200
+########################################################################################################################
+import argparse
+import random
+import re
+import sys
+import time
+
+from compiler import astformat
+from compiler.incremental import Document, lex
+from compiler.lexer import FastLexer
+from compiler.parser import Parser
+from benchmarks.pipeline import generate_program, parse_size
+
+NUMBER_PATTERN = re.compile(r'\b[0-9]+\b')
+SEMI_PATTERN = re.compile(';')
+
+SESSIONS = ('typing', 'scattered')
+
+
+# (offset, deleted, inserted) of the next edit. near is the offset to stay close to, None for anywhere.
+def next_edit(text, rng, near=None):
+    start = rng.randrange(len(text)) if near is None else max(near - 200, 0)
+    if rng.random() < 0.5:
+        m = NUMBER_PATTERN.search(text, start) or NUMBER_PATTERN.search(text)
+        return m.start(), m.end() - m.start(), str(rng.randrange(1000))
+    m = SEMI_PATTERN.search(text, start) or SEMI_PATTERN.search(text)
+    return m.end(), 0, ' x0 := x0 + {};'.format(rng.randrange(10))
+
+
+def run_session(text, session, edits, seed):
+    rng = random.Random(seed)
+    document = Document(text, detect_records=True)
+    near = len(text) // 2 if session == 'typing' else None
+    times = []
+    full = 0
+    for _ in range(edits):
+        offset, deleted, inserted = next_edit(document.text, rng, near)
+        start = time.perf_counter()
+        result = document.edit(offset, deleted, inserted)
+        times.append(time.perf_counter() - start)
+        full += result['block'] is None
+    start = time.perf_counter()
+    document.settle()
+    settle_seconds = time.perf_counter() - start
+    return document, times, full, settle_seconds
+
+
+def check(document):
+    tokens = lex(FastLexer(document.text, detect_records=True))
+    expected = [(token.type, token.value, token.start, token.end) for token in tokens]
+    if [(token.type, token.value, token.start, token.end) for token in document.tokens] != expected:
+        return False
+    tree = Parser(iter(tokens)).parse()
+    return astformat.dumps(document.tree) == astformat.dumps(tree)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Compare incremental re-parsing with parsing from scratch.')
+    argparser.add_argument('--sizes', default='10KB,100KB,1MB', help='comma separated program sizes, e.g. 1KB,10MB')
+    argparser.add_argument('--edits', type=int, default=100, help='edits per session')
+    argparser.add_argument('--seed', type=int, default=0)
+    argparser.add_argument('--check', action='store_true', help='compare the result with a full parse')
+    args = argparser.parse_args()
+
+    print('{:>10} {:<10} {:>12} {:>12} {:>12} {:>8} {:>10}'.format(
+        'size', 'session', 'full parse s', 'edit mean ms', 'edit max ms', 'full', 'settle ms'))
+    status = 0
+    for size in map(parse_size, args.sizes.split(',')):
+        text = generate_program(size, args.seed)
+        start = time.perf_counter()
+        Document(text, detect_records=True)
+        parse_seconds = time.perf_counter() - start
+        for session in SESSIONS:
+            document, times, full, settle_seconds = run_session(text, session, args.edits, args.seed)
+            print('{:>10} {:<10} {:>12.4f} {:>12.3f} {:>12.3f} {:>8} {:>10.3f}'.format(
+                size, session, parse_seconds, sum(times) / len(times) * 1000, max(times) * 1000, full,
+                settle_seconds * 1000))
+            if args.check and not check(document):
+                print('MISMATCH size={} session={}: the document differs from a full parse'.format(size, session))
+                status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,256 @@
+########################################################################################################################
+#   Pipeline benchmark:
+#
+#   Generates Micro-C programs of the requested sizes and times every phase of the pipeline on them on its own:
+#       lex         get_next_token until EOF                    tokens/s
+#       parse       Parser.parse on the lexed tokens            AST nodes/s
+#       traverse    Traversal.run, executing the program        AST nodes/s
+#       gendot      ASTVisualizer.gendot on the parsed tree     DOT bytes/s
+#   plus the peak memory of each phase. The programs mix declarations, arithmetic, records, arrays, if and while,
+#   every loop runs a fixed number of times, so the traversal time grows linearly with the size as well.
+#
+#   --output writes the results as JSON. --baseline compares them with such a file and exits with status 1 when a
+#   phase is slower, or needs more memory, than in the baseline by more than --threshold.
+#
+#   Run from the repository root:
+#       python -m benchmarks.pipeline --sizes 1KB,100KB,10MB --output pipeline.json
+#       python -m benchmarks.pipeline --sizes 1KB,100KB,10MB --baseline pipeline.json --threshold 0.1
+########################################################################################################################
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from compiler.lexer import Lexer, FastLexer
+from compiler.parser import Parser, Traversal
+from compiler.static import TT_EOF
+from genastdot import ASTVisualizer
+
+LEXERS = {
+    'lexer': Lexer,
+    'fast': FastLexer,
+}
+
+PHASES = ('lex', 'parse', 'traverse', 'gendot')
+
+# Phase -> what its throughput counts
+UNITS = {
+    'lex': 'tokens',
+    'parse': 'nodes',
+    'traverse': 'nodes',
+    'gendot': 'bytes',
+}
+
+SIZE_UNITS = {'KB': 1 << 10, 'MB': 1 << 20, 'GB': 1 << 30, 'B': 1}
+
+
+# One piece of the program. Every piece only reads the variables it declares, so the values stay small and no
+# piece depends on another one.
+def generate_piece(i, rng):
+    x, y, a, c = 'x{}'.format(i), 'y{}'.format(i), 'a{}'.format(i), 'c{}'.format(i)
+    statements = [
+        'int {}'.format(x),
+        'int {}'.format(y),
+        'int[4] {}'.format(a),
+        '{} := ({} + {}) * {} - {} / 2'.format(x, y, rng.randrange(100), rng.randrange(1, 10), rng.randrange(100)),
+        '{}[{}] := {} + {}'.format(a, rng.randrange(4), x, rng.randrange(10)),
+    ]
+    kind = i % 3
+    if kind == 0:
+        statements.append('{{int fst; int snd }} R; R.fst := {} * 2; R.snd := R.fst - {}[0]'.format(x, a))
+    elif kind == 1:
+        statements.append('if ({} > {} AND {} <= {}) {{ {} := {} - 1; {}[1] := {} }}'.format(
+            x, rng.randrange(100), y, rng.randrange(100), y, y, a, y))
+    else:
+        statements.append('{} := 0; while ({} < 3) {{ {} := {} + 1; {}[{}] := {}[{}] + {} }}'.format(
+            c, c, c, c, a, rng.randrange(4), a, rng.randrange(4), c))
+    return '; '.join(statements)
+
+
+def generate_program(size, seed=0):
+    rng = random.Random(seed)
+    pieces = []
+    length = 4
+    i = 0
+    while length < size:
+        piece = generate_piece(i, rng)
+        pieces.append(piece)
+        length += len(piece) + 3
+        i += 1
+    return '{ ' + ';\n'.join(pieces) + ' }'
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    for unit, factor in SIZE_UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+def lex(engine, text):
+    lexer = engine(text, detect_records=True)
+    tokens = []
+    token = lexer.get_next_token()
+    while token.type != TT_EOF:
+        tokens.append(token)
+        token = lexer.get_next_token()
+    tokens.append(token)
+    return tokens
+
+
+def count_nodes(tree):
+    count = 0
+
+    def pre(node):
+        nonlocal count
+        count += 1
+
+    Traversal.walk(tree, pre)
+    return count
+
+
+# Runs every phase, each on the output of the one before, and returns phase -> (result, seconds)
+def run_phases(engine, text):
+    results = {}
+
+    def timed(phase, function, *args):
+        gc.collect()
+        start = time.perf_counter()
+        result = function(*args)
+        results[phase] = result, time.perf_counter() - start
+        return result
+
+    tokens = timed('lex', lex, engine, text)
+    tree = timed('parse', lambda: Parser(tokens).parse())
+    timed('traverse', lambda: Traversal().run(tree))
+    timed('gendot', lambda: ASTVisualizer(None).gendot(tree))
+    return results
+
+
+# The peak memory of every phase, measured on a separate run so tracemalloc does not skew the timing. The input of
+# a phase is built before tracing starts, only what the phase itself allocates counts.
+def measure_memory(engine, text):
+    peaks = {}
+
+    def traced(phase, function):
+        gc.collect()
+        tracemalloc.start()
+        result = function()
+        _, peaks[phase] = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result
+
+    tokens = traced('lex', lambda: lex(engine, text))
+    tree = traced('parse', lambda: Parser(tokens).parse())
+    del tokens
+    traced('traverse', lambda: Traversal().run(tree))
+    traced('gendot', lambda: ASTVisualizer(None).gendot(tree))
+    return peaks
+
+
+def measure(engine, text, repeat, memory):
+    seconds = dict.fromkeys(PHASES)
+    counts = {}
+    for _ in range(repeat):
+        results = run_phases(engine, text)
+        for phase, (_, elapsed) in results.items():
+            seconds[phase] = elapsed if seconds[phase] is None else min(seconds[phase], elapsed)
+        counts = {
+            'lex': len(results['lex'][0]),
+            'parse': count_nodes(results['parse'][0]),
+            'gendot': len(results['gendot'][0].encode('utf-8')),
+        }
+        counts['traverse'] = counts['parse']
+        del results
+
+    peaks = measure_memory(engine, text) if memory else {}
+    phases = {}
+    for phase in PHASES:
+        phases[phase] = {
+            'seconds': round(seconds[phase], 6),
+            UNITS[phase]: counts[phase],
+            'per_second': round(counts[phase] / seconds[phase], 1) if seconds[phase] else None,
+            'peak_bytes': peaks.get(phase),
+        }
+    return phases
+
+
+# The (size, phase, what, baseline, current) of every regression by more than threshold (a fraction)
+def compare(baseline, results, threshold):
+    previous = {result['size']: result['phases'] for result in baseline['results']}
+    regressions = []
+    for result in results:
+        if result['size'] not in previous:
+            continue
+        for phase, current in result['phases'].items():
+            old = previous[result['size']].get(phase)
+            if old is None:
+                continue
+            if old['per_second'] and current['per_second'] and \
+                    current['per_second'] < old['per_second'] * (1 - threshold):
+                regressions.append((result['size'], phase, 'per_second', old['per_second'], current['per_second']))
+            if old['peak_bytes'] and current['peak_bytes'] and \
+                    current['peak_bytes'] > old['peak_bytes'] * (1 + threshold):
+                regressions.append((result['size'], phase, 'peak_bytes', old['peak_bytes'], current['peak_bytes']))
+    return regressions
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Measure the lexer, parser, traversal and DOT output.')
+    argparser.add_argument('--sizes', default='1KB,10KB,100KB,1MB',
+                           help='comma separated program sizes, e.g. 1KB,10MB,100MB')
+    argparser.add_argument('--lexer', choices=sorted(LEXERS), default='fast')
+    argparser.add_argument('--repeat', type=int, default=3, help='timed runs, the fastest one is reported')
+    argparser.add_argument('--seed', type=int, default=0)
+    argparser.add_argument('--no-memory', action='store_true', help='skip the peak memory runs')
+    argparser.add_argument('--output', default=None, help='write the results to this JSON file')
+    argparser.add_argument('--baseline', default=None, help='JSON file of an earlier run to compare with')
+    argparser.add_argument('--threshold', type=float, default=0.1,
+                           help='fraction a phase may be slower or bigger than in the baseline')
+    args = argparser.parse_args()
+
+    engine = LEXERS[args.lexer]
+    results = []
+    print('{:>10} {:<9} {:>10} {:>12} {:>14} {:>12}'.format(
+        'size', 'phase', 'seconds', 'count', 'per second', 'peak bytes'))
+    for size in map(parse_size, args.sizes.split(',')):
+        text = generate_program(size, args.seed)
+        phases = measure(engine, text, args.repeat, not args.no_memory)
+        del text
+        for phase, stats in phases.items():
+            print('{:>10} {:<9} {:>10.4f} {:>12} {:>14} {:>12}'.format(
+                size, phase, stats['seconds'], stats[UNITS[phase]],
+                '{:.0f} {}'.format(stats['per_second'] or 0, UNITS[phase]), str(stats['peak_bytes'])))
+        results.append({'size': size, 'phases': phases})
+
+    if args.output is not None:
+        report = {
+            'benchmark': 'pipeline',
+            'python': platform.python_version(),
+            'lexer': args.lexer,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(report, output, indent=1)
+
+    if args.baseline is not None:
+        with open(args.baseline, encoding='utf-8') as source:
+            baseline = json.load(source)
+        regressions = compare(baseline, results, args.threshold)
+        for size, phase, what, old, new in regressions:
+            print('REGRESSION size={} {} {}: {} -> {}'.format(size, phase, what, old, new))
+        if regressions:
+            return 1
+        print('No phase regressed by more than {:.0%}'.format(args.threshold))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+########################################################################################################################
+#   Incremental re-analysis benchmark:
+#
+#   Times IncrementalSolver.update (dataflow.py) against solving the analysis from scratch, on the program graph of
+#   a generated program (benchmarks/worklists.py) with the requested number of statements. Every update is one
+#   small edit of the graph, like the edit of one statement:
+#       change      an edge gets the action of another edge
+#       insert      an edge q -> q' is split into q -> n -> q' by a new node n, with the action of another edge
+#       delete      an edge q -> q' is replaced by a skip edge
+#       jump        an edge from a node to a node near it is added or removed again
+#       expression  an edge gets a new assignment, of the product of two right hand sides of the program, so the
+#                   analysis gets a fact it did not have (an expression that is new to available expressions)
+#       disconnect  the edges into a node (against the analysis: out of it) are removed, so that the extremal
+#                   node no longer reaches it
+#   The actions come from the program itself, plus a skip action and the new assignments. --check solves the edited graph from scratch
+#   after every update and compares the facts of every node.
+#
+#   Run from the repository root:
+#       python -m benchmarks.reanalysis --statements 30000 --updates 200 --analyses rd,lv,ae
+########################################################################################################################
+import argparse
+import random
+import sys
+import time
+from array import array
+
+from compiler.graph import ACTION_ASSIGN, ACTION_SKIP, Action, ProgramGraph, build_program_graph, expression_text
+from compiler.lexer import FastLexer, Token
+from compiler.parser import Assign, BinOp, Parser
+from compiler.static import TT_MUL
+from dataflow import ANALYSES, WORKLISTS, IncrementalSolver, solve
+from benchmarks.worklists import generate_program
+
+EDITS = ('change', 'insert', 'delete', 'jump', 'expression', 'disconnect')
+
+
+# The graph the solver has now, as a ProgramGraph of its live edges
+def current_graph(solver, graph, actions):
+    analysis = solver.analysis
+    sources, targets, action_ids = array('i'), array('i'), array('i')
+    for edge, action in enumerate(analysis.edge_actions):
+        if action is not None:
+            sources.append(solver.sources[edge])
+            targets.append(solver.targets[edge])
+            action_ids.append(action.id)
+    return ProgramGraph(solver.node_count, sources, targets, action_ids, actions, graph.names)
+
+
+def check(solver, graph, actions, analysis_name):
+    expected = solve(ANALYSES[analysis_name](current_graph(solver, graph, actions)), 'rr')
+    solution = solver.solution()
+    for node in range(solver.node_count):
+        if set(solution.facts(node)) != set(expected.facts(node)):
+            return node
+    return None
+
+
+# A new assignment left := right * right', from two assignments of the program, numbered after the actions
+def product_action(graph, actions, rng):
+    assignments = [action for action in graph.actions if action.kind == ACTION_ASSIGN]
+    first, second = rng.choice(assignments).node, rng.choice(assignments).node
+    node = Assign(first.left, BinOp(first.right, second.right, Token(TT_MUL, '*')), first.token)
+    text, _ = expression_text(node, graph.names)
+    action = Action(len(actions), ACTION_ASSIGN, None, node, False, text)
+    actions.append(action)
+    return action
+
+
+# Applies one random edit, the arguments of update
+def random_edit(solver, graph, actions, jumps, rng):
+    live = solver.analysis.edge_actions
+    while True:
+        edge = rng.randrange(len(live))
+        if live[edge] is not None:
+            break
+    action = actions[rng.randrange(len(actions))]
+    skip = actions[len(graph.actions)]
+    edit = rng.choice(EDITS)
+    if edit == 'change':
+        return {'changed': [(edge, action)]}
+    if edit == 'insert':
+        node = solver.add_node()
+        return {'removed': [edge], 'added': [(solver.sources[edge], live[edge], node),
+                                             (node, action, solver.targets[edge])]}
+    if edit == 'delete':
+        return {'changed': [(edge, skip)]}
+    if edit == 'expression':
+        return {'changed': [(edge, product_action(graph, actions, rng))]}
+    if edit == 'disconnect' and solver.incoming[solver.heads[edge]]:
+        return {'removed': list(solver.incoming[solver.heads[edge]])}
+    # A jump may have been split by an insert since
+    jumps[:] = [jump for jump in jumps if live[jump] is not None]
+    if jumps and rng.random() < 0.5:
+        return {'removed': [jumps.pop(rng.randrange(len(jumps)))]}
+    source = solver.sources[edge]
+    target = min(max(source + rng.randrange(-20, 21), 0), graph.node_count - 1)
+    return {'added': [(source, skip, target)]}
+
+
+def run(graph, analysis_name, worklist, updates, seed, checking):
+    rng = random.Random(seed)
+    # Interned like the graph builder does, with the next action id
+    actions = graph.actions + [Action(len(graph.actions), ACTION_SKIP, None, None, False, 'skip')]
+
+    start = time.perf_counter()
+    solver = IncrementalSolver(ANALYSES[analysis_name](graph), worklist)
+    solve_seconds = time.perf_counter() - start
+
+    times = []
+    transfers = 0
+    jumps = []
+    for _ in range(updates):
+        edit = random_edit(solver, graph, actions, jumps, rng)
+        start = time.perf_counter()
+        added = solver.update(**edit)
+        times.append(time.perf_counter() - start)
+        transfers += solver.stats['transfers']
+        if len(edit.get('added', ())) == 1:
+            jumps.extend(added)
+        if checking:
+            node = check(solver, graph, actions, analysis_name)
+            if node is not None:
+                return solve_seconds, times, transfers, node
+    return solve_seconds, times, transfers, None
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Compare incremental re-analysis with solving from scratch.')
+    argparser.add_argument('--statements', type=int, default=30000, help='assignments in the program')
+    argparser.add_argument('--loops', type=int, default=200, help='loop nests')
+    argparser.add_argument('--analyses', default=','.join(ANALYSES), help='comma separated, from: ' +
+                           ', '.join(ANALYSES))
+    argparser.add_argument('--worklist', choices=sorted(WORKLISTS), default='rr')
+    argparser.add_argument('--updates', type=int, default=100, help='edits of the program graph')
+    argparser.add_argument('--seed', type=int, default=0)
+    argparser.add_argument('--check', action='store_true', help='compare every update with a full solve')
+    args = argparser.parse_args()
+
+    text = generate_program(args.statements, args.loops, seed=args.seed)
+    graph = build_program_graph(Parser(FastLexer(text)).parse())
+    print('{} nodes, {} edges'.format(graph.node_count, graph.edge_count))
+    print('{:<4} {:>10} {:>14} {:>14} {:>14} {:>16}'.format(
+        'ana', 'solve s', 'update mean ms', 'update p50 ms', 'update max ms', 'transfers/update'))
+    status = 0
+    for analysis_name in args.analyses.split(','):
+        solve_seconds, times, transfers, mismatch = run(graph, analysis_name, args.worklist, args.updates,
+                                                        args.seed, args.check)
+        ordered = sorted(times)
+        print('{:<4} {:>10.3f} {:>14.3f} {:>14.3f} {:>14.3f} {:>16.1f}'.format(
+            analysis_name, solve_seconds, sum(times) / len(times) * 1000, ordered[len(ordered) // 2] * 1000,
+            ordered[-1] * 1000, transfers / len(times)))
+        if mismatch is not None:
+            print('MISMATCH analysis={} update={}: the facts of q{} differ from a full solve'.format(
+                analysis_name, len(times), mismatch))
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
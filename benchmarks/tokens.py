@@ -0,0 +1,76 @@
+########################################################################################################################
+#   Token memory benchmark:
+#
+#   Lexes a generated Micro-C program with the Token based engines and with the array backed TokenBuffer, and
+#   reports the bytes kept alive per token and the tokens lexed per second.
+#
+#   Run from the repository root:
+#       python -m benchmarks.tokens --statements 100000
+########################################################################################################################
+import argparse
+import gc
+import time
+import tracemalloc
+
+from compiler.lexer import Lexer, FastLexer
+from compiler.tokenbuffer import TokenBuffer
+
+
+# Every statement uses fresh identifiers, so nothing can be shared between them
+def generate_program(statements):
+    lines = ['{ int a0']
+    for i in range(1, statements):
+        lines.append('; a{} := a{} * {} + (b{} - {})'.format(i, i - 1, i, i, i % 97))
+    lines.append(' }')
+    return '\n'.join(lines)
+
+
+def lex_tokens(engine):
+    def lex(text):
+        tokens, error = engine(text).make_tokens()
+        if error:
+            raise error
+        return tokens
+    return lex
+
+
+ENGINES = [
+    ('Lexer (Token)', lex_tokens(Lexer)),
+    ('FastLexer (Token)', lex_tokens(FastLexer)),
+    ('TokenBuffer', TokenBuffer.from_text),
+]
+
+
+def measure(lex, text):
+    gc.collect()
+    start = time.perf_counter()
+    tokens = lex(text)
+    seconds = time.perf_counter() - start
+    count = len(tokens)
+    del tokens
+
+    # Memory is measured on a separate run so tracemalloc does not skew the timing
+    gc.collect()
+    tracemalloc.start()
+    tokens = lex(text)
+    kept, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tokens
+    return count, seconds, kept
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Compare memory and speed of the token representations.')
+    argparser.add_argument('--statements', type=int, default=50000, help='statements in the generated program')
+    args = argparser.parse_args()
+
+    text = generate_program(args.statements)
+    print('program: {} bytes'.format(len(text)))
+    print('{:<20} {:>10} {:>15} {:>15}'.format('engine', 'tokens', 'bytes/token', 'tokens/sec'))
+    for name, lex in ENGINES:
+        count, seconds, kept = measure(lex, text)
+        print('{:<20} {:>10} {:>15.1f} {:>15,.0f}'.format(name, count, kept / count, count / seconds))
+
+
+if __name__ == '__main__':
+    main()
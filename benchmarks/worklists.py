@@ -0,0 +1,168 @@
+########################################################################################################################
+#   Worklist benchmark:
+#
+#   Generates Micro-C programs from a few knobs, builds their program graphs and solves every analysis of
+#   dataflow.py with every worklist strategy, reporting the wall time, the worklist operations (inserts + extracts),
+#   the transfer function evaluations and the peak memory of each run.
+#
+#   The program has `loops` loop nests of `depth` nested while loops, every loop body holds `branching` if
+#   statements, and `statements` assignments are spread evenly over all the bodies. A knob given as a comma
+#   separated list is swept, every combination is one configuration.
+#
+#   Run from the repository root:
+#       python -m benchmarks.worklists --statements 2000 --loops 20 --depth 1,3,6 --output worklists.json
+########################################################################################################################
+import argparse
+import gc
+import itertools
+import json
+import platform
+import random
+import time
+import tracemalloc
+
+from compiler.graph import build_program_graph
+from compiler.lexer import FastLexer
+from compiler.parser import Parser
+from dataflow import ANALYSES, WORKLISTS, solve
+
+VARIABLES = 8
+KNOBS = ('statements', 'loops', 'depth', 'branching')
+
+
+class Block:
+
+    def __init__(self, header=None):
+        # header is the 'while (...)' or 'if (...)' line, None for the program itself
+        self.header = header
+        self.blocks = []
+        self.assignments = 0
+
+
+def generate_program(statements=1000, loops=10, depth=2, branching=2, seed=0):
+    rng = random.Random(seed)
+
+    def condition(keyword):
+        return '{} (v{} < {})'.format(keyword, rng.randrange(VARIABLES), rng.randrange(100))
+
+    program = Block()
+    bodies = [program]
+    for _ in range(loops):
+        parent = program
+        for _ in range(depth):
+            loop = Block(condition('while'))
+            parent.blocks.append(loop)
+            bodies.append(loop)
+            for _ in range(branching):
+                branch = Block(condition('if'))
+                loop.blocks.append(branch)
+                bodies.append(branch)
+            parent = loop
+    for i in range(statements):
+        bodies[i % len(bodies)].assignments += 1
+
+    def assignment():
+        target, left, right = (rng.randrange(VARIABLES) for _ in range(3))
+        operator = rng.choice('+-*')
+        if rng.random() < 0.3:
+            return 'v{} := v{} {} {}'.format(target, left, operator, rng.randrange(10))
+        return 'v{} := v{} {} v{}'.format(target, left, operator, right)
+
+    def statements_of(block):
+        parts = [assignment() for _ in range(block.assignments)]
+        parts.extend('{} {{ {} }}'.format(nested.header, '; '.join(statements_of(nested))) for nested in block.blocks)
+        return parts
+
+    declarations = ['int v{}'.format(i) for i in range(VARIABLES)]
+    return '{ ' + '; '.join(declarations + statements_of(program)) + ' }'
+
+
+def measure(analysis, worklist, repeat):
+    seconds = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        solution = solve(analysis, worklist)
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    # Memory is measured on a separate run so tracemalloc does not skew the timing
+    gc.collect()
+    tracemalloc.start()
+    solve(analysis, worklist)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = solution.stats
+    return {
+        'seconds': round(seconds, 6),
+        'worklist_operations': stats['inserts'] + stats['extracts'],
+        'transfers': stats['transfers'],
+        'peak_bytes': peak,
+    }
+
+
+def run(config, analyses, worklists, repeat, seed):
+    text = generate_program(seed=seed, **config)
+    start = time.perf_counter()
+    graph = build_program_graph(Parser(FastLexer(text)).parse())
+    build_seconds = time.perf_counter() - start
+
+    results = []
+    for analysis_name in analyses:
+        analysis = ANALYSES[analysis_name](graph)
+        for worklist in worklists:
+            result = dict(config, analysis=analysis_name, worklist=worklist, nodes=graph.node_count,
+                          edges=graph.edge_count, build_seconds=round(build_seconds, 6))
+            result.update(measure(analysis, worklist, repeat))
+            results.append(result)
+    return results
+
+
+def int_list(text):
+    return [int(value) for value in text.split(',')]
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Compare the worklist strategies on generated programs.')
+    argparser.add_argument('--statements', type=int_list, default=[2000], help='assignments in the program')
+    argparser.add_argument('--loops', type=int_list, default=[20], help='loop nests')
+    argparser.add_argument('--depth', type=int_list, default=[3], help='while loops nested in every loop nest')
+    argparser.add_argument('--branching', type=int_list, default=[2], help='if statements in every loop body')
+    argparser.add_argument('--analyses', default=','.join(ANALYSES), help='comma separated, from: ' +
+                           ', '.join(ANALYSES))
+    argparser.add_argument('--worklists', default=','.join(WORKLISTS), help='comma separated, from: ' +
+                           ', '.join(WORKLISTS))
+    argparser.add_argument('--repeat', type=int, default=3, help='timed runs, the fastest one is reported')
+    argparser.add_argument('--seed', type=int, default=0)
+    argparser.add_argument('--output', default=None, help='write the results to this JSON file')
+    args = argparser.parse_args()
+
+    analyses = args.analyses.split(',')
+    worklists = args.worklists.split(',')
+    results = []
+    print('{:<30} {:<4} {:<5} {:>10} {:>12} {:>12} {:>12}'.format(
+        'configuration', 'ana', 'wl', 'seconds', 'wl ops', 'transfers', 'peak bytes'))
+    for values in itertools.product(*(getattr(args, knob) for knob in KNOBS)):
+        config = dict(zip(KNOBS, values))
+        label = ' '.join('{}={}'.format(knob[0], value) for knob, value in config.items())
+        for result in run(config, analyses, worklists, args.repeat, args.seed):
+            print('{:<30} {:<4} {:<5} {:>10.4f} {:>12} {:>12} {:>12}'.format(
+                label, result['analysis'], result['worklist'], result['seconds'], result['worklist_operations'],
+                result['transfers'], result['peak_bytes']))
+            results.append(result)
+
+    if args.output is not None:
+        report = {
+            'benchmark': 'worklists',
+            'python': platform.python_version(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(report, output, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+########################################################################################################################
+#   Analysis client:
+#
+#   The thin command line side of daemon.py. It only imports what it needs to send one JSON-RPC request over the
+#   daemon's Unix socket and print the answer, so a request costs the Python startup plus the work itself,
+#   without importing or warming up the compiler.
+#
+#       python daemon.py &
+#       python client.py tokenize program.mc
+#       python client.py gendot program.mc --max-nodes 200 | dot -Tsvg -o ast.svg
+#       python client.py analyze program.mc --analysis lv --worklist rr
+#       python client.py shutdown
+#
+#   The protocol is JSON-RPC 2.0 with one request or response per line (newline delimited JSON).
+########################################################################################################################
+import argparse
+import json
+import os
+import socket
+import sys
+
+DEFAULT_SOCKET = os.path.join(os.environ.get('TMPDIR', '/tmp'), 'microc-analysis-{}.sock'.format(os.getuid()))
+
+# Methods that take no source text
+CONTROL_METHODS = {'shutdown', 'stats'}
+
+
+class RPCError(Exception):
+
+    def __init__(self, code, message):
+        super().__init__('{} ({})'.format(message, code))
+        self.code = code
+        self.message = message
+
+
+class Client:
+
+    def __init__(self, path=DEFAULT_SOCKET):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self.file = self.socket.makefile('rb')
+        self.next_id = 1
+
+    def call(self, method, **params):
+        request = {'jsonrpc': '2.0', 'id': self.next_id, 'method': method, 'params': params}
+        self.next_id += 1
+        self.socket.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        line = self.file.readline()
+        if not line:
+            raise RPCError(-32000, 'The daemon closed the connection')
+        response = json.loads(line)
+        if 'error' in response:
+            raise RPCError(response['error']['code'], response['error']['message'])
+        return response['result']
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Send a request to the Micro-C analysis daemon.')
+    argparser.add_argument('method', help='tokenize, parse, gendot, analyze, stats or shutdown')
+    argparser.add_argument('source', nargs='?', default='-', help='Micro-C file (default: standard input)')
+    argparser.add_argument('--socket', default=DEFAULT_SOCKET)
+    argparser.add_argument('--records', action='store_true', help='lex { ... } R record declarations')
+    argparser.add_argument('--analysis', default=None, help='analyze: rd, lv or ae')
+    argparser.add_argument('--worklist', default=None, help='analyze: lifo, fifo, rr or scc')
+    argparser.add_argument('--max-nodes', type=int, default=None, help='gendot: draw at most this many nodes')
+    argparser.add_argument('--max-depth', type=int, default=None, help='gendot: draw this many levels')
+    argparser.add_argument('--param', action='append', default=[], metavar='NAME=JSON',
+                           help='any other parameter, the value as JSON')
+    args = argparser.parse_args()
+
+    params = {}
+    if args.method not in CONTROL_METHODS:
+        if args.source == '-':
+            params['text'] = sys.stdin.read()
+        else:
+            with open(args.source, encoding='utf-8') as source:
+                params['text'] = source.read()
+        if args.records:
+            params['detect_records'] = True
+        for name in ('analysis', 'worklist', 'max_nodes', 'max_depth'):
+            if getattr(args, name) is not None:
+                params[name] = getattr(args, name)
+    for param in args.param:
+        name, _, value = param.partition('=')
+        params[name] = json.loads(value)
+
+    try:
+        with Client(args.socket) as client:
+            result = client.call(args.method, **params)
+    except (OSError, RPCError) as error:
+        sys.stderr.write('{}\n'.format(error))
+        return 1
+
+    if args.method == 'gendot':
+        sys.stdout.write(result['dot'] + '\n')
+    else:
+        sys.stdout.write(json.dumps(result) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,498 @@
+########################################################################################################################
+#   Binary AST format:
+#
+#   A compact, versioned encoding of the trees built by compiler/parser.py, for handing them between pipeline
+#   stages and processes. All fixed width numbers are little endian.
+#
+#       header          magic b'MCAST\0', version byte, flags byte, string count (u32), node count (u32)
+#       string offsets  u32 * (string count + 1), where each string starts and ends in the string data
+#       string data     the interned strings (UTF-8), padded to a multiple of 4 bytes
+#       node offsets    u32 * node count, where each node record starts in the records
+#       records         one record per node, every number in it a varint (7 bits per byte, low bits first)
+#
+#   A record is the node kind (KINDS) followed by its fields. A child is stored as the distance back to its own
+#   record; children are written before their parent, so that distance is always positive and usually small, and
+#   the root is the last record. Compound and Record store their number of children first, ArrayDeclaration its
+#   size after its children. A token is its type and its value (string index * 2, or integer * 2 + 1) and, when the
+#   OFFSETS flag is set, start + 1 (0 for unknown) and its length. The shared ZERO_NODE and NO_OP are stored once.
+#   The slots the SlotResolver fills in are left out, they are resolved again when the tree is run.
+#
+#       data = dumps(tree)
+#       tree = loads(data)              rebuilds the nodes
+#       view = ASTView(data)            reads nodes straight out of the buffer, on demand
+#       view = open_view(path)          the same over an mmap of a file written by dump()
+#
+#   loads decodes every varint of the records with one regular expression pass and builds the nodes from that list.
+#   An ASTView only decodes the header; node and string offsets are memoryview casts of the buffer, so opening a
+#   view costs the same for any size of tree and nothing is copied.
+########################################################################################################################
+import gc
+import mmap
+import re
+import struct
+import sys
+
+from compiler.lexer import Token
+from compiler.parser import (Compound, Record, Assign, BinOp, Condition, UnaryOp, Variable, Integer, Type, ZeroNode,
+                             NoOp, VariableDeclaration, ArrayDeclaration, ArrayElement, If, While, ZERO_NODE, NO_OP,
+                             Traversal)
+
+MAGIC = b'MCAST\0'
+VERSION = 1
+HEADER = struct.Struct('<6sBBII')
+
+# Flags
+OFFSETS = 1
+
+# Node kinds, the first byte of every record
+KIND_COMPOUND = 0
+KIND_RECORD = 1
+KIND_ASSIGN = 2
+KIND_BINOP = 3
+KIND_CONDITION = 4
+KIND_UNARYOP = 5
+KIND_VARIABLE = 6
+KIND_INTEGER = 7
+KIND_TYPE = 8
+KIND_ZERO = 9
+KIND_NOOP = 10
+KIND_DECLARATION = 11
+KIND_ARRAY_DECLARATION = 12
+KIND_ARRAY_ELEMENT = 13
+KIND_IF = 14
+KIND_WHILE = 15
+
+KINDS = {
+    Compound: KIND_COMPOUND,
+    Record: KIND_RECORD,
+    Assign: KIND_ASSIGN,
+    BinOp: KIND_BINOP,
+    Condition: KIND_CONDITION,
+    UnaryOp: KIND_UNARYOP,
+    Variable: KIND_VARIABLE,
+    Integer: KIND_INTEGER,
+    Type: KIND_TYPE,
+    ZeroNode: KIND_ZERO,
+    NoOp: KIND_NOOP,
+    VariableDeclaration: KIND_DECLARATION,
+    ArrayDeclaration: KIND_ARRAY_DECLARATION,
+    ArrayElement: KIND_ARRAY_ELEMENT,
+    If: KIND_IF,
+    While: KIND_WHILE,
+}
+NODE_CLASSES = {kind: node_class for node_class, kind in KINDS.items()}
+
+# Kinds whose record is (children...) with a fixed number of children, and the ones that also carry a token
+FIXED_CHILDREN = {
+    KIND_ASSIGN: 2, KIND_BINOP: 2, KIND_CONDITION: 2, KIND_UNARYOP: 1, KIND_DECLARATION: 2,
+    KIND_ARRAY_DECLARATION: 2, KIND_ARRAY_ELEMENT: 2, KIND_IF: 2, KIND_WHILE: 2,
+}
+WITH_TOKEN = {KIND_ASSIGN, KIND_BINOP, KIND_CONDITION, KIND_UNARYOP, KIND_VARIABLE, KIND_INTEGER, KIND_TYPE}
+
+# One varint: any continuation bytes, then the last byte
+VARINT_PATTERN = re.compile(rb'[\x80-\xff]*[\x00-\x7f]')
+
+LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+def write_varint(out, value):
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(data):
+    value = 0
+    for shift, byte in enumerate(data):
+        value |= (byte & 0x7f) << (7 * shift)
+    return value
+
+
+def read_varint(buffer, pos):
+    value = shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def u32_array(buffer, start, count):
+    view = memoryview(buffer)[start:start + 4 * count].cast('I')
+    if LITTLE_ENDIAN:
+        return view
+    values = view.tolist()
+    return [int.from_bytes(value.to_bytes(4, sys.byteorder), 'little') for value in values]
+
+
+class Encoder:
+
+    def __init__(self, offsets=True):
+        self.offsets = offsets
+        self.strings = []
+        self.string_ids = {}
+        self.records = bytearray()
+        self.node_offsets = []
+        # id(node) -> index of its record
+        self.index = {}
+
+    def string(self, text):
+        string_id = self.string_ids.get(text)
+        if string_id is None:
+            string_id = self.string_ids[text] = len(self.strings)
+            self.strings.append(text)
+        return string_id
+
+    def token(self, token):
+        out = self.records
+        write_varint(out, self.string(token.type))
+        value = token.value
+        if type(value) is int:
+            write_varint(out, value * 2 + 1)
+        else:
+            write_varint(out, self.string(value) * 2)
+        if self.offsets:
+            if token.start is None:
+                out.append(0)
+            else:
+                write_varint(out, token.start + 1)
+                write_varint(out, token.end - token.start)
+
+    def add(self, node):
+        if id(node) in self.index:
+            return
+        index = len(self.node_offsets)
+        out = self.records
+        self.node_offsets.append(len(out))
+        kind = KINDS.get(type(node))
+        if kind is None:
+            raise Exception('No binary encoding for {}'.format(type(node).__name__))
+        out.append(kind)
+        if kind == KIND_COMPOUND or kind == KIND_RECORD:
+            write_varint(out, len(node.children))
+        for child in node.child_nodes():
+            write_varint(out, index - self.index[id(child)])
+        if kind in WITH_TOKEN:
+            self.token(node.token)
+        elif kind == KIND_ARRAY_DECLARATION:
+            write_varint(out, node.size)
+        self.index[id(node)] = index
+
+    def encode(self, tree):
+        # Post order, so every child has its record before its parent
+        Traversal.walk(tree, post=self.add)
+
+        blobs = [text.encode('utf-8', 'surrogatepass') for text in self.strings]
+        string_offsets = [0]
+        for blob in blobs:
+            string_offsets.append(string_offsets[-1] + len(blob))
+        string_data = b''.join(blobs)
+        string_data += b'\0' * (-len(string_data) % 4)
+
+        flags = OFFSETS if self.offsets else 0
+        return b''.join((
+            HEADER.pack(MAGIC, VERSION, flags, len(self.strings), len(self.node_offsets)),
+            struct.pack('<{}I'.format(len(string_offsets)), *string_offsets),
+            string_data,
+            struct.pack('<{}I'.format(len(self.node_offsets)), *self.node_offsets),
+            self.records,
+        ))
+
+
+# The tree as bytes. Without offsets the tokens lose their start / end, which makes the data smaller and lets
+# loads share one Token between all the nodes with the same token.
+def dumps(tree, offsets=True):
+    return Encoder(offsets).encode(tree)
+
+
+def dump(tree, file, offsets=True):
+    file.write(dumps(tree, offsets))
+
+
+class Layout:
+    # Where the parts of an encoded tree are
+
+    def __init__(self, buffer):
+        if len(buffer) < HEADER.size:
+            raise Exception('Not a Micro-C AST: too short')
+        magic, version, flags, string_count, node_count = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise Exception('Not a Micro-C AST')
+        if version != VERSION:
+            raise Exception('Micro-C AST version {} is not supported (expected {})'.format(version, VERSION))
+        self.offsets = bool(flags & OFFSETS)
+        self.string_count = string_count
+        self.node_count = node_count
+        self.string_offsets_start = HEADER.size
+        self.string_data_start = self.string_offsets_start + 4 * (string_count + 1)
+        string_bytes = struct.unpack_from('<I', buffer, self.string_data_start - 4)[0]
+        self.node_offsets_start = self.string_data_start + string_bytes + (-string_bytes % 4)
+        self.records_start = self.node_offsets_start + 4 * node_count
+        if self.records_start > len(buffer):
+            raise Exception('Micro-C AST is truncated')
+
+
+def load_strings(buffer, layout):
+    offsets = struct.unpack_from('<{}I'.format(layout.string_count + 1), buffer, layout.string_offsets_start)
+    data = bytes(buffer[layout.string_data_start:layout.string_data_start + offsets[-1]])
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8', 'surrogatepass') for i in range(layout.string_count)]
+
+
+# Rebuilds the tree from bytes (or any buffer) written by dumps
+def loads(data):
+    layout = Layout(data)
+    strings = load_strings(data, layout)
+    records = bytes(data[layout.records_start:])
+    # Nearly every number fits in three bytes (offsets up to 2 MB), those are decoded inline
+    values = [item[0] if len(item) == 1 else
+              item[0] & 0x7f | item[1] << 7 if len(item) == 2 else
+              item[0] & 0x7f | (item[1] & 0x7f) << 7 | item[2] << 14 if len(item) == 3 else
+              decode_varint(item) for item in VARINT_PATTERN.findall(records)]
+    next_value = iter(values).__next__
+    with_offsets = layout.offsets
+    shared_tokens = {}
+
+    def token():
+        token_type = strings[next_value()]
+        value = next_value()
+        value = value >> 1 if value & 1 else strings[value >> 1]
+        if with_offsets:
+            start = next_value()
+            if start:
+                start -= 1
+                return Token(token_type, value, start, start + next_value())
+            return Token(token_type, value)
+        key = token_type, value
+        shared = shared_tokens.get(key)
+        if shared is None:
+            shared = shared_tokens[key] = Token(token_type, value)
+        return shared
+
+    nodes = []
+    append = nodes.append
+    # Building a tree is one allocation after the other, the cyclic collector would run over it again and again
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for index in range(layout.node_count):
+            kind = next_value()
+            if kind == KIND_VARIABLE:
+                append(Variable(token()))
+            elif kind == KIND_INTEGER:
+                append(Integer(token()))
+            elif kind == KIND_BINOP or kind == KIND_ASSIGN or kind == KIND_CONDITION:
+                left = nodes[index - next_value()]
+                right = nodes[index - next_value()]
+                append(NODE_CLASSES[kind](left, right, token()))
+            elif kind == KIND_COMPOUND:
+                node = Compound()
+                node.children = [nodes[index - next_value()] for _ in range(next_value())]
+                append(node)
+            elif kind == KIND_DECLARATION:
+                type_node = nodes[index - next_value()]
+                append(VariableDeclaration(type_node, nodes[index - next_value()]))
+            elif kind == KIND_TYPE:
+                append(Type(token()))
+            elif kind == KIND_ARRAY_ELEMENT:
+                var_node = nodes[index - next_value()]
+                append(ArrayElement(var_node, nodes[index - next_value()]))
+            elif kind == KIND_IF or kind == KIND_WHILE:
+                condition = nodes[index - next_value()]
+                append(NODE_CLASSES[kind](condition, nodes[index - next_value()]))
+            elif kind == KIND_UNARYOP:
+                expression = nodes[index - next_value()]
+                append(UnaryOp(token(), expression))
+            elif kind == KIND_ARRAY_DECLARATION:
+                type_node = nodes[index - next_value()]
+                var_node = nodes[index - next_value()]
+                append(ArrayDeclaration(type_node, var_node, next_value()))
+            elif kind == KIND_RECORD:
+                append(Record([nodes[index - next_value()] for _ in range(next_value())]))
+            elif kind == KIND_ZERO:
+                append(ZERO_NODE)
+            elif kind == KIND_NOOP:
+                append(NO_OP)
+            else:
+                raise Exception('Unknown node kind {} in Micro-C AST'.format(kind))
+    finally:
+        if gc_enabled:
+            gc.enable()
+    if not nodes:
+        raise Exception('Micro-C AST has no nodes')
+    return nodes[-1]
+
+
+def load(file):
+    return loads(file.read())
+
+
+########################################################################################################################
+#   ASTView:
+#
+#   Read-only access to an encoded tree without building it. view.root is a NodeView; a NodeView decodes its own
+#   record when it is asked for its children, token or size, and build() turns it (and everything below it) into
+#   ordinary nodes. Strings are decoded once, the first time they are needed.
+########################################################################################################################
+
+class ViewToken:
+    __slots__ = ('type', 'value', 'start', 'end')
+
+    def __init__(self, type, value, start=None, end=None):
+        self.type = type
+        self.value = value
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return 'Token({}, {})'.format(self.type, repr(self.value))
+
+
+class NodeView:
+    __slots__ = ('view', 'index')
+
+    def __init__(self, view, index):
+        self.view = view
+        self.index = index
+
+    @property
+    def kind(self):
+        return self.view.buffer[self.view.records_start + self.view.node_offsets[self.index]]
+
+    @property
+    def node_class(self):
+        return NODE_CLASSES[self.kind]
+
+    @property
+    def children(self):
+        return tuple(NodeView(self.view, child) for child in self.view.record(self.index)[1])
+
+    @property
+    def token(self):
+        return self.view.record(self.index)[2]
+
+    @property
+    def value(self):
+        return self.view.record(self.index)[2].value
+
+    # The number of elements of an ArrayDeclaration
+    @property
+    def size(self):
+        return self.view.record(self.index)[3]
+
+    def build(self):
+        return self.view.build(self.index)
+
+    def __repr__(self):
+        return 'NodeView({}, {})'.format(self.node_class.__name__, self.index)
+
+
+class ASTView:
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        layout = Layout(buffer)
+        self.with_offsets = layout.offsets
+        self.node_count = layout.node_count
+        self.records_start = layout.records_start
+        self.string_offsets = u32_array(buffer, layout.string_offsets_start, layout.string_count + 1)
+        self.string_data_start = layout.string_data_start
+        self.node_offsets = u32_array(buffer, layout.node_offsets_start, layout.node_count)
+        self.strings = {}
+        if self.node_count == 0:
+            raise Exception('Micro-C AST has no nodes')
+
+    @property
+    def root(self):
+        return NodeView(self, self.node_count - 1)
+
+    def node(self, index):
+        return NodeView(self, index)
+
+    def string(self, string_id):
+        text = self.strings.get(string_id)
+        if text is None:
+            start = self.string_data_start + self.string_offsets[string_id]
+            end = self.string_data_start + self.string_offsets[string_id + 1]
+            text = self.strings[string_id] = bytes(self.buffer[start:end]).decode('utf-8', 'surrogatepass')
+        return text
+
+    # (kind, child indices, token or None, size or None) of a node
+    def record(self, index):
+        buffer = self.buffer
+        pos = self.records_start + self.node_offsets[index]
+        kind = buffer[pos]
+        pos += 1
+        if kind == KIND_COMPOUND or kind == KIND_RECORD:
+            count, pos = read_varint(buffer, pos)
+        else:
+            count = FIXED_CHILDREN.get(kind, 0)
+        children = []
+        for _ in range(count):
+            distance, pos = read_varint(buffer, pos)
+            children.append(index - distance)
+        token = size = None
+        if kind in WITH_TOKEN:
+            token_type, pos = read_varint(buffer, pos)
+            value, pos = read_varint(buffer, pos)
+            value = value >> 1 if value & 1 else self.string(value >> 1)
+            token = ViewToken(self.string(token_type), value)
+            if self.with_offsets:
+                start, pos = read_varint(buffer, pos)
+                if start:
+                    length, pos = read_varint(buffer, pos)
+                    token.start = start - 1
+                    token.end = start - 1 + length
+        elif kind == KIND_ARRAY_DECLARATION:
+            size, pos = read_varint(buffer, pos)
+        return kind, children, token, size
+
+    # The subtree at index as ordinary nodes
+    def build(self, index):
+        built = {}
+        # (index, children pushed)
+        stack = [(index, False)]
+        while stack:
+            node_index, ready = stack.pop()
+            if node_index in built:
+                continue
+            kind, children, token, size = self.record(node_index)
+            if not ready:
+                stack.append((node_index, True))
+                stack.extend((child, False) for child in reversed(children))
+                continue
+            children = [built[child] for child in children]
+            if token is not None:
+                token = Token(token.type, token.value, token.start, token.end)
+            if kind == KIND_COMPOUND:
+                node = Compound()
+                node.children = children
+            elif kind == KIND_RECORD:
+                node = Record(children)
+            elif kind in (KIND_ASSIGN, KIND_BINOP, KIND_CONDITION):
+                node = NODE_CLASSES[kind](children[0], children[1], token)
+            elif kind == KIND_UNARYOP:
+                node = UnaryOp(token, children[0])
+            elif kind in (KIND_VARIABLE, KIND_INTEGER, KIND_TYPE):
+                node = NODE_CLASSES[kind](token)
+            elif kind == KIND_ZERO:
+                node = ZERO_NODE
+            elif kind == KIND_NOOP:
+                node = NO_OP
+            elif kind == KIND_ARRAY_DECLARATION:
+                node = ArrayDeclaration(children[0], children[1], size)
+            elif kind in FIXED_CHILDREN:
+                node = NODE_CLASSES[kind](children[0], children[1])
+            else:
+                raise Exception('Unknown node kind {} in Micro-C AST'.format(kind))
+            built[node_index] = node
+        return built[index]
+
+
+# A view over a file written by dump(), mapped into memory instead of read
+def open_view(path):
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return ASTView(mapped)
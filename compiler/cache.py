@@ -0,0 +1,155 @@
+########################################################################################################################
+#   ASTCache:
+#
+#   An on-disk cache in front of Parser.parse(). Entries are pickled Compound trees stored in one directory, named
+#   after the sha256 of the source text together with a version stamp of the compiler sources (lexer, parser and
+#   static), so changing the grammar makes every old entry unreachable. Those are removed when the cache is opened.
+#
+#   The total size of the entries is capped: when a new entry does not fit, the least recently used ones are
+#   evicted. A hit refreshes the modification time of its file, which is what orders the entries between runs.
+########################################################################################################################
+import gc
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+from compiler import lexer, parser, static
+from compiler.lexer import FastLexer
+from compiler.parser import Parser
+
+ENTRY_SUFFIX = '.ast'
+
+
+def grammar_version():
+    digest = hashlib.sha256()
+    for module in (lexer, parser, static):
+        with open(module.__file__, 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()[:16]
+
+
+GRAMMAR_VERSION = grammar_version()
+
+
+class ASTCache:
+
+    def __init__(self, directory='.ast_cache', max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> size in bytes, least recently used first
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    # Reads the existing entries in least recently used order and drops the ones from other grammar versions
+    def load(self):
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            if not name.startswith(GRAMMAR_VERSION):
+                os.remove(path)
+                continue
+            info = os.stat(path)
+            found.append((info.st_mtime, name[:-len(ENTRY_SUFFIX)], info.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.total_bytes += size
+
+    def key(self, text, detect_records=False):
+        digest = hashlib.sha256(text.encode('utf-8', 'surrogatepass'))
+        digest.update(b'R' if detect_records else b'-')
+        return GRAMMAR_VERSION + '-' + digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    # Parser(FastLexer(text)).parse(), answered from the cache when the same text was parsed before
+    def parse(self, text, detect_records=False):
+        key = self.key(text, detect_records)
+        tree = self.get(key)
+        if tree is not None:
+            return tree
+
+        tree = Parser(FastLexer(text, detect_records)).parse()
+        self.put(key, tree)
+        return tree
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        path = self.path(key)
+        # Unpickling creates a node per step, the cyclic collector would otherwise run over the half built tree
+        # again and again
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(path, 'rb') as entry:
+                tree = pickle.load(entry)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            # Removed or damaged behind our back: treat it as a miss
+            self.forget(key)
+            self.misses += 1
+            return None
+        finally:
+            if gc_enabled:
+                gc.enable()
+        self.hits += 1
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process after we read it, the tree is still good
+            self.forget(key)
+            return tree
+        self.entries.move_to_end(key)
+        return tree
+
+    def put(self, key, tree):
+        try:
+            data = pickle.dumps(tree, pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            # Too deeply nested for pickle, such trees are simply not cached
+            return
+        if len(data) > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self.forget(key)
+        while self.entries and self.total_bytes + len(data) > self.max_bytes:
+            self.forget(next(iter(self.entries)))
+            self.evictions += 1
+
+        path = self.path(key)
+        temporary = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary, 'wb') as entry:
+            entry.write(data)
+        os.replace(temporary, path)
+        self.entries[key] = len(data)
+        self.total_bytes += len(data)
+
+    def forget(self, key):
+        self.total_bytes -= self.entries.pop(key)
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        while self.entries:
+            self.forget(next(iter(self.entries)))
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'bytes': self.total_bytes,
+        }
@@ -0,0 +1,299 @@
+########################################################################################################################
+#   Code generation:
+#
+#   Compiles a parsed program (a Compound tree) into one Python function, once, so running it does no dispatch and
+#   no type tests per node. Variables are resolved to slots by the SlotResolver first: every single variable
+#   becomes a local variable of the generated function named after its slot (s_<slot>), arrays stay in the frame
+#   list the function is called with. if and while become Python if and while statements and expressions become
+#   Python expressions.
+#
+#   The semantics are the ones of Traversal: a declaration sets a variable to 0, / is Python's division, AND / OR
+#   short circuit, reading a variable that was never set raises a NameError and an array index out of range an
+#   IndexError.
+#
+#   Expressions are generated with Traversal.walk, without recursion. Python's own parser does not accept
+#   arbitrarily deep nesting, so a sub expression nested deeper than MAX_INLINE_DEPTH is first stored in a
+#   temporary (t_<n>) and the expression continues from there. When the right side of an AND / OR needs
+#   temporaries, the AND / OR becomes an if around them, so they are only computed when Python's and / or would
+#   have looked at the right side.
+#
+#   Statements nest through the bodies of if and while, and Python only compiles 20 nested loops and 100 levels of
+#   indentation. A program that nests deeper than that is not compiled, compile_program returns an
+#   InterpretedProgram that runs it with Traversal.
+#
+#       program = compile_program(Parser(FastLexer(text)).parse())
+#       variables = program.run(i=0)
+########################################################################################################################
+from compiler.parser import (Traversal, Compound, Assign, ZeroNode, Variable, Type, NoOp, VariableDeclaration,
+                             UnaryOp, BinOp, Record, Condition, If, While, Integer, ArrayDeclaration, ArrayElement,
+                             SlotResolver, check_index)
+from compiler.static import *
+
+MAX_INLINE_DEPTH = 50
+
+# Python's limits on nested loops (CO_MAXBLOCKS) and levels of indentation (MAXINDENT)
+MAX_NESTED_LOOPS = 20
+MAX_INDENT = 100
+
+PYTHON_OPERATORS = {
+    TT_PLUS: '+',
+    TT_MINUS: '-',
+    TT_MUL: '*',
+    TT_DIV: '/',
+    TT_LT: '<',
+    TT_GT: '>',
+    TT_LTE: '<=',
+    TT_GTE: '>=',
+    TT_EE: '==',
+    TT_NE: '!=',
+    TT_AND: 'and',
+    TT_OR: 'or',
+    TT_NOT: 'not',
+}
+
+SHORT_CIRCUIT = {TT_AND, TT_OR}
+
+FUNCTION_NAME = 'micro_c_program'
+
+
+# Assigns an array element inside an expression, where Python has no assignment to a subscript
+def store(frame, value, slot):
+    frame[slot] = value
+    return value
+
+
+class CompiledProgram:
+
+    def __init__(self, source, layout):
+        self.source = source
+        self.layout = layout
+        namespace = {'check_index': check_index, 'store': store}
+        exec(compile(source, '<micro-c>', 'exec'), namespace)
+        self.function = namespace[FUNCTION_NAME]
+
+    # Runs the program with the given initial variable values and returns the variables it ends with
+    def run(self, **variables):
+        frame = self.layout.new_frame(variables)
+        scope = self.function(frame)
+        # The single variables were locals, the frame has to see their final values
+        for slot, length in self.layout.variables.values():
+            if length is None:
+                frame[slot] = scope.get('s_{}'.format(slot))
+        return self.layout.values(frame)
+
+
+# The same interface as CompiledProgram, for programs Python can not compile
+class InterpretedProgram:
+
+    def __init__(self, tree):
+        self.source = None
+        self.tree = tree
+
+    def run(self, **variables):
+        return Traversal().run(self.tree, **variables)
+
+
+class CodeGenerator:
+
+    def __init__(self, layout):
+        self.layout = layout
+        self.lines = []
+        self.indent = 1
+        self.temporaries = 0
+        # Deepest nesting of the generated code, see fits()
+        self.loops = 0
+        self.max_loops = 0
+        self.max_indent = 0
+
+    def emit(self, line):
+        self.max_indent = max(self.max_indent, self.indent + 1 if line.endswith(':') else self.indent)
+        self.lines.append('    ' * self.indent + line)
+
+    # Whether Python can compile the generated code
+    def fits(self):
+        return self.max_loops <= MAX_NESTED_LOOPS and self.max_indent < MAX_INDENT
+
+    @staticmethod
+    def variable(node):
+        return 's_{}'.format(node.slot)
+
+    # The frame index of an array element, checked against the length of the array unless it is a constant in range.
+    # A constant out of range is checked when it is reached, like any other index, not while generating.
+    @staticmethod
+    def element(node, index):
+        if type(node.index) is Integer and 0 <= node.index.value < node.length:
+            return str(node.var_node.slot + node.index.value)
+        return '{} + check_index({}, {}, {!r})'.format(node.var_node.slot, index, node.length, node.var_node.value)
+
+    def temporary(self, expression):
+        self.temporaries += 1
+        name = 't_{}'.format(self.temporaries)
+        self.emit('{} = {}'.format(name, expression))
+        return name
+
+    def generate(self, tree):
+        body = self.lines
+        self.statement(tree)
+        self.lines = []
+        self.indent = 1
+        # Starting values of the outermost variables
+        for slot, length in sorted(self.layout.variables.values()):
+            if length is None:
+                self.emit('if frame[{0}] is not None: s_{0} = frame[{0}]'.format(slot))
+        prologue = self.lines
+
+        return '\n'.join(['def {}(frame):'.format(FUNCTION_NAME)] + prologue + body + [
+            '    return locals()',
+            '',
+        ])
+
+    def statement(self, node):
+        node_type = type(node)
+        if node_type is Compound or node_type is Record:
+            for child in node.children:
+                self.statement(child)
+        elif node_type is Assign:
+            right = self.expression(node.right)
+            if type(node.left) is ArrayElement:
+                target = 'frame[{}]'.format(self.element(node.left, self.expression(node.left.index)))
+            else:
+                target = self.variable(node.left)
+            self.emit('{} = {}'.format(target, right))
+        elif node_type is VariableDeclaration:
+            self.emit('{} = 0'.format(self.variable(node.var_node)))
+        elif node_type is ArrayDeclaration:
+            slot = node.var_node.slot
+            self.emit('frame[{}:{}] = [0] * {}'.format(slot, slot + node.size, node.size))
+        elif node_type is If:
+            self.emit('if {}:'.format(self.expression(node.condition)))
+            self.block(node.children)
+        elif node_type is While:
+            self.loop(node)
+        elif node_type is NoOp:
+            pass
+        else:
+            self.expression(node)
+
+    def block(self, node):
+        self.indent += 1
+        self.emit('pass')
+        self.statement(node)
+        self.indent -= 1
+
+    def loop(self, node):
+        self.loops += 1
+        self.max_loops = max(self.max_loops, self.loops)
+        self.generate_loop(node)
+        self.loops -= 1
+
+    def generate_loop(self, node):
+        start = len(self.lines)
+        self.indent += 1
+        condition = self.expression(node.condition)
+        spilled = len(self.lines) > start
+        self.indent -= 1
+        if not spilled:
+            self.emit('while {}:'.format(condition))
+            self.block(node.children)
+            return
+
+        # The condition needed temporaries, they have to be computed again before every iteration
+        setup = self.lines[start:]
+        del self.lines[start:]
+        self.emit('while True:')
+        self.lines.extend(setup)
+        self.indent += 1
+        self.emit('if not ({}):'.format(condition))
+        self.emit('    break')
+        self.indent -= 1
+        self.block(node.children)
+
+    # Returns the Python expression for node, after emitting the temporaries it needs
+    def expression(self, node):
+        values = []
+        # id of the right side of an AND / OR -> where the lines of its temporaries start
+        right_starts = {}
+
+        def pre(node):
+            if id(node) in right_starts:
+                right_starts[id(node)] = len(self.lines)
+            if type(node) is Condition and node.operation.type in SHORT_CIRCUIT:
+                right_starts[id(node.right)] = None
+
+        def post(node):
+            node_type = type(node)
+            if node_type is Integer:
+                values.append((repr(node.value), 0))
+            elif node_type is Variable:
+                values.append((self.variable(node), 0))
+            elif node_type is ArrayElement:
+                # Never spilled (its index already is when needed), so an assignment can take the index back out
+                index, depth = values.pop()
+                values.pop()
+                values.append(('frame[{}]'.format(self.element(node, index)), depth + 1))
+            elif node_type is ZeroNode:
+                values.append(('0', 0))
+            elif node_type is UnaryOp:
+                operand, depth = values.pop()
+                self.push(values, '({} {})'.format(PYTHON_OPERATORS[node.operation.type], operand), depth + 1)
+            elif node_type is Condition and node.operation.type in SHORT_CIRCUIT:
+                right, right_depth = values.pop()
+                left, left_depth = values.pop()
+                start = right_starts.pop(id(node.right))
+                if len(self.lines) > start:
+                    values.append((self.guard(node.operation.type, left, right, start), 0))
+                else:
+                    operator = PYTHON_OPERATORS[node.operation.type]
+                    self.push(values, '({} {} {})'.format(left, operator, right), max(left_depth, right_depth) + 1)
+            elif node_type is BinOp or node_type is Condition:
+                right, right_depth = values.pop()
+                left, left_depth = values.pop()
+                operator = PYTHON_OPERATORS[node.operation.type]
+                self.push(values, '({} {} {})'.format(left, operator, right), max(left_depth, right_depth) + 1)
+            elif node_type is Assign:
+                # An assignment inside an expression, e.g. a := b := 1; its value is the assigned value
+                right, right_depth = values.pop()
+                left, left_depth = values.pop()
+                if type(node.left) is ArrayElement:
+                    index = left[len('frame['):-1]
+                    self.push(values, 'store(frame, {}, {})'.format(right, index), max(left_depth, right_depth) + 1)
+                else:
+                    self.push(values, '({} := {})'.format(left, right), right_depth + 1)
+            else:
+                raise Exception('Cannot compile {}'.format(node_type.__name__))
+
+        Traversal.walk(node, pre, post)
+        return values.pop()[0]
+
+    # left AND / OR right as a temporary, where the lines from start on compute the temporaries of right:
+    #     t = left
+    #     if t:  (if not t: for OR)
+    #         <temporaries of right>
+    #         t = right
+    def guard(self, operation, left, right, start):
+        right_lines = self.lines[start:]
+        del self.lines[start:]
+        name = self.temporary(left)
+        self.emit(('if {}:' if operation == TT_AND else 'if not {}:').format(name))
+        for line in right_lines:
+            self.lines.append('    ' + line)
+            self.max_indent = max(self.max_indent, (len(line) - len(line.lstrip(' '))) // 4 + 1)
+        self.indent += 1
+        self.emit('{} = {}'.format(name, right))
+        self.indent -= 1
+        return name
+
+    def push(self, values, expression, depth):
+        if depth > MAX_INLINE_DEPTH:
+            values.append((self.temporary(expression), 0))
+        else:
+            values.append((expression, depth))
+
+
+def compile_program(tree):
+    layout = SlotResolver().resolve(tree)
+    generator = CodeGenerator(layout)
+    source = generator.generate(tree)
+    if not generator.fits():
+        return InterpretedProgram(tree)
+    return CompiledProgram(source, layout)
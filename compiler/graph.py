@@ -0,0 +1,267 @@
+########################################################################################################################
+#   Program graphs:
+#
+#   Turns a parsed program into a program graph as on formalmethods.dk/pa4fun: the nodes are program points, the
+#   edges carry the action executed when going from one to the other. Node 0 is the start and node 1 the end of
+#   the program, the others are numbered as they are created.
+#
+#       x := a                  q0 --x := a--> q1
+#       int x, int[10] A        q0 --int x--> q1 (records declare each field, R.fst)
+#       S1; S2                  q0 --S1--> q --S2--> q1
+#       if b { S }              q0 --b--> q --S--> q1 and q0 --NOT (b)--> q1
+#       while b { S }           q0 --b--> q --S--> q0 and q0 --NOT (b)--> q1
+#
+#   The graph is built with an explicit stack in one pass over the tree. Edges are kept in flat integer arrays and
+#   indexed CSR style by source and by target: the edges leaving q are succ_edges[succ_offsets[q]:succ_offsets[q+1]],
+#   the ones entering it likewise in pred_edges. Actions are interned, every distinct action (same kind and same
+#   text) is one Action object shared by all the edges that carry it.
+#
+#   Variables are resolved by the SlotResolver first, so an inner variable that hides an outer one with the same
+#   name is a different variable in the graph. It is written name#slot.
+########################################################################################################################
+from array import array
+
+from compiler.parser import (Traversal, Compound, Assign, Variable, NoOp, VariableDeclaration, ArrayDeclaration,
+                             ArrayElement, UnaryOp, BinOp, Record, Condition, If, While, Integer, ZeroNode,
+                             SlotResolver, BINDING_POWER)
+from compiler.static import *
+
+START = 0
+END = 1
+
+ACTION_ASSIGN = 'assign'
+ACTION_DECLARE = 'declare'
+ACTION_TEST = 'test'
+ACTION_SKIP = 'skip'
+
+# Binding power of what never needs parentheses, and of an assignment, which always does inside an expression
+ATOM_POWER = 100
+ASSIGN_POWER = 0
+
+
+class Action:
+    __slots__ = ('id', 'kind', 'variable', 'node', 'negated', 'text')
+
+    # variable is the variable an assignment or declaration sets, node the Assign, declaration or condition
+    def __init__(self, id, kind, variable, node, negated, text):
+        self.id = id
+        self.kind = kind
+        self.variable = variable
+        self.node = node
+        self.negated = negated
+        self.text = text
+
+    def __repr__(self):
+        return 'Action({})'.format(self.text)
+
+
+class ProgramGraph:
+
+    def __init__(self, node_count, sources, targets, action_ids, actions, names):
+        self.node_count = node_count
+        # Edge e goes from sources[e] to targets[e] and carries actions[action_ids[e]]
+        self.sources = sources
+        self.targets = targets
+        self.action_ids = action_ids
+        self.actions = actions
+        # slot -> name of the variable in the actions
+        self.names = names
+        self.succ_offsets, self.succ_edges = self.index(sources)
+        self.pred_offsets, self.pred_edges = self.index(targets)
+
+    # Counting sort of the edge ids by the given end point
+    def index(self, ends):
+        offsets = array('i', [0]) * (self.node_count + 1)
+        for node in ends:
+            offsets[node + 1] += 1
+        for node in range(self.node_count):
+            offsets[node + 1] += offsets[node]
+        edges = array('i', [0]) * len(ends)
+        free = offsets[:-1]
+        for edge, node in enumerate(ends):
+            edges[free[node]] = edge
+            free[node] += 1
+        return offsets, edges
+
+    @property
+    def edge_count(self):
+        return len(self.sources)
+
+    def out_edges(self, node):
+        return self.succ_edges[self.succ_offsets[node]:self.succ_offsets[node + 1]]
+
+    def in_edges(self, node):
+        return self.pred_edges[self.pred_offsets[node]:self.pred_offsets[node + 1]]
+
+    # (action, target) for every edge leaving node
+    def successors(self, node):
+        for edge in self.out_edges(node):
+            yield self.actions[self.action_ids[edge]], self.targets[edge]
+
+    # (source, action) for every edge entering node
+    def predecessors(self, node):
+        for edge in self.in_edges(node):
+            yield self.sources[edge], self.actions[self.action_ids[edge]]
+
+    def action(self, edge):
+        return self.actions[self.action_ids[edge]]
+
+    def nbytes(self):
+        arrays = (self.sources, self.targets, self.action_ids, self.succ_offsets, self.succ_edges,
+                  self.pred_offsets, self.pred_edges)
+        return sum(len(values) * values.itemsize for values in arrays)
+
+    def dot(self):
+        lines = ['digraph program_graph {\n',
+                 '  q{} [label="q▷"]\n'.format(START),
+                 '  q{} [label="q◀"]\n'.format(END)]
+        for edge in range(self.edge_count):
+            lines.append('  q{} -> q{} [label="{}"]\n'.format(
+                self.sources[edge], self.targets[edge], self.action(edge).text))
+        lines.append('}\n')
+        return ''.join(lines)
+
+
+class GraphBuilder:
+
+    def __init__(self):
+        self.node_count = 2
+        self.sources = array('i')
+        self.targets = array('i')
+        self.action_ids = array('i')
+        self.actions = []
+        self.interned = {}
+        self.names = []
+
+    def build(self, tree):
+        layout = SlotResolver().resolve(tree)
+        self.names = self.unique_names(layout)
+
+        stack = [(tree, START, END)]
+        while stack:
+            node, q0, q1 = stack.pop()
+            node_type = type(node)
+            if node_type is Compound or node_type is Record:
+                statements = [child for child in node.children if type(child) is not NoOp]
+                if not statements:
+                    self.edge(q0, self.intern(ACTION_SKIP, None, None, False, 'skip'), q1)
+                    continue
+                points = [q0] + [self.new_node() for _ in statements[1:]] + [q1]
+                # Pushed last to first, so the statements are handled (and their nodes numbered) in order
+                for i in range(len(statements) - 1, -1, -1):
+                    stack.append((statements[i], points[i], points[i + 1]))
+            elif node_type is Assign:
+                variable = self.target_name(node.left)
+                self.edge(q0, self.intern(ACTION_ASSIGN, variable, node, False, self.text(node)), q1)
+            elif node_type is VariableDeclaration:
+                variable = self.names[node.var_node.slot]
+                text = '{} {}'.format(node.type_node.value, variable)
+                self.edge(q0, self.intern(ACTION_DECLARE, variable, node, False, text), q1)
+            elif node_type is ArrayDeclaration:
+                variable = self.names[node.var_node.slot]
+                text = '{}[{}] {}'.format(node.type_node.value, node.size, variable)
+                self.edge(q0, self.intern(ACTION_DECLARE, variable, node, False, text), q1)
+            elif node_type is If or node_type is While:
+                q = self.new_node()
+                text = self.text(node.condition)
+                self.edge(q0, self.intern(ACTION_TEST, None, node.condition, False, text), q)
+                # The body of a loop goes back to its test
+                stack.append((node.children, q, q0 if node_type is While else q1))
+                text = 'NOT ({})'.format(text)
+                self.edge(q0, self.intern(ACTION_TEST, None, node.condition, True, text), q1)
+            elif node_type is NoOp:
+                self.edge(q0, self.intern(ACTION_SKIP, None, None, False, 'skip'), q1)
+            else:
+                raise Exception('No program graph for {}'.format(node_type.__name__))
+
+        return ProgramGraph(self.node_count, self.sources, self.targets, self.action_ids, self.actions, self.names)
+
+    # A variable keeps its name, unless an earlier slot has the same name already (it hides or is hidden by it)
+    @staticmethod
+    def unique_names(layout):
+        seen = set()
+        names = []
+        for slot, name in enumerate(layout.names):
+            if name is None or name not in seen:
+                names.append(name)
+                seen.add(name)
+            else:
+                names.append('{}#{}'.format(name, slot))
+        return names
+
+    def new_node(self):
+        self.node_count += 1
+        return self.node_count - 1
+
+    def edge(self, source, action, target):
+        self.sources.append(source)
+        self.targets.append(target)
+        self.action_ids.append(action.id)
+
+    # The test of NOT (x OR y) and the negated test of x OR y have the same text, negated tells them apart
+    def intern(self, kind, variable, node, negated, text):
+        key = kind, negated, text
+        action = self.interned.get(key)
+        if action is None:
+            action = Action(len(self.actions), kind, variable, node, negated, text)
+            self.actions.append(action)
+            self.interned[key] = action
+        return action
+
+    def target_name(self, node):
+        if type(node) is ArrayElement:
+            return self.names[node.var_node.slot]
+        return self.names[node.slot]
+
+    def text(self, node):
+        return expression_text(node, self.names)[0]
+
+
+# The source text of an expression, with only the parentheses the binding powers need, as (text, power). When a
+# found list is given, (node, text) is appended to it for every operation, element and assignment inside node.
+def expression_text(node, names, found=None):
+    values = []
+
+    def post(node):
+        node_type = type(node)
+        if node_type is Integer or node_type is ZeroNode:
+            values.append((str(node.value), ATOM_POWER))
+        elif node_type is Variable:
+            values.append((names[node.slot], ATOM_POWER))
+        elif node_type is ArrayElement:
+            index, _ = values.pop()
+            values.pop()
+            values.append(('{}[{}]'.format(names[node.var_node.slot], index), ATOM_POWER))
+        elif node_type is UnaryOp:
+            operand, operand_power = values.pop()
+            power = BINDING_POWER[node.operation.type][1]
+            if operand_power < power:
+                operand = '({})'.format(operand)
+            separator = ' ' if node.operation.type == TT_NOT else ''
+            values.append(('{}{}{}'.format(node.operation.value, separator, operand), power))
+        elif node_type is BinOp or node_type is Condition:
+            right, right_power = values.pop()
+            left, left_power = values.pop()
+            power = BINDING_POWER[node.operation.type][0]
+            # Operators are left associative, a - (b - c) keeps its parentheses
+            if left_power < power:
+                left = '({})'.format(left)
+            if right_power <= power:
+                right = '({})'.format(right)
+            values.append(('{} {} {}'.format(left, node.operation.value, right), power))
+        elif node_type is Assign:
+            right, _ = values.pop()
+            left, _ = values.pop()
+            values.append(('{} := {}'.format(left, right), ASSIGN_POWER))
+        else:
+            raise Exception('No program graph for {}'.format(node_type.__name__))
+        if found is not None and node_type is not Integer and node_type is not ZeroNode and node_type is not Variable:
+            found.append((node, values[-1][0]))
+
+    Traversal.walk(node, post=post)
+    text, power = values.pop()
+    return text, power
+
+
+def build_program_graph(tree):
+    return GraphBuilder().build(tree)
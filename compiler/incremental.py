@@ -0,0 +1,287 @@
+########################################################################################################################
+#   Incremental re-parsing:
+#
+#   A Document keeps the text of a program together with its tokens and its tree, and applies edits to all three:
+#       document = Document(text, detect_records=True)
+#       document.edit(offset, deleted, inserted)      # text[offset:offset + deleted] is replaced with inserted
+#       document.tree, document.tokens
+#
+#   While parsing, every block (Compound and Record) remembers its separators: the token that opens it, the ';'
+#   between its statements and the '}' that closes it. Statement k of a block lies between separators k and k + 1.
+#   An edit looks up the tokens it touches, walks down from the root to the innermost block that holds them (into
+#   Records and into the body of an If or While) and re-lexes and re-parses only the statements of that block that
+#   the edit touches. They are spliced into the children of the block and into the token list; everything else,
+#   subtrees and tokens, stays as it is.
+#
+#   The re-lexed text runs from the separator before the statements to the one after them, and both have to come
+#   out of the lexer unchanged, so a token can not merge with its neighbour across the edge. The brackets inside
+#   must match among themselves before and after the edit, so the lexer's look-ahead (record detection) reads the
+#   rest of the text as before. When either does not hold, or the statements do not parse, the statement holding
+#   the block is re-parsed in the block above it, and so on up to a full parse. An edit that leaves the program
+#   invalid raises the syntax error of the full parse and leaves the document as it was.
+#
+#   Shifting the offsets of every token after an edit would make each edit as slow as the length of the file.
+#   Like the gap of a text editor's buffer, the tokens from index gap on have offsets that are gap_shift behind;
+#   an edit only moves the gap to where it happens, so a run of edits costs the size of the edits plus the distance
+#   between them. settle() brings every offset (also those of the tokens in the tree) up to date.
+########################################################################################################################
+from bisect import bisect_left, bisect_right
+from operator import attrgetter
+
+from compiler.lexer import FastLexer, Token
+from compiler.parser import Parser, Traversal, Record, If, While
+from compiler.static import *
+
+START = attrgetter('start')
+END = attrgetter('end')
+
+BRACKET_PAIRS = {')': '(', ']': '[', '}': '{'}
+
+
+# Whether every bracket character of the text has its partner in the text as well
+def balanced(text):
+    stack = []
+    for char in text:
+        if char in '([{':
+            stack.append(char)
+        elif char in BRACKET_PAIRS:
+            if not stack or stack.pop() != BRACKET_PAIRS[char]:
+                return False
+    return not stack
+
+
+# Every token of the lexer up to and including EOF, each with its own offsets
+def lex(lexer):
+    tokens = []
+    token = lexer.get_next_token()
+    while token.type != TT_EOF:
+        tokens.append(token)
+        token = lexer.get_next_token()
+    tokens.append(token)
+    return tokens
+
+
+class SpanParser(Parser):
+    # Records the separators of every block it parses in blocks (id(block) -> tokens) and the token of every
+    # record field R.fst in fields (id of the '.' token -> token of the field variable)
+
+    def __init__(self, tokens, blocks, fields, lexer=None):
+        super().__init__(tokens)
+        # A lexer over the whole text lets error() report a line and column
+        if lexer is not None:
+            self.lexer = lexer
+        self.blocks = blocks
+        self.fields = fields
+        self.semis = []
+        self.list_semis = []
+        self.closing = None
+
+    def consume(self, token_type):
+        token = self.curr_token
+        super().consume(token_type)
+        if token_type == TT_SEMI:
+            self.semis.append(token)
+        elif token_type == TT_R_BRACKET:
+            self.closing = token
+
+    # Leaves the ';' between the statements in self.semis
+    def parse_statement_list(self):
+        outer = self.semis
+        self.semis = []
+        results = super().parse_statement_list()
+        self.list_semis, self.semis = self.semis, outer
+        return results
+
+    def parse_compound_statement(self):
+        opening = self.curr_token
+        node = super().parse_compound_statement()
+        self.blocks[id(node)] = [opening] + self.list_semis + [self.closing]
+        return node
+
+    def parse_record(self):
+        opening = self.curr_token
+        node = super().parse_record()
+        if type(node) is Record:
+            self.blocks[id(node)] = [opening] + self.list_semis + [self.closing]
+        return node
+
+    def parse_field(self, record):
+        method = self.curr_token
+        node = super().parse_field(record)
+        self.fields[id(method)] = node.token
+        return node
+
+
+class Document:
+
+    def __init__(self, text, detect_records=False):
+        self.detect_records = detect_records
+        self.load(text)
+
+    # Lexes and parses all of text
+    def load(self, text):
+        lexer = FastLexer(text, self.detect_records)
+        tokens = lex(lexer)
+        blocks, fields = {}, {}
+        tree = SpanParser(tokens, blocks, fields, lexer).parse()
+        self.text = text
+        self.tokens = tokens
+        self.tree = tree
+        self.blocks = blocks
+        self.fields = fields
+        self.gap = len(tokens)
+        self.gap_shift = 0
+
+    # Adds delta to the offsets of the tokens first to last (not included) and of the field variables among them
+    def shift(self, first, last, delta):
+        tokens = self.tokens
+        fields = self.fields
+        for i in range(first, last):
+            token = tokens[i]
+            token.start += delta
+            token.end += delta
+            if token.type == TT_METHOD:
+                field = fields.get(id(token))
+                if field is not None:
+                    field.start += delta
+                    field.end += delta
+
+    def settle(self):
+        self.shift(self.gap, len(self.tokens), self.gap_shift)
+        self.gap = len(self.tokens)
+        self.gap_shift = 0
+
+    def start(self, i):
+        return self.tokens[i].start + (self.gap_shift if i >= self.gap else 0)
+
+    def end(self, i):
+        return self.tokens[i].end + (self.gap_shift if i >= self.gap else 0)
+
+    # Position of a token in self.tokens. The offsets on either side of the gap are in order, so it is found with
+    # a bisect in each.
+    def index(self, token):
+        tokens = self.tokens
+        for first, last in ((0, self.gap), (self.gap, len(tokens))):
+            i = bisect_left(tokens, token.start, first, last, key=START)
+            if i < last and tokens[i] is token:
+                return i
+        raise Exception('Token {!r} is not in the document'.format(token))
+
+    # Index of the first token that ends at or after offset, and of the first that starts after it
+    def first_ending(self, offset):
+        i = bisect_left(self.tokens, offset, 0, self.gap, key=END)
+        if i < self.gap:
+            return i
+        return bisect_left(self.tokens, offset - self.gap_shift, self.gap, len(self.tokens), key=END)
+
+    def first_starting_after(self, offset):
+        i = bisect_right(self.tokens, offset, 0, self.gap, key=START)
+        if i < self.gap:
+            return i
+        return bisect_right(self.tokens, offset - self.gap_shift, self.gap, len(self.tokens), key=START)
+
+    # The block statement k opens, if the whole edit is inside its separators
+    def inner_block(self, node, first, last):
+        node_type = type(node)
+        if node_type is If or node_type is While:
+            node = node.children
+        elif node_type is not Record:
+            return None
+        separators = self.blocks[id(node)]
+        if self.index(separators[0]) < first and last <= self.index(separators[-1]):
+            return node
+        return None
+
+    # Replaces text[offset:offset + deleted] with inserted and brings the tokens and the tree up to date. Returns
+    # what was re-parsed: the type of the block (None for a full parse), how many statements and how many tokens.
+    def edit(self, offset, deleted, inserted):
+        if offset < 0 or deleted < 0 or offset + deleted > len(self.text):
+            raise Exception('Edit of {} characters at {} is outside of the text'.format(deleted, offset))
+        text = self.text[:offset] + inserted + self.text[offset + deleted:]
+        delta = len(inserted) - deleted
+
+        # The tokens the edit touches, also the ones right next to it: first to last (not included)
+        first = self.first_ending(offset)
+        last = max(self.first_starting_after(offset + deleted), first)
+
+        # The blocks that hold them, outermost first, with the statements of each that do
+        path = []
+        block = self.tree
+        separators = self.blocks[id(block)]
+        if self.index(separators[0]) < first and last - 1 < self.index(separators[-1]):
+            while block is not None:
+                separators = self.blocks[id(block)]
+                k1 = bisect_left(separators, first, key=self.index) - 1
+                k2 = max(bisect_right(separators, last - 1, key=self.index) - 1, k1)
+                path.append((block, k1, k2))
+                block = self.inner_block(block.children[k1], first, last) if k1 == k2 else None
+
+        for block, k1, k2 in reversed(path):
+            result = self.reparse(text, delta, block, k1, k2)
+            if result is not None:
+                return result
+
+        self.load(text)
+        return {'block': None, 'statements': len(self.tree.children), 'tokens': len(self.tokens)}
+
+    # Re-parses statements k1 to k2 of block in the edited text, None if that is not enough
+    def reparse(self, text, delta, block, k1, k2):
+        separators = self.blocks[id(block)]
+        before, after = self.index(separators[k1]), self.index(separators[k2 + 1])
+        start, end = self.start(before), self.end(after) + delta
+        middle_start, middle_end = self.end(before), self.start(after)
+        if not balanced(self.text[middle_start:middle_end]) or not balanced(text[middle_start:middle_end + delta]):
+            return None
+
+        lexer = FastLexer(text[start:end], self.detect_records)
+        opening = separators[k1]
+        if opening.type == TT_RECORD:
+            # The '}' of the record is outside of the piece, so the lexer would not see the record by itself
+            lexer.structure_index().record_openings.add(0)
+        try:
+            tokens = lex(lexer)
+        except Exception:
+            return None
+        closing = separators[k2 + 1]
+        if len(tokens) < 3 or tokens[0].type != opening.type or tokens[0].end != middle_start - start:
+            return None
+        if tokens[-2].type != closing.type or tokens[-2].start != middle_end + delta - start:
+            return None
+
+        statement_tokens = tokens[1:-2]
+        for token in statement_tokens:
+            token.start += start
+            token.end += start
+        blocks, fields = {}, {}
+        parser = SpanParser(statement_tokens + [Token(TT_EOF, None, end, end)], blocks, fields)
+        try:
+            statements = parser.parse_statement_list()
+            if parser.curr_token.type != TT_EOF:
+                return None
+        except Exception:
+            return None
+
+        # Only the tokens after the gap are behind, so the gap goes to the statements that are replaced
+        if self.gap <= before:
+            self.shift(self.gap, before + 1, self.gap_shift)
+        elif self.gap > after:
+            self.shift(after, self.gap, -self.gap_shift)
+        for token in self.tokens[before + 1:after]:
+            if token.type == TT_METHOD:
+                self.fields.pop(id(token), None)
+
+        def forget(node):
+            self.blocks.pop(id(node), None)
+
+        for statement in block.children[k1:k2 + 1]:
+            Traversal.walk(statement, forget)
+
+        self.tokens[before + 1:after] = statement_tokens
+        block.children[k1:k2 + 1] = statements
+        separators[k1 + 1:k2 + 1] = parser.list_semis
+        self.blocks.update(blocks)
+        self.fields.update(fields)
+        self.gap = before + 1 + len(statement_tokens)
+        self.gap_shift += delta
+        self.text = text
+        return {'block': type(block).__name__, 'statements': len(statements), 'tokens': len(statement_tokens)}
@@ -3,7 +3,13 @@
 #
 #   This class is used when an error happens within the lexer
 ########################################################################################################################
+import gc
+import re
 import string
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from operator import attrgetter, itemgetter
 from compiler.static import *
 
 ########################################################################################################################
@@ -14,18 +20,19 @@ from compiler.static import *
 ########################################################################################################################
 
 class Token:
-    def __init__(self, type, value=0):
+    __slots__ = ('type', 'value', 'start', 'end')
+
+    # start / end are the offsets of the token in the text (end is just past it), None when unknown.
+    # A LineIndex turns them into lines and columns when they are needed.
+    def __init__(self, type, value=0, start=None, end=None):
         self.type = type
         self.value = value
+        self.start = start
+        self.end = end
 
-        # if pos_start:
-        #     self.pos_start = pos_start.copy()
-        #     self.pos_end = pos_start.copy()
-        #     self.pos_end.advance()
-
-        # if pos_end:
-        #     self.pos_end = pos_end
-
+    # Pickled as a constructor call, which loads about twice as fast as restoring __slots__ state
+    def __reduce__(self):
+        return Token, (self.type, self.value, self.start, self.end)
 
     # How the token is represented e.g. in console [type:value] || if no value [type]
     def __repr__(self):
@@ -59,20 +66,127 @@ RESERVED_TOKENS = {
     'int': Token(TT_VAR_TYPE, 'int'),
     'float': Token(TT_VAR_TYPE, 'float'),
     'R': Token(TT_RECORD, 'R'),
-    'if': Token(TT_IF, 'IF')
+    'if': Token(TT_IF, 'IF'),
+    'while': Token(TT_WHILE, 'WHILE'),
+    'AND': Token(TT_AND, 'AND'),
+    'OR': Token(TT_OR, 'OR'),
+    'NOT': Token(TT_NOT, 'NOT')
 }
 
+COMPARATOR_TOKENS = {
+    '<': TT_LT,
+    '>': TT_GT,
+    '<=': TT_LTE,
+    '>=': TT_GTE,
+    '==': TT_EE,
+    '!=': TT_NE,
+}
+
+
+########################################################################################################################
+#   LineIndex:
+#
+#   Replaces tracking the line and column on every advance(). The offsets at which the lines start are collected
+#   in one pass the first time a location is asked for, after that an offset is turned into a (line, column)
+#   pair, both starting at 1, with a bisect. For a piece of a larger file, line and column are where the piece
+#   starts in the file.
+########################################################################################################################
+
+class LineIndex:
+
+    def __init__(self, text, line=1, column=1):
+        self.line_starts = array('i', [0])
+        self.line_starts.extend(m.end() for m in re.finditer('\n', text))
+        self.line = line
+        self.column = column
+
+    def line_col(self, offset):
+        line = bisect_right(self.line_starts, offset)
+        column = offset - self.line_starts[line - 1] + 1
+        if line == 1:
+            column += self.column - 1
+        return line + self.line - 1, column
+
+
+########################################################################################################################
+#   StructureIndex:
+#
+#   One linear pass over the text that records where the structural characters are, so the lexer can look ahead
+#   without scanning. It holds
+#       matching        offset of every matched bracket ({, (, [ and their closers) -> offset of its partner
+#       semis           offsets of the ';', in order; next_semi(offset) finds the first one at or after an offset
+#       closes          offsets of the '}', in order; next_close(offset) the same
+#       record_openings offsets of the '{' that open a record declaration, e.g. {int fst; int snd} R
+########################################################################################################################
+
+STRUCTURE_PATTERN = re.compile(r'[{}()\[\];]')
+RECORD_NAME_PATTERN = re.compile(r'\s*R(?![^\W_]|[{}])')
+IF_PATTERN = re.compile(r'if\s*\(')
+
+OPENING_BRACKETS = {'}': '{', ')': '(', ']': '['}
+
+
+class StructureIndex:
+
+    def __init__(self, text):
+        self.matching = {}
+        self.record_openings = set()
+        # Only the separators themselves, memory grows with their number and not with the length of the text
+        self.semis = array('i')
+        self.closes = array('i')
+
+        open_brackets = []
+        for m in STRUCTURE_PATTERN.finditer(text):
+            pos = m.start()
+            char = m.group()
+            if char == ';':
+                self.semis.append(pos)
+                continue
+            if char not in OPENING_BRACKETS:
+                open_brackets.append(pos)
+                continue
+
+            if char == '}':
+                self.closes.append(pos)
+            # Unbalanced closers are left without a partner
+            if open_brackets and text[open_brackets[-1]] == OPENING_BRACKETS[char]:
+                opening = open_brackets.pop()
+                self.matching[opening] = pos
+                self.matching[pos] = opening
+                if char == '}' and RECORD_NAME_PATTERN.match(text, pos + 1):
+                    self.record_openings.add(opening)
+
+    # Offset of the first ';' at or after pos, -1 if there is none
+    def next_semi(self, pos):
+        i = bisect_left(self.semis, pos)
+        return self.semis[i] if i < len(self.semis) else -1
+
+    # Offset of the first '}' at or after pos, -1 if there is none
+    def next_close(self, pos):
+        i = bisect_left(self.closes, pos)
+        return self.closes[i] if i < len(self.closes) else -1
+
 
 class Lexer:
 
-    def __init__(self, micro_code_txt):
+    def __init__(self, micro_code_txt, detect_records=False):
         self.text = micro_code_txt
         self.pos = 0
         self.current_char = self.text[self.pos]
+        # When set, the '{' opening a record declaration is lexed as a RECORD token instead of a L_BRACKET
+        self.detect_records = detect_records
+        self.index = None
+        self.lines = None
         
     def error(self):
-        string = f"Invalid character {self.current_char}"
+        line, column = self.line_index().line_col(self.pos)
+        string = f"Invalid character {self.current_char} at line {line}, column {column}"
         raise Exception(string)
+
+    def line_index(self):
+        if self.lines is None:
+            self.lines = LineIndex(self.text)
+        return self.lines
         
     def make_id(self):
         # Handle identifiers and reserved tokens
@@ -81,8 +195,11 @@ class Lexer:
             result += self.current_char
             self.advance()
             
-        token = RESERVED_TOKENS.get(result, Token(TT_IDENTIFIER, result))
-        return token
+        # Reserved tokens are copied, the lexer stamps the offsets on the token it returns
+        reserved = RESERVED_TOKENS.get(result)
+        if reserved:
+            return Token(reserved.type, reserved.value)
+        return Token(TT_IDENTIFIER, result)
 
     # Advances one position in the text and sets the current_char
     def advance(self):
@@ -114,88 +231,363 @@ class Lexer:
             self.advance()
         return int(result)
 
-    def make_record(self):
-        token = Token(TT_RECORD, 'R')
-        self.make_id()
-        while self.current_char is not None:    
+    # <, >, <=, >=, == and != (a lone = or ! is not a token)
+    def make_comparator(self):
+        char = self.current_char
+        if self.text[self.pos + 1:self.pos + 2] == '=':
             self.advance()
-        return token
-    
+            self.advance()
+            return Token(COMPARATOR_TOKENS[char + '='], char + '=')
+        if char not in COMPARATOR_TOKENS:
+            self.error()
+        self.advance()
+        return Token(COMPARATOR_TOKENS[char], char)
+
+    def make_record(self):
+        # Called on the '{' of a record declaration
+        self.advance()
+        return Token(TT_RECORD, 'R')
+
+    # The structure index is only built the first time one of the look-ahead methods needs it
+    def structure_index(self):
+        if self.index is None:
+            self.index = StructureIndex(self.text)
+        return self.index
+
+    # The '}' matching the '{' at the current position, otherwise the next '}' (-1 if there is none)
     def find_next_bracket(self):
-        bracket_pos = self.pos
-        while str(self.text).replace(' ', '')[bracket_pos] != '}':
-            bracket_pos += 1
-        return bracket_pos        
-    
+        index = self.structure_index()
+        if self.current_char == '{':
+            return index.matching.get(self.pos, -1)
+        return index.next_close(self.pos)
+
     def find_next_semi(self):
-        pos = self.pos
-        while str(self.text).replace(' ', '')[pos] != ';':
-            pos += 1
-        return pos
-    
+        return self.structure_index().next_semi(self.pos)
+
     def is_record(self):
-        pos = self.pos
-        is_record = False
-        while str(self.text).replace(' ', '')[pos] != 'R':
-            pos += 1
-        else:
-            is_record = True
-        return is_record
+        return self.pos in self.structure_index().record_openings
 
     def is_if(self):
-        pass
+        m = IF_PATTERN.match(self.text, self.pos)
+        return m is not None and m.end() - 1 in self.structure_index().matching
+
+    def get_next_token(self):
+        self.skip_whitespace()
+        start = self.pos
+        token = self.make_token()
+        token.start = start
+        token.end = self.pos
+        return token
+
+    # Lexes the token starting at the current (non whitespace) character
+    def make_token(self):
+        if self.current_char is None:
+            return Token(TT_EOF, None)
 
+        if self.detect_records and self.current_char == '{' and self.is_record():
+            return self.make_record()
 
+        if self.current_char.isalpha() or self.current_char in RESERVED_TOKENS.keys():
+            return self.make_id()
+
+
+        if self.current_char == ':' and self.peek_next() == '=':
+            self.advance()
+            self.advance()
+            return Token(TT_ASSIGN, ':=')
+
+        if self.current_char.isdigit():
+            return Token(TT_INT, self.make_number())
         
-    def get_next_token(self):
-        while self.current_char is not None:
-            if self.current_char.isspace():
-                self.skip_whitespace()
-                continue
-            
-            if self.current_char.isalpha() or self.current_char in RESERVED_TOKENS.keys():
-                return self.make_id()
-#                if self.current_char == '{' and self.is_record():
-#                   return self.make_record()
+        if self.current_char == ';':
+            self.advance()
+            return Token(TT_SEMI, ';')
 
+        if self.current_char == '+':
+            self.advance()
+            return Token(TT_PLUS, '+')
 
-            if self.current_char == ':' and self.peek_next() == '=':
-                self.advance()
-                self.advance()
-                return Token(TT_ASSIGN, ':=')
+        if self.current_char == '-':
+            self.advance()
+            return Token(TT_MINUS, '-')
 
-            if self.current_char.isdigit():
-                return Token(TT_INT, self.make_number())
-            
-            if self.current_char == ';':
-                self.advance()
-                return Token(TT_SEMI, ';')
+        if self.current_char == '*':
+            self.advance()
+            return Token(TT_MUL, '*')
 
-            if self.current_char == '+':
-                self.advance()
-                return Token(TT_PLUS, '+')
+        if self.current_char == '/':
+            self.advance()
+            return Token(TT_DIV, '/')
 
-            if self.current_char == '-':
-                self.advance()
-                return Token(TT_MINUS, '-')
+        if self.current_char == '(':
+            self.advance()
+            return Token(TT_L_PAREN, '(')
 
-            if self.current_char == '*':
-                self.advance()
-                return Token(TT_MUL, '*')
+        if self.current_char == ')':
+            self.advance()
+            return Token(TT_R_PAREN, ')')
 
-            if self.current_char == '/':
-                self.advance()
-                return Token(TT_DIV, '/')
+        if self.current_char == '[':
+            self.advance()
+            return Token(TT_L_SQUARE, '[')
 
-            if self.current_char == '(':
-                self.advance()
-                return Token(TT_L_PAREN, '(')
+        if self.current_char == ']':
+            self.advance()
+            return Token(TT_R_SQUARE, ']')
 
-            if self.current_char == ')':
-                self.advance()
-                return Token(TT_R_PAREN, ')')
+        if self.current_char == '.':
+            self.advance()
+            return Token(TT_METHOD, '.')
+
+        if self.current_char in '<>=!':
+            return self.make_comparator()
+
+        self.error()
+
+    # Lexes the whole text, returning the list of tokens (ending with EOF) and the error that stopped it, if any
+    def make_tokens(self):
+        tokens = []
+        try:
+            token = self.get_next_token()
+            while token.type != TT_EOF:
+                tokens.append(token)
+                token = self.get_next_token()
+            tokens.append(token)
+        except Exception as error:
+            return tokens, error
+        return tokens, None
 
-            self.error()
 
-        return Token(TT_EOF, None)
-    
\ No newline at end of file
+########################################################################################################################
+#   FastLexer:
+#
+#   A second engine behind the same get_next_token / make_tokens interface. Instead of walking the text one
+#   advance() at a time it matches a whole token (plus the whitespace before it) with one compiled pattern and
+#   slices the lexeme straight out of the text. Keywords are resolved with a single RESERVED_TOKENS lookup.
+#
+#   make_tokens goes further: for ASCII text it finds every lexeme of the program and its offsets with two passes of
+#   one pattern and builds the tokens with C level maps, classifying each distinct lexeme only once. Every token
+#   is a Token of its own with its start / end offsets, like the ones get_next_token returns.
+#
+#   The patterns only cover ASCII input. Anything they do not recognise (non-ASCII letters or digits, a lone ':',
+#   illegal characters) is handed to the original Lexer for exactly one token, so both engines always produce the
+#   same token stream and raise the same errors.
+########################################################################################################################
+
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        ([A-Za-z{}][A-Za-z0-9{}]*)(?![A-Za-z0-9{}]|[^\x00-\x7f])    # 1: identifier or reserved token
+      | ([0-9]+)(?![0-9]|[^\x00-\x7f])                            # 2: integer
+      | (:=|[<>=!]=|[;+\-*/()<>\[\].])                             # 3: operator, comparator or separator
+      | \Z                                                         # end of input
+    )""", re.VERBOSE)
+
+# Every non-whitespace run is one of these lexemes; '\S' catches whatever the lexer does not understand
+LEXEME_PATTERN = re.compile(r'[A-Za-z{}][A-Za-z0-9{}]*|[0-9]+|:=|[<>=!]=|[;+\-*/()<>\[\].]|\S')
+
+# The same with the lexemes captured, so split keeps them
+LEXEME_SPLIT = re.compile('(' + LEXEME_PATTERN.pattern + ')')
+
+START = attrgetter('start')
+FIRST = itemgetter(0)
+SECOND = itemgetter(1)
+
+OPERATOR_TOKENS = {
+    ':=': TT_ASSIGN,
+    ';': TT_SEMI,
+    '+': TT_PLUS,
+    '-': TT_MINUS,
+    '*': TT_MUL,
+    '/': TT_DIV,
+    '(': TT_L_PAREN,
+    ')': TT_R_PAREN,
+    '[': TT_L_SQUARE,
+    ']': TT_R_SQUARE,
+    '.': TT_METHOD,
+    **COMPARATOR_TOKENS
+}
+
+
+class FastLexer(Lexer):
+
+    def __init__(self, micro_code_txt, detect_records=False):
+        super().__init__(micro_code_txt, detect_records)
+        self._match = TOKEN_PATTERN.match
+
+    # Lets the original engine lex the single token starting at pos
+    def fallback_token(self, pos):
+        self.pos = pos
+        self.current_char = self.text[pos] if pos < len(self.text) else None
+        return Lexer.get_next_token(self)
+
+    def get_next_token(self):
+        text = self.text
+        m = self._match(text, self.pos)
+        if m is None:
+            return self.fallback_token(self.pos)
+
+        self.pos = end = m.end()
+        self.current_char = text[end] if end < len(text) else None
+
+        kind = m.lastindex
+        if kind == 1:
+            lexeme = m.group(1)
+            start = m.start(1)
+            if self.detect_records and lexeme[0] == '{' and start in self.structure_index().record_openings:
+                return self.fallback_token(start)
+            reserved = RESERVED_TOKENS.get(lexeme)
+            if reserved:
+                return Token(reserved.type, reserved.value, start, end)
+            return Token(TT_IDENTIFIER, lexeme, start, end)
+        if kind == 2:
+            return Token(TT_INT, int(m.group(2)), m.start(2), end)
+        if kind == 3:
+            lexeme = m.group(3)
+            return Token(OPERATOR_TOKENS[lexeme], lexeme, m.start(3), end)
+        return Token(TT_EOF, None, end, end)
+
+    def make_tokens(self):
+        text = self.text
+        if not text.isascii():
+            return super().make_tokens()
+
+        # Splitting on the lexemes leaves the whitespace between them, so the offsets are the running sums of the
+        # lengths of the pieces. The splitting, the sums, the lookups and the building of the tokens all run as C
+        # level maps; Python code only runs once per distinct lexeme, to classify it.
+        start = self.pos
+        pieces = LEXEME_SPLIT.split(text[start:] if start else text)
+        offsets = list(accumulate(map(len, pieces), initial=start))
+        lexemes = pieces[1::2]
+        kinds = LexemeKinds()
+        # Hundreds of thousands of new objects would set off the cyclic garbage collector over and over again,
+        # tokens never form cycles
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            kinds = list(map(kinds.__getitem__, lexemes))
+            tokens = list(map(Token, map(FIRST, kinds), map(SECOND, kinds), offsets[1::2], offsets[2::2]))
+        except ValueError:
+            # An illegal character somewhere: let the token at a time path find it and report it like Lexer does
+            return super().make_tokens()
+        finally:
+            if collecting:
+                gc.enable()
+
+        if self.detect_records:
+            self.split_record_openings(tokens)
+        tokens.append(Token(TT_EOF, None, len(text), len(text)))
+        self.pos = len(text)
+        self.current_char = None
+        return tokens, None
+
+    # The '{' opening a record declaration is a token of its own, LEXEME_PATTERN reads it as the start of an
+    # identifier. Those identifiers are lexed again, one token at a time.
+    def split_record_openings(self, tokens):
+        for opening in sorted(self.structure_index().record_openings, reverse=True):
+            i = bisect_left(tokens, opening, key=START)
+            if i == len(tokens) or tokens[i].start != opening:
+                continue
+            end = tokens[i].end
+            pieces = [Token(TT_RECORD, 'R', opening, opening + 1)]
+            self.pos = opening + 1
+            while self.pos < end:
+                pieces.append(self.get_next_token())
+            tokens[i:i + 1] = pieces
+
+    # (type, value) of a lexeme matched by LEXEME_PATTERN, ValueError for one the lexer does not understand
+    @staticmethod
+    def lexeme_kind(lexeme):
+        char = lexeme[0]
+        if char.isalpha() or char in '{}':
+            reserved = RESERVED_TOKENS.get(lexeme)
+            if reserved:
+                return reserved.type, reserved.value
+            return TT_IDENTIFIER, lexeme
+        if char.isdigit():
+            return TT_INT, int(lexeme)
+        if lexeme in OPERATOR_TOKENS:
+            return OPERATOR_TOKENS[lexeme], lexeme
+        raise ValueError(lexeme)
+
+
+# lexeme -> (type, value), filled in as new lexemes show up
+class LexemeKinds(dict):
+
+    def __missing__(self, lexeme):
+        kind = self[lexeme] = FastLexer.lexeme_kind(lexeme)
+        return kind
+
+
+########################################################################################################################
+#   Streaming:
+#
+#   tokenize_file lexes a Micro-C file without ever holding all of it in memory. The file is read in buffered
+#   chunks and the tokens are handed out lazily, so a Parser can pull them straight from the generator.
+#
+#   A token never goes on past whitespace or past one of the single character tokens ; ( ) [ ] + - * / . (none of
+#   them starts or continues a longer lexeme), so each chunk is only lexed up to the last of those and the possibly
+#   unfinished lexeme after it is carried over into the next chunk. A token that spans a chunk boundary is therefore
+#   always lexed in one piece, and only what follows the last boundary is held back, however the file is laid out.
+#   Every piece is lexed knowing where it starts, so the tokens carry their offsets in the file and an error gives
+#   the line and column in the file.
+#
+#   Records are not detected: whether a '{' opens a record is only known at its matching '}', which may be any
+#   number of chunks later.
+########################################################################################################################
+
+CHUNK_SIZE = 1 << 20
+
+# A character after which a new lexeme always starts, searched for in the reversed chunk
+BOUNDARY_PATTERN = re.compile(r'[\s;()\[\]+\-*/.]')
+
+
+def tokenize_file(path, chunk_size=CHUNK_SIZE, encoding='utf-8'):
+    with open(path, encoding=encoding) as source:
+        yield from tokenize_chunks(iter(lambda: source.read(chunk_size), ''))
+
+
+def tokenize_chunks(chunks):
+    # The text after the last boundary, in the pieces it was read in
+    pending = []
+    # Where the next piece starts in the file
+    offset, line, column = 0, 1, 1
+    for chunk in chunks:
+        boundary = BOUNDARY_PATTERN.search(chunk[::-1])
+        if boundary is None:
+            pending.append(chunk)
+            continue
+        cut = len(chunk) - boundary.start()
+        pending.append(chunk[:cut])
+        text = ''.join(pending)
+        pending = [chunk[cut:]]
+        yield from lex_segment(text, offset, line, column)
+        offset += len(text)
+        newlines = text.count('\n')
+        if newlines:
+            line += newlines
+            column = len(text) - text.rfind('\n')
+        else:
+            column += len(text)
+
+    pending = ''.join(pending)
+    yield from lex_segment(pending, offset, line, column)
+    offset += len(pending)
+    yield Token(TT_EOF, None, offset, offset)
+
+
+# Lexes a complete piece of the program, leaving out the EOF token. offset, line and column are where the piece
+# starts in the file, the tokens and the errors are given in the file's positions.
+def lex_segment(text, offset=0, line=1, column=1):
+    if not text or text.isspace():
+        return ()
+    lexer = FastLexer(text)
+    lexer.lines = LineIndex(text, line, column)
+    tokens, error = lexer.make_tokens()
+    if error:
+        raise error
+    tokens.pop()
+    if offset:
+        for token in tokens:
+            token.start += offset
+            token.end += offset
+    return tokens
@@ -1,85 +1,246 @@
 from compiler.lexer import Lexer, Token
 from compiler.static import *
 
+########################################################################################################################
+#   AST nodes:
+#
+#   Every node class declares __slots__, so a node is a fixed size object without a __dict__. _num is the slot the
+#   ASTVisualizer numbers nodes with. Aliases (operation for token) and values that are only a copy of the token
+#   value are properties instead of extra slots, and nodes that are the same everywhere are shared: ZERO_NODE,
+#   NO_OP and the tokens of Record and If. The assignment a VariableDeclaration stands for is only built when it is
+#   asked for.
+########################################################################################################################
+
 class AST(object):
-    pass
+    __slots__ = ('_num',)
+
+    # The nodes below this one, in the order they are visited
+    def child_nodes(self):
+        return ()
 
 
 class Compound(AST):
     # Represents a list of statement nodes
+    __slots__ = ('children',)
+
     def __init__(self):
         self.children = []
-        
-class Assign(AST):
+
+    def child_nodes(self):
+        return self.children
+
+
+# Nodes whose token is their operator
+class Operation(AST):
+    __slots__ = ('token',)
+
+    @property
+    def operation(self):
+        return self.token
+
+
+# Nodes whose value is the value of their token
+class Leaf(AST):
+    __slots__ = ('token',)
+
+    def __init__(self, token):
+        self.token = token
+
+    @property
+    def value(self):
+        return self.token.value
+
+
+class Assign(Operation):
+    __slots__ = ('left', 'right')
+
     def __init__(self, left, right, operation):
         self.left = left
         self.right = right
-        self.token = self.operation = operation
+        self.token = operation
+
+    def child_nodes(self):
+        return self.left, self.right
         
-class ZeroNode(AST):
+class ZeroNode(Leaf):
+    __slots__ = ()
+
     def __init__(self):
-        self.token = Token(TT_ZERO, '0')
-        self.value = self.token.value
+        super().__init__(Token(TT_ZERO, '0'))
         
-class Variable(AST):
+class Variable(Leaf):
+    # slot is where the variable lives in the frame of a run, filled in by the SlotResolver. A record field is a
+    # variable named after the record and the field, e.g. R.fst
+    __slots__ = ('slot',)
+
     def __init__(self, token):
         self.token = token
-        self.value = token.value
+        self.slot = None
         
-class Type(AST):
-    def __init__(self, token):
-        self.token = token
-        self.value = token.value
+class Type(Leaf):
+    __slots__ = ()
         
 class NoOp(AST):
-    pass
+    __slots__ = ()
+
+
+ZERO_NODE = ZeroNode()
+NO_OP = NoOp()
+DECLARATION_ASSIGN_TOKEN = Token(TT_ASSIGN, ':=')
+
 
 class VariableDeclaration(AST):
+    __slots__ = ('type_node', 'var_node', '_assign_node')
+
     def __init__(self, type_node, var_node):
         self.type_node = type_node
         self.var_node = var_node
-        self.assign_node = Assign(self.var_node, ZeroNode(), Token(TT_ASSIGN, ':='))
+        self._assign_node = None
+
+    def child_nodes(self):
+        return self.type_node, self.var_node
+
+    # The declaration as the assignment var := 0
+    @property
+    def assign_node(self):
+        if self._assign_node is None:
+            self._assign_node = Assign(self.var_node, ZERO_NODE, DECLARATION_ASSIGN_TOKEN)
+        return self._assign_node
+
+# int[10] A
+class ArrayDeclaration(AST):
+    __slots__ = ('type_node', 'var_node', 'size')
+
+    def __init__(self, type_node, var_node, size):
+        self.type_node = type_node
+        self.var_node = var_node
+        self.size = size
+
+    def child_nodes(self):
+        return self.type_node, self.var_node
+
+# A[index]; length is the number of elements of the array, filled in by the SlotResolver
+class ArrayElement(AST):
+    __slots__ = ('var_node', 'index', 'length')
+
+    def __init__(self, var_node, index):
+        self.var_node = var_node
+        self.index = index
+        self.length = None
+
+    def child_nodes(self):
+        return self.var_node, self.index
+
+class UnaryOp(Operation):
+    __slots__ = ('expression',)
 
-class UnaryOp(AST):
     def __init__(self, operation, expression):
-        self.token = self.operation = operation
+        self.token = operation
         self.expression = expression
 
-class BinOp(AST):
+    def child_nodes(self):
+        return self.expression,
+
+class BinOp(Operation):
+    __slots__ = ('left', 'right')
+
     def __init__(self, left, right, operation):
         self.left = left
         self.right = right
-        self.token = self.operation = operation
+        self.token = operation
+
+    def child_nodes(self):
+        return self.left, self.right
         
 class Record(AST):
+    __slots__ = ('children',)
+    token = Token('R', 'R')
+
     def __init__(self, children):
         self.children = children
-        self.token = Token('R', 'R')
 
-class Condition(AST):
+    def child_nodes(self):
+        return self.children
+
+class Condition(Operation):
+    __slots__ = ('left', 'right')
+
     def __init__(self, left, right, operation):
         self.left = left
         self.right = right
-        self.token = self.operation = operation
+        self.token = operation
+
+    def child_nodes(self):
+        return self.left, self.right
 
 class If(AST):
+    __slots__ = ('condition', 'children')
+    token = Token('If', 'If')
+
     def __init__(self, condition, children):
         self.condition = condition
         self.children = children
-        self.token = Token('If', 'If')
 
-class Integer(AST):
-    def __init__(self, token):
-        self.token = token
-        self.value = token.value
+    def child_nodes(self):
+        return self.condition, self.children
+
+class While(AST):
+    __slots__ = ('condition', 'children')
+    token = Token('While', 'While')
+
+    def __init__(self, condition, children):
+        self.condition = condition
+        self.children = children
+
+    def child_nodes(self):
+        return self.condition, self.children
+
+class Integer(Leaf):
+    __slots__ = ()
+
+# How tightly each operator binds as (infix operator, prefix operator); None where it cannot be used that way
+BINDING_POWER = {
+    TT_OR: (1, None),
+    TT_AND: (2, None),
+    TT_NOT: (None, 3),
+    TT_EE: (4, None),
+    TT_NE: (4, None),
+    TT_LT: (4, None),
+    TT_GT: (4, None),
+    TT_LTE: (4, None),
+    TT_GTE: (4, None),
+    TT_PLUS: (5, 7),
+    TT_MINUS: (5, 7),
+    TT_MUL: (6, None),
+    TT_DIV: (6, None),
+}
+NO_BINDING_POWER = (None, None)
+# An open parenthesis on the operator stack, it binds less tightly than any operator
+PAREN_POWER = -1
+
+# Operators that build a Condition, the others build a BinOp
+CONDITION_OPERATORS = {TT_OR, TT_AND, TT_EE, TT_NE, TT_LT, TT_GT, TT_LTE, TT_GTE}
 
 class Parser(object):
     
-    def __init__(self, lexer):
+    def __init__(self, lexer, tracer=None):
+        # lexer is anything with get_next_token(), or an iterable of tokens ending with EOF (e.g. tokenize_file)
         self.lexer = lexer
-        self.curr_token = self.lexer.get_next_token()
+        if hasattr(lexer, 'get_next_token'):
+            self.next_token = lexer.get_next_token
+        else:
+            self.next_token = iter(lexer).__next__
+        self.curr_token = self.next_token()
+        # A ParseTracer (compiler/trace.py) wraps this parser's methods; without one nothing is recorded
+        if tracer is not None:
+            tracer.attach(self)
         
     def error(self):
+        # Tokens only carry offsets, the lexer (or token buffer) turns them into a line and column
+        start = getattr(self.curr_token, 'start', None)
+        if start is not None and hasattr(self.lexer, 'line_index'):
+            line, column = self.lexer.line_index().line_col(start)
+            raise Exception('Invalid syntax at line {}, column {}'.format(line, column))
         raise Exception('Invalid syntax')
         
     def consume(self, token_type):
@@ -87,85 +248,100 @@ class Parser(object):
         # compare it with the passed token type, if 
         # there is a match, consume the token, otherwise
         # raise exception
-        print(self.curr_token.type, token_type)
         if self.curr_token.type == token_type: 
-            self.curr_token = self.lexer.get_next_token()
+            self.curr_token = self.next_token()
         else:
-            print('consume error')
             self.error()
             
-    def parse_factor(self):
+    # Operator precedence parser used for every expression and condition. An operator waits on an explicit stack
+    # until one that binds less tightly (or the end of the expression) shows up, so neither long operator chains
+    # nor deep parentheses recurse. Outside of parentheses it stops before the first infix operator that binds
+    # less tightly than min_power.
+    def parse_operators(self, min_power=0):
+        operands = []
+        operators = []
+        open_parens = 0
+
+        while True:
+            # Operand position: any number of prefix operators and open parentheses, then a value
+            token = self.curr_token
+            prefix_power = BINDING_POWER.get(token.type, NO_BINDING_POWER)[1]
+            if prefix_power is not None:
+                self.consume(token.type)
+                operators.append((prefix_power, token, True))
+                continue
+            if token.type == TT_L_PAREN:
+                self.consume(TT_L_PAREN)
+                operators.append((PAREN_POWER, token, False))
+                open_parens += 1
+                continue
+            operands.append(self.parse_operand())
+
+            # Operator position: close parentheses, then an infix operator or the end of the expression
+            while self.curr_token.type == TT_R_PAREN and open_parens:
+                while operators[-1][0] != PAREN_POWER:
+                    self.reduce(operands, operators)
+                operators.pop()
+                open_parens -= 1
+                self.consume(TT_R_PAREN)
+
+            token = self.curr_token
+            power = BINDING_POWER.get(token.type, NO_BINDING_POWER)[0]
+            if power is None or (power < min_power and not open_parens):
+                break
+            while operators and operators[-1][0] >= power:
+                self.reduce(operands, operators)
+            self.consume(token.type)
+            operators.append((power, token, False))
+
+        if open_parens:
+            self.error()
+        while operators:
+            self.reduce(operands, operators)
+        return operands.pop()
+
+    # Replaces the operator on top of the stack and its operands with the node they form
+    @staticmethod
+    def reduce(operands, operators):
+        power, token, prefix = operators.pop()
+        if prefix:
+            operands.append(UnaryOp(token, operands.pop()))
+            return
+        right = operands.pop()
+        left = operands.pop()
+        if token.type in CONDITION_OPERATORS:
+            operands.append(Condition(left=left, right=right, operation=token))
+        else:
+            operands.append(BinOp(left=left, right=right, operation=token))
+
+    def parse_operand(self):
         token = self.curr_token
-        if token.type == TT_PLUS:
-            self.consume(TT_PLUS)
-            node = UnaryOp(token, self.parse_factor())
-            return node
-        elif token.type == TT_MINUS:
-            self.consume(TT_MINUS)
-            node = UnaryOp(token, self.parse_factor())
-            return node
-        elif token.type == TT_INT:
+        if token.type == TT_INT:
             self.consume(TT_INT)
             return Integer(token)
-        elif token.type == TT_L_PAREN:
-            self.consume(TT_L_PAREN)
-            node = self.parse_expression()
-            self.consume(TT_R_PAREN)
-            return node
-        else:
-            node = self.parse_assign_statement()
-            return node
-        
-    def parse_term(self):
-        node = self.parse_factor()
-        while self.curr_token.type in (TT_MUL, TT_DIV):
-            token = self.curr_token
-            if token.type == TT_MUL:
-                self.consume(TT_MUL)
-            elif token.type == TT_DIV:
-                self.consume(TT_DIV)
-                
-            node = BinOp(left=node, right=self.parse_factor(), operation=token)
-        return node
+        if token.type == TT_IDENTIFIER or token.type == TT_RECORD:
+            variable = self.parse_reference()
+            # An assignment inside an expression, e.g. a := b := 1
+            if self.curr_token.type == TT_ASSIGN:
+                return self.parse_assignment(variable)
+            return variable
+        self.error()
 
+    def parse_factor(self):
+        return self.parse_operators(BINDING_POWER[TT_MINUS][1])
 
+    def parse_term(self):
+        return self.parse_operators(BINDING_POWER[TT_MUL][0])
 
     def parse_condition(self):
-        node = self.parse_term()
+        return self.parse_operators()
 
-        while self.curr_token.type in (TT_LT, TT_GT, TT_LTE, TT_GTE):
-            token = self.curr_token
-            if token.type == TT_LT:
-                self.consume(TT_LT)
-            elif token.type == TT_LTE:
-                self.consume(TT_LTE)
-            elif token.type == TT_GT:
-                self.consume(TT_GT)
-            elif token.type == TT_GTE:
-                self.consume(TT_GTE)
-
-            node = Condition(left=node, right=self.parse_factor(), operation=token)
-        return node
-
-    
     def parse_expression(self):
-        node = self.parse_term()
-        
-        while self.curr_token.type in (TT_PLUS, TT_MINUS):
-            token = self.curr_token
-            if token.type == TT_PLUS:
-                self.consume(TT_PLUS)
-            elif token.type == TT_MINUS:
-                self.consume(TT_MINUS)
-                
-            node = BinOp(left=node, right=self.parse_term(), operation=token)
-        
-        return node
+        return self.parse_operators()
     
     def parse(self):
         node = self.parse_program()
         if self.curr_token.type != TT_EOF and self.curr_token.type != TT_RECORD:
-            print('parse error')
             self.error()
             
         return node
@@ -193,7 +369,6 @@ class Parser(object):
             self.consume(TT_SEMI)
             results.append(self.parse_statement())
         if self.curr_token.type == TT_IDENTIFIER:
-            print('statement error')
             self.error()
         return results
         
@@ -206,13 +381,19 @@ class Parser(object):
             node = self.parse_variable_declaration()
         elif self.curr_token.type == TT_RECORD:
             node = self.parse_record()
+        elif self.curr_token.type == TT_IF:
+            node = self.parse_if()
+        elif self.curr_token.type == TT_WHILE:
+            node = self.parse_while()
         else:
             node = self.empty()
         return node
     
             
     def parse_assign_statement(self):
-        left = self.parse_variable()
+        return self.parse_assignment(self.parse_reference())
+
+    def parse_assignment(self, left):
         token = self.curr_token
         self.consume(TT_ASSIGN)
         right = self.parse_expression()
@@ -224,6 +405,26 @@ class Parser(object):
         node = Variable(self.curr_token)
         self.consume(TT_IDENTIFIER)
         return node
+
+    # What can be read or assigned: a variable, an array element A[i] or a record field R.fst
+    def parse_reference(self):
+        if self.curr_token.type == TT_RECORD:
+            token = self.curr_token
+            self.consume(TT_RECORD)
+            return self.parse_field(token)
+        node = self.parse_variable()
+        if self.curr_token.type == TT_L_SQUARE:
+            self.consume(TT_L_SQUARE)
+            node = ArrayElement(node, self.parse_expression())
+            self.consume(TT_R_SQUARE)
+        return node
+
+    def parse_field(self, record):
+        self.consume(TT_METHOD)
+        field = self.curr_token
+        self.consume(TT_IDENTIFIER)
+        name = '{}.{}'.format(record.value, field.value)
+        return Variable(Token(TT_IDENTIFIER, name, record.start, field.end))
     
     def parse_type(self):
         token = self.curr_token
@@ -234,19 +435,35 @@ class Parser(object):
     
     def parse_variable_declaration(self):
         type_node = self.parse_type()
+        if self.curr_token.type == TT_L_SQUARE:
+            return self.parse_array_declaration(type_node)
         var_node = self.parse_variable()
         declaration = VariableDeclaration(type_node, var_node)
         return declaration
+
+    def parse_array_declaration(self, type_node):
+        self.consume(TT_L_SQUARE)
+        size = self.curr_token
+        self.consume(TT_INT)
+        if size.value < 1:
+            self.error()
+        self.consume(TT_R_SQUARE)
+        var_node = self.parse_variable()
+        return ArrayDeclaration(type_node, var_node, size.value)
     
     def empty(self):
-        return NoOp()
+        return NO_OP
     
     def parse_record(self):
-        # self.consume(TT_L_BRACKET)
+        # {int fst; int snd} R lexed with detect_records: RECORD fields R_BRACKET RECORD
+        token = self.curr_token
+        self.consume(TT_RECORD)
+        # R.fst := ... is an assignment to a field
+        if self.curr_token.type == TT_METHOD:
+            return self.parse_assignment(self.parse_field(token))
         nodes = self.parse_statement_list()
-        # self.consume(TT_R_BRACKET)
+        self.consume(TT_R_BRACKET)
         self.consume(TT_RECORD)
-        self.consume(TT_SEMI)
         root = Record(nodes)
         # for node in nodes:
         #     root.children.append(node)        
@@ -259,25 +476,72 @@ class Parser(object):
         node = If(condition=condition, children=children)
         return node
 
+    def parse_while(self):
+        self.consume(TT_WHILE)
+        condition = self.parse_condition()
+        children = self.parse_compound_statement()
+        node = While(condition=condition, children=children)
+        return node
+
 
         
     
 class Traversal(object):
-    GLOBAL_SCOPE = {}
+
+    # Node class -> visit_ function of this visitor class. Every subclass gets its own table, filled in the first
+    # time it meets a node class, so visiting a node is one dict lookup instead of building a name and a getattr.
+    dispatch = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.dispatch = {}
+
+    @classmethod
+    def resolve(cls, node_class):
+        visitor = getattr(cls, 'visit_' + node_class.__name__, cls.visit_exception)
+        cls.dispatch[node_class] = visitor
+        return visitor
         
+    # Runs the program in a frame of its own and returns the values of its outermost variables
+    def run(self, tree, **variables):
+        self.layout = SlotResolver().resolve(tree)
+        self.frame = self.layout.new_frame(variables)
+        self.visit_node(tree)
+        return self.layout.values(self.frame)
+
     def visit_node(self, node):
-        method_name = 'visit_' + type(node).__name__
-        visitor = getattr(self, method_name, self.visit_exception)
-        return visitor(node)
+        try:
+            visitor = self.dispatch[type(node)]
+        except KeyError:
+            visitor = self.resolve(type(node))
+        return visitor(self, node)
+
+    # Non recursive traversal with an explicit stack, for trees too deep for visit_node. pre(node) is called before
+    # the children of a node (returning False skips them), post(node) after them. Children are visited in order.
+    @staticmethod
+    def walk(node, pre=None, post=None):
+        stack = [(node, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if children_done:
+                post(node)
+                continue
+            if pre is not None and pre(node) is False:
+                continue
+            if post is not None:
+                stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.child_nodes()))
     
     def visit_exception(self, node):
         raise Exception('No visit_{} method'.format(type(node).__name__))
     
     def visit_UnaryOp(self, node):
-        if node.operaion.type == TT_PLUS:
+        if node.operation.type == TT_PLUS:
             return +self.visit_node(node.expression)
-        if node.operaion.type == TT_MINUS:
+        if node.operation.type == TT_MINUS:
             return -self.visit_node(node.expression)
+        if node.operation.type == TT_NOT:
+            return not self.visit_node(node.expression)
         
     def visit_BinOp(self, node):
         if node.operation.type == TT_PLUS:
@@ -290,7 +554,7 @@ class Traversal(object):
             return self.visit_node(node.left) / self.visit_node(node.right)
 
     def visit_Integer(self, node):
-        return node.value.value
+        return node.value
     
     def visit_Compound(self, node):
         for child in node.children:
@@ -300,37 +564,205 @@ class Traversal(object):
         pass
     
     def visit_Assign(self, node):
-        var_name = node.left.value
-        self.GLOBAL_SCOPE[var_name] = self.visit_node(node.right)
+        value = self.visit_node(node.right)
+        left = node.left
+        if type(left) is ArrayElement:
+            index = check_index(self.visit_node(left.index), left.length, left.var_node.value)
+            self.frame[left.var_node.slot + index] = value
+        else:
+            self.frame[left.slot] = value
+        return value
     
     def visit_Variable(self, node):
-        var_name = node.value
-        val = self.GLOBAL_SCOPE.get(var_name)
+        val = self.frame[node.slot]
         if val is None:
-            raise NameError(repr(var_name))
+            raise NameError(repr(node.value))
         else:
             return val
+
+    def visit_ArrayElement(self, node):
+        index = check_index(self.visit_node(node.index), node.length, node.var_node.value)
+        return self.frame[node.var_node.slot + index]
         
     def visit_VariableDeclaration(self, node):
-        # Do nothing
-        pass
+        # A declaration sets the variable to 0
+        self.visit_node(node.assign_node)
+
+    def visit_ArrayDeclaration(self, node):
+        # Every element starts at 0
+        slot = node.var_node.slot
+        self.frame[slot:slot + node.size] = [0] * node.size
 
     def visit_Type(self, node):
         # Do nothing
         pass
     
     def visit_ZeroNode(self, node):
-        # Do nothing
-        pass
+        return 0
     
     def visit_Record(self, node):
-        pass
+        # The fields are declarations
+        for child in node.children:
+            self.visit_node(child)
 
     def visit_If(self, node):
-        pass
+        if self.visit_node(node.condition):
+            self.visit_node(node.children)
+
+    def visit_While(self, node):
+        while self.visit_node(node.condition):
+            self.visit_node(node.children)
 
+    # AND and OR short circuit like Python's and / or
     def visit_Condition(self, node):
-        pass
+        operation = node.operation.type
+        left = self.visit_node(node.left)
+        if operation == TT_AND:
+            return left and self.visit_node(node.right)
+        if operation == TT_OR:
+            return left or self.visit_node(node.right)
+        right = self.visit_node(node.right)
+        if operation == TT_LT:
+            return left < right
+        elif operation == TT_GT:
+            return left > right
+        elif operation == TT_LTE:
+            return left <= right
+        elif operation == TT_GTE:
+            return left >= right
+        elif operation == TT_EE:
+            return left == right
+        elif operation == TT_NE:
+            return left != right
+
+
+########################################################################################################################
+#   Slot resolution:
+#
+#   Before a program runs, the SlotResolver gives every variable an integer slot in a frame, a plain list holding
+#   the values of one run. Each Variable node is given the slot of the variable it refers to, so a lookup is an
+#   index into the frame instead of a dict lookup by name, and two runs never share their variables.
+#
+#   Every { } block is a scope: a declaration in it is a new variable, hiding one with the same name outside the
+#   block until the block ends. A variable used without being declared belongs to the outermost scope. An array
+#   (int[10] A) takes one slot per element and a record field is its own variable (R.fst). A slot holds None until
+#   its variable is set.
+########################################################################################################################
+
+class Layout:
+
+    def __init__(self):
+        # Number of slots in a frame
+        self.size = 0
+        # slot -> name of the variable that starts there, None for the other elements of an array
+        self.names = []
+        # The variables of the outermost scope: name -> (slot, length), length is None unless it is an array
+        self.variables = {}
+
+    def allocate(self, name, length=None):
+        slot = self.size
+        self.size += 1 if length is None else length
+        self.names.append(name)
+        self.names.extend([None] * (self.size - slot - 1))
+        return slot
+
+    # A new frame, with the given starting values for variables of the outermost scope (other names are ignored)
+    def new_frame(self, variables=None):
+        frame = [None] * self.size
+        for name, value in (variables or {}).items():
+            if name not in self.variables:
+                continue
+            slot, length = self.variables[name]
+            if length is None:
+                frame[slot] = value
+            elif len(value) != length:
+                raise Exception('Array {} has {} elements, got {} values'.format(name, length, len(value)))
+            else:
+                frame[slot:slot + length] = value
+        return frame
+
+    # The values of the outermost variables, leaving out the ones that were never set
+    def values(self, frame):
+        values = {}
+        for name, (slot, length) in self.variables.items():
+            if frame[slot] is None:
+                continue
+            values[name] = frame[slot] if length is None else frame[slot:slot + length]
+        return values
+
+
+def check_index(index, length, name):
+    if not 0 <= index < length:
+        raise IndexError('Index {} is out of range for {}[{}]'.format(index, name, length))
+    return index
+
+
+class SlotResolver:
+
+    def __init__(self):
+        self.layout = Layout()
+        # Name -> (slot, length) for every open scope, the innermost last
+        self.scopes = [self.layout.variables]
+        self.root = None
+        self.record = None
+        self.array_variable = None
+
+    def resolve(self, tree):
+        self.root = tree
+        Traversal.walk(tree, self.enter, self.leave)
+        return self.layout
+
+    def lookup(self, name):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        # Used without a declaration
+        slot = self.layout.allocate(name)
+        self.scopes[0][name] = slot, None
+        return slot, None
 
+    def declare(self, name, length=None):
+        if self.record is not None:
+            name = '{}.{}'.format(self.record, name)
+        scope = self.scopes[-1]
+        # Declaring a name again in the same scope keeps its slot if it has the same shape
+        if name in scope and scope[name][1] == length:
+            return scope[name][0]
+        slot = self.layout.allocate(name, length)
+        scope[name] = slot, length
+        return slot
 
+    def enter(self, node):
+        node_type = type(node)
+        if node_type is Variable:
+            # The name of an indexed array was resolved by its ArrayElement
+            if node is self.array_variable:
+                return
+            node.slot, length = self.lookup(node.value)
+            if length is not None:
+                raise Exception('Array {} is used without an index'.format(node.value))
+        elif node_type is ArrayElement:
+            name = node.var_node.value
+            node.var_node.slot, node.length = self.lookup(name)
+            if node.length is None:
+                raise Exception('{} is not an array'.format(name))
+            self.array_variable = node.var_node
+        elif node_type is VariableDeclaration:
+            node.var_node.slot = self.declare(node.var_node.value)
+            return False
+        elif node_type is ArrayDeclaration:
+            node.var_node.slot = self.declare(node.var_node.value, node.size)
+            return False
+        elif node_type is Compound:
+            if node is not self.root:
+                self.scopes.append({})
+        elif node_type is Record:
+            self.record = node.token.value
 
+    def leave(self, node):
+        node_type = type(node)
+        if node_type is Compound:
+            if node is not self.root:
+                self.scopes.pop()
+        elif node_type is Record:
+            self.record = None
@@ -17,6 +17,7 @@ TT_POW = 'POW'  # ^
 TT_EQUALS = 'EQUALS'  # =
 
 TT_IF = 'IF'
+TT_WHILE = 'WHILE'
 
 # Scopes
 TT_L_PAREN = 'L_PAREN'  # (
@@ -40,6 +41,9 @@ TT_LT = 'LT'  # <
 TT_GT = 'GT'  # >
 TT_LTE = 'LTE'  # <=
 TT_GTE = 'GTE'  # >=
+TT_AND = 'AND'
+TT_OR = 'OR'
+TT_NOT = 'NOT'
 
 TT_EOF = 'EOF'
 TT_SEMI = 'SEMI' # ;
@@ -60,4 +64,21 @@ KEYWORDS = [
     'BREAK'
 ]
 
-TT_ZERO = '0'
\ No newline at end of file
+TT_ZERO = '0'
+
+# Interned integer codes for the token types, used by the compact token store (compiler/tokenbuffer.py)
+TOKEN_TYPES = [
+    TT_INT, TT_FLOAT, TT_STRING, TT_RECORD,
+    TT_VAR_INT, TT_VAR_TYPE,
+    TT_PLUS, TT_MINUS, TT_MUL, TT_DIV, TT_POW, TT_EQUALS,
+    TT_IF,
+    TT_L_PAREN, TT_R_PAREN, TT_L_BRACKET, TT_R_BRACKET, TT_L_SQUARE, TT_R_SQUARE,
+    TT_IDENTIFIER, TT_KEYWORD, TT_METHOD, TT_EL,
+    TT_ASSIGN, TT_EE, TT_NE, TT_LT, TT_GT, TT_LTE, TT_GTE,
+    TT_EOF, TT_SEMI,
+    TT_ZERO,
+    TT_AND, TT_OR, TT_NOT,
+    TT_WHILE
+]
+
+TYPE_CODES = {token_type: code for code, token_type in enumerate(TOKEN_TYPES)}
@@ -0,0 +1,172 @@
+########################################################################################################################
+#   TokenBuffer:
+#
+#   A compact token store for large programs. Instead of one Token object per token it keeps parallel arrays
+#       types       interned integer type code of every token (see TOKEN_TYPES / TYPE_CODES in compiler/static.py)
+#       value_ids   index of the token value in the interned values list, or TEXT_VALUE when the value is just
+#                   the lexeme itself (identifiers) or its number (integers) and is read back from the text
+#       starts      offset of the first character of the token in the text
+#       ends        offset just past the last character of the token
+#
+#   Token objects are only created on demand, as TokenView objects that read straight out of the arrays. A view
+#   has the same type / value attributes as a Token, so a TokenBuffer can be handed to the Parser directly.
+########################################################################################################################
+from array import array
+
+from compiler.lexer import FastLexer, LineIndex, LEXEME_PATTERN
+from compiler.static import *
+
+TEXT_VALUE = -1
+
+
+class TokenView:
+    __slots__ = ('buffer', 'index')
+
+    def __init__(self, buffer, index):
+        self.buffer = buffer
+        self.index = index
+
+    @property
+    def type(self):
+        return TOKEN_TYPES[self.buffer.types[self.index]]
+
+    @property
+    def value(self):
+        return self.buffer.value(self.index)
+
+    @property
+    def start(self):
+        return self.buffer.starts[self.index]
+
+    @property
+    def end(self):
+        return self.buffer.ends[self.index]
+
+    def __repr__(self):
+        return 'Token({type}, {value})'.format(
+            type=self.type,
+            value=repr(self.value)
+        )
+
+
+class TokenBuffer:
+
+    def __init__(self, text):
+        self.text = text
+        self.lines = None
+        self.clear()
+
+    def clear(self):
+        self.types = array('B')
+        self.value_ids = array('i')
+        self.starts = array('i')
+        self.ends = array('i')
+        self.values = []
+        self.value_codes = {}
+        # Read position of get_next_token
+        self.pos = 0
+
+    # Lexes text straight into a new buffer
+    @classmethod
+    def from_text(cls, text, detect_records=False):
+        buffer = cls(text)
+        if not text.isascii() or detect_records or not buffer.extend_fast():
+            buffer.extend_from_lexer(FastLexer(text, detect_records) if text else None)
+        return buffer
+
+    def intern(self, value):
+        value_id = self.value_codes.get(value)
+        if value_id is None:
+            value_id = self.value_codes[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+    # Id to store for a token value: TEXT_VALUE if it can be read back from the lexeme, else the interned value
+    def value_id(self, token_type, value, lexeme):
+        if token_type == TT_IDENTIFIER and value == lexeme:
+            return TEXT_VALUE
+        if token_type == TT_INT and lexeme.isdigit() and value == int(lexeme):
+            return TEXT_VALUE
+        return self.intern(value)
+
+    def value(self, index):
+        value_id = self.value_ids[index]
+        if value_id != TEXT_VALUE:
+            return self.values[value_id]
+        lexeme = self.text[self.starts[index]:self.ends[index]]
+        return int(lexeme) if self.types[index] == TYPE_CODES[TT_INT] else lexeme
+
+    def append(self, token_type, value, start, end):
+        self.types.append(TYPE_CODES[token_type])
+        self.value_ids.append(self.value_id(token_type, value, self.text[start:end]))
+        self.starts.append(start)
+        self.ends.append(end)
+
+    # ASCII only path: one LEXEME_PATTERN match per token, every distinct lexeme is classified once.
+    # Returns False (leaving the buffer empty) if the text has a character the lexer would reject.
+    def extend_fast(self):
+        codes_by_lexeme = {}
+        types_append = self.types.append
+        value_ids_append = self.value_ids.append
+        starts_append = self.starts.append
+        ends_append = self.ends.append
+
+        for m in LEXEME_PATTERN.finditer(self.text):
+            lexeme = m.group()
+            codes = codes_by_lexeme.get(lexeme)
+            if codes is None:
+                try:
+                    token_type, value = FastLexer.lexeme_kind(lexeme)
+                except ValueError:
+                    self.clear()
+                    return False
+                codes = (TYPE_CODES[token_type], self.value_id(token_type, value, lexeme))
+                codes_by_lexeme[lexeme] = codes
+            start, end = m.span()
+            types_append(codes[0])
+            value_ids_append(codes[1])
+            starts_append(start)
+            ends_append(end)
+
+        self.append(TT_EOF, None, len(self.text), len(self.text))
+        return True
+
+    # General path: pulls tokens from a lexer (errors are raised as is)
+    def extend_from_lexer(self, lexer):
+        if lexer is None:
+            self.append(TT_EOF, None, 0, 0)
+            return
+        while True:
+            token = lexer.get_next_token()
+            self.append(token.type, token.value, token.start, token.end)
+            if token.type == TT_EOF:
+                return
+
+    def line_index(self):
+        if self.lines is None:
+            self.lines = LineIndex(self.text)
+        return self.lines
+
+    # Bytes held by the arrays (the few interned values are shared between all tokens)
+    def nbytes(self):
+        return sum(a.itemsize * len(a) for a in (self.types, self.value_ids, self.starts, self.ends))
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.types)
+        if not 0 <= index < len(self.types):
+            raise IndexError('token index out of range')
+        return TokenView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.types)):
+            yield TokenView(self, index)
+
+    # Lets a Parser read from the buffer like from a lexer; keeps returning EOF at the end
+    def get_next_token(self):
+        index = min(self.pos, len(self.types) - 1)
+        self.pos += 1
+        return TokenView(self, index)
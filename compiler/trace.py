@@ -0,0 +1,60 @@
+########################################################################################################################
+#   ParseTracer:
+#
+#   Records what a Parser does into a ring buffer that only keeps the last `capacity` events. Each event is a tuple
+#       (kind, name, token type, token value, token start offset)
+#   where kind is 'enter' (name is the parse_* rule), 'consume' (name is the expected token type) or 'error'.
+#
+#   A Parser without a tracer runs its methods untouched. A tracer is attached by shadowing the parse_* methods,
+#   consume and error on that one parser instance with recording wrappers, so tracing costs nothing unless it is
+#   switched on.
+########################################################################################################################
+import sys
+from collections import deque
+
+
+class ParseTracer:
+
+    def __init__(self, capacity=10000):
+        self.events = deque(maxlen=capacity)
+
+    def attach(self, parser):
+        for name in dir(type(parser)):
+            if name == 'parse' or name.startswith('parse_'):
+                setattr(parser, name, self.trace_rule(parser, name, getattr(parser, name)))
+        parser.consume = self.trace_consume(parser, parser.consume)
+        parser.error = self.trace_error(parser, parser.error)
+
+    def record(self, kind, name, token):
+        self.events.append((kind, name, token.type, token.value, getattr(token, 'start', None)))
+
+    def trace_rule(self, parser, name, method):
+        record = self.record
+
+        def traced(*args, **kwargs):
+            record('enter', name, parser.curr_token)
+            return method(*args, **kwargs)
+        return traced
+
+    def trace_consume(self, parser, method):
+        record = self.record
+
+        def traced(token_type):
+            record('consume', token_type, parser.curr_token)
+            return method(token_type)
+        return traced
+
+    def trace_error(self, parser, method):
+        record = self.record
+
+        def traced():
+            record('error', 'error', parser.curr_token)
+            return method()
+        return traced
+
+    def clear(self):
+        self.events.clear()
+
+    def dump(self, stream=sys.stdout):
+        for kind, name, token_type, value, start in self.events:
+            stream.write('{:<8} {:<28} {} {!r} @{}\n'.format(kind, name, token_type, value, start))
@@ -0,0 +1,364 @@
+########################################################################################################################
+#   Analysis daemon:
+#
+#   A long running server for tools that send many small requests. It answers JSON-RPC 2.0 requests, one per line,
+#   on a Unix domain socket (or on stdin / stdout with --stdio):
+#       tokenize    text, detect_records                                    -> {'tokens': [[type, value, start, end]]}
+#       parse       text, detect_records, binary                            -> {'nodes': n, 'ast': base64}
+#       gendot      text, detect_records, max_nodes, max_depth, path, source_range     -> {'dot': text}
+#       analyze     text, detect_records, analysis, worklist                -> {'facts': [...], 'edges': [...], ...}
+#       stats       the cache statistics of the worker that answers
+#       shutdown    stops the daemon
+#
+#   An asyncio loop reads the requests and hands the work to a pool of worker processes (a thread with --workers 0),
+#   so a long request does not hold up the others; responses are sent as they are ready, matched by their id.
+#   Every worker keeps its lexer and parser imported and the trees and program graphs of the last texts it saw in
+#   LRU caches (in front of the on-disk ASTCache with --cache-dir), so a request only pays for the work itself.
+#
+#   python daemon.py --socket /tmp/microc.sock --workers 2
+#   python client.py parse program.mc --socket /tmp/microc.sock
+########################################################################################################################
+import argparse
+import asyncio
+import base64
+import inspect
+import json
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from client import DEFAULT_SOCKET
+from compiler import astformat
+from compiler.cache import ASTCache
+from compiler.graph import build_program_graph
+from compiler.lexer import FastLexer
+from compiler.parser import Parser, Traversal
+from compiler.static import TT_EOF
+from dataflow import ANALYSES, WORKLISTS, solve
+from genastdot import ASTVisualizer
+
+# Longest request line, a request carries the whole program text
+LINE_LIMIT = 1 << 28
+
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+ANALYSIS_ERROR = -32000
+
+
+class InvalidParams(Exception):
+    pass
+
+
+class WorkerState:
+    # The warm caches of one worker
+
+    def __init__(self, cache_size=128, cache_dir=None):
+        self.cache_size = cache_size
+        self.ast_cache = ASTCache(cache_dir) if cache_dir is not None else None
+        # (text, detect_records) -> tree / program graph, least recently used first
+        self.trees = OrderedDict()
+        self.graphs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def remember(self, table, key, build):
+        value = table.get(key)
+        if value is not None:
+            table.move_to_end(key)
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = table[key] = build()
+        if len(table) > self.cache_size:
+            table.popitem(last=False)
+        return value
+
+    def tree(self, text, detect_records):
+        if self.ast_cache is not None:
+            build = lambda: self.ast_cache.parse(text, detect_records)
+        else:
+            build = lambda: Parser(FastLexer(text, detect_records)).parse()
+        return self.remember(self.trees, (text, detect_records), build)
+
+    def graph(self, text, detect_records):
+        # The graph builder resolves the slots of the tree it is given, so it gets a tree of its own
+        build = lambda: build_program_graph(Parser(FastLexer(text, detect_records)).parse())
+        return self.remember(self.graphs, (text, detect_records), build)
+
+
+# The state of the worker this process (or thread) is, set up by init_worker
+state = None
+
+
+def init_worker(cache_size, cache_dir):
+    global state
+    state = WorkerState(cache_size, cache_dir)
+
+
+def tokenize(text, detect_records=False):
+    lexer = FastLexer(text, detect_records)
+    tokens = []
+    token = lexer.get_next_token()
+    while token.type != TT_EOF:
+        tokens.append([token.type, token.value, token.start, token.end])
+        token = lexer.get_next_token()
+    return {'tokens': tokens}
+
+
+def parse(text, detect_records=False, binary=False):
+    tree = state.tree(text, detect_records)
+    count = 0
+
+    def pre(node):
+        nonlocal count
+        count += 1
+
+    Traversal.walk(tree, pre)
+    result = {'nodes': count}
+    if binary:
+        result['ast'] = base64.b64encode(astformat.dumps(tree)).decode('ascii')
+    return result
+
+
+def gendot(text, detect_records=False, max_nodes=None, max_depth=None, path=None, source_range=None):
+    tree = state.tree(text, detect_records)
+    visualizer = ASTVisualizer(None, max_nodes, max_depth, path and tuple(path), source_range and tuple(source_range))
+    return {'dot': visualizer.gendot(tree)}
+
+
+def analyze(text, detect_records=False, analysis='rd', worklist='scc'):
+    if analysis not in ANALYSES:
+        raise InvalidParams('Unknown analysis {!r}, expected one of {}'.format(analysis, ', '.join(ANALYSES)))
+    if worklist not in WORKLISTS:
+        raise InvalidParams('Unknown worklist {!r}, expected one of {}'.format(worklist, ', '.join(WORKLISTS)))
+    graph = state.graph(text, detect_records)
+    solution = solve(ANALYSES[analysis](graph), worklist)
+    return {
+        'edges': [[graph.sources[edge], graph.targets[edge], graph.action(edge).text]
+                  for edge in range(graph.edge_count)],
+        'facts': [solution.facts(node) for node in range(graph.node_count)],
+        'stats': solution.stats,
+    }
+
+
+def stats():
+    return {'pid': os.getpid(), 'hits': state.hits, 'misses': state.misses, 'trees': len(state.trees),
+            'graphs': len(state.graphs)}
+
+
+METHODS = {
+    'tokenize': tokenize,
+    'parse': parse,
+    'gendot': gendot,
+    'analyze': analyze,
+    'stats': stats,
+}
+
+
+# Runs in a worker. Errors come back as (code, message), exceptions do not all survive being pickled.
+def run_method(method, params):
+    function = METHODS[method]
+    # Only a mismatch with the signature is the caller's fault, a TypeError from the work itself is not
+    try:
+        inspect.signature(function).bind(**params)
+    except TypeError as error:
+        return (INVALID_PARAMS, str(error)), None
+    try:
+        return None, function(**params)
+    except InvalidParams as error:
+        return (INVALID_PARAMS, str(error)), None
+    except Exception as error:
+        return (ANALYSIS_ERROR, '{}: {}'.format(type(error).__name__, error)), None
+
+
+class AnalysisServer:
+
+    def __init__(self, workers=None, cache_size=128, cache_dir=None):
+        self.workers = workers
+        self.cache_size = cache_size
+        self.cache_dir = cache_dir
+        if workers == 0:
+            # In this process: one thread, so the caches are shared by every request
+            init_worker(cache_size, cache_dir)
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            self.executor = self.new_pool()
+        self.stopped = None
+        # The open connections: writer -> the task serving it
+        self.connections = {}
+
+    def new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                   initargs=(self.cache_size, self.cache_dir))
+
+    # The (error, result) of running a method in the executor. A worker that dies (killed, out of memory) breaks the
+    # whole pool: the requests it had fail and the later ones go to a new pool.
+    async def run(self, method, params):
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            return await loop.run_in_executor(executor, run_method, method, params)
+        except BrokenProcessPool as error:
+            if self.executor is executor:
+                self.executor = self.new_pool()
+                executor.shutdown(wait=False, cancel_futures=True)
+            return (ANALYSIS_ERROR, 'Worker died: {}'.format(error)), None
+        except Exception as error:
+            return (ANALYSIS_ERROR, '{}: {}'.format(type(error).__name__, error)), None
+
+    @staticmethod
+    def error(request_id, code, message):
+        return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
+
+    # The response to one decoded request, None for a notification (a request without an id)
+    async def dispatch(self, request):
+        if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+            return self.error(None, INVALID_REQUEST, 'Invalid request')
+        request_id = request.get('id')
+        method = request['method']
+        params = request.get('params', {})
+        if not isinstance(params, dict):
+            response = self.error(request_id, INVALID_PARAMS, 'params must be an object')
+        elif method == 'shutdown':
+            self.stopped.set()
+            response = {'jsonrpc': '2.0', 'id': request_id, 'result': None}
+        elif method not in METHODS:
+            response = self.error(request_id, METHOD_NOT_FOUND, 'Unknown method {!r}'.format(method))
+        else:
+            error, result = await self.run(method, params)
+            if error is None:
+                response = {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+            else:
+                response = self.error(request_id, *error)
+        return response if 'id' in request else None
+
+    # The response to one line, which holds a request or a batch of them
+    async def handle(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            return self.error(None, PARSE_ERROR, 'Parse error: {}'.format(error))
+        if isinstance(request, list):
+            if not request:
+                return self.error(None, INVALID_REQUEST, 'Empty batch')
+            responses = await asyncio.gather(*(self.dispatch(single) for single in request))
+            return [response for response in responses if response is not None] or None
+        return await self.dispatch(request)
+
+    # Reads requests until the end of the stream, answering each one as soon as it is done
+    async def serve_stream(self, reader, write):
+        pending = set()
+
+        async def respond(line):
+            response = await self.handle(line)
+            if response is not None:
+                write((json.dumps(response) + '\n').encode('utf-8'))
+
+        # A shutdown ends the read that is waiting for the next request
+        stopping = asyncio.ensure_future(self.stopped.wait())
+        reading = None
+        try:
+            while not self.stopped.is_set():
+                reading = asyncio.ensure_future(reader.readline())
+                await asyncio.wait((reading, stopping), return_when=asyncio.FIRST_COMPLETED)
+                if not reading.done():
+                    break
+                try:
+                    line = reading.result()
+                except (ValueError, asyncio.LimitOverrunError):
+                    write((json.dumps(self.error(None, INVALID_REQUEST, 'Request too long')) + '\n').encode('utf-8'))
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.ensure_future(respond(line))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        finally:
+            stopping.cancel()
+            if reading is not None:
+                reading.cancel()
+        if pending:
+            await asyncio.wait(pending)
+
+    async def serve_socket(self, path):
+        self.stopped = asyncio.Event()
+
+        async def connection(reader, writer):
+            self.connections[writer] = asyncio.current_task()
+            try:
+                await self.serve_stream(reader, writer.write)
+                await writer.drain()
+            except ConnectionError:
+                # The client went away, or the connection was closed at shutdown
+                pass
+            finally:
+                self.connections.pop(writer, None)
+                writer.close()
+
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(connection, path, limit=LINE_LIMIT)
+        # Only the user running the daemon may talk to it
+        os.chmod(path, 0o600)
+        try:
+            await self.stopped.wait()
+        finally:
+            server.close()
+            # An open connection ends at the end of its stream, instead of being cancelled in readline
+            connections = list(self.connections.items())
+            for writer, task in connections:
+                writer.close()
+            if connections:
+                await asyncio.wait([task for writer, task in connections])
+            await server.wait_closed()
+            os.remove(path)
+
+    async def serve_stdio(self):
+        self.stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=LINE_LIMIT)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        output = sys.stdout.buffer
+
+        def write(data):
+            output.write(data)
+            output.flush()
+
+        await self.serve_stream(reader, write)
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Serve Micro-C analysis requests from warm worker processes.')
+    argparser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket to listen on')
+    argparser.add_argument('--stdio', action='store_true', help='read requests from stdin instead of a socket')
+    argparser.add_argument('--workers', type=int, default=None,
+                           help='worker processes (default: one per core, 0: a thread of the daemon)')
+    argparser.add_argument('--cache-size', type=int, default=128, help='trees and graphs each worker keeps')
+    argparser.add_argument('--cache-dir', default=None, help='also keep parsed trees on disk in this directory')
+    args = argparser.parse_args()
+
+    server = AnalysisServer(args.workers, args.cache_size, args.cache_dir)
+    try:
+        if args.stdio:
+            asyncio.run(server.serve_stdio())
+        else:
+            asyncio.run(server.serve_socket(args.socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,645 @@
+# -*- coding: utf-8 -*-
+########################################################################################################################
+#   Bit vector dataflow analysis:
+#
+#   A monotone framework solver over the program graphs of compiler/graph.py. The facts of an analysis are
+#   numbered and a set of facts is a Python int used as a bit set, so joining two sets is one | (or & for a must
+#   analysis) and the transfer function of an edge is
+#       (facts & keep[edge]) | gen[edge]
+#   with keep = ~kill and gen computed once per edge before solving. keep is a negative int, & keep clears the killed
+#   bits without ever building a mask as wide as all the facts. The order in which the solver visits nodes is a
+#   worklist strategy from roundRobin.py.
+#
+#   The facts of live variables and available expressions are variables and expressions, so their sets stay
+#   small. Reaching definitions has one fact per definition: each node holds a bit set as wide as the program.
+#
+#       graph = build_program_graph(Parser(FastLexer(text)).parse())
+#       solution = solve(LiveVariables(graph), worklist='rr')
+#       solution.facts(node)
+#
+#   What an action does to the variables follows pa4fun: an assignment to x or a declaration of x defines x, an
+#   assignment to an element A[i] only adds a definition of A (it does not kill the others), and every variable read
+#   by the action is used. Assignments nested inside an expression count as well.
+########################################################################################################################
+import argparse
+import sys
+
+from compiler.graph import (START, END, ACTION_ASSIGN, ACTION_DECLARE, ACTION_TEST, ACTION_SKIP, expression_text,
+                            build_program_graph)
+from compiler.lexer import FastLexer
+from compiler.parser import Parser, Traversal, Assign, Variable, ArrayElement, UnaryOp, BinOp, Integer, ZeroNode
+from compiler.static import *
+from roundRobin import Worklist, LIFO, FIFO, ImprovedRoundRobin, SCCWorklist
+
+WORKLISTS = {
+    'lifo': lambda graph, start, backward: LIFO(),
+    'fifo': lambda graph, start, backward: FIFO(),
+    'rr': ImprovedRoundRobin,
+    'scc': SCCWorklist,
+}
+
+
+# Which variables an action defines (strongly: the old value is gone, or weakly: an array element) and uses, as
+# (strong, weak, used) sets of names
+def action_effect(action, names):
+    strong, weak, used = set(), set(), set()
+    if action.kind == ACTION_SKIP:
+        pass
+    elif action.kind == ACTION_DECLARE:
+        strong.add(action.variable)
+    else:
+        targets = set()
+
+        def pre(node):
+            node_type = type(node)
+            if node_type is Assign:
+                left = node.left
+                if type(left) is ArrayElement:
+                    weak.add(names[left.var_node.slot])
+                    targets.add(id(left.var_node))
+                else:
+                    strong.add(names[left.slot])
+                    targets.add(id(left))
+            elif node_type is Variable and id(node) not in targets:
+                used.add(names[node.slot])
+
+        Traversal.walk(action.node, pre)
+    return strong, weak, used
+
+
+# The effects of every interned action, computed once, as a list indexed by action id
+def action_effects(graph):
+    return [action_effect(action, graph.names) for action in graph.actions]
+
+
+class BitVectorAnalysis:
+    # A forward analysis solves from START along the edges, a backward one from END against them. A may analysis
+    # joins with union and starts from the empty set, a must analysis joins with intersection and starts from all.
+    backward = False
+    must = False
+
+    def __init__(self, graph):
+        self.graph = graph
+        # Bit i stands for facts[i]
+        self.facts = []
+        self.keep = []
+        self.gen = []
+        # Only kept once track() is called, for set_edge: fact -> bit, name -> the edges that kill the facts about
+        # the name, and edge -> its action (None for a removed edge)
+        self.bit_of = None
+        self.killers = None
+        self.edge_actions = None
+
+    @property
+    def full(self):
+        return (1 << len(self.facts)) - 1
+
+    @property
+    def extremal_node(self):
+        return END if self.backward else START
+
+    # The facts that hold at the extremal node
+    def extremal_value(self):
+        return 0
+
+    def bottom(self):
+        return self.full if self.must else 0
+
+    def describe(self, bits):
+        facts = []
+        while bits:
+            low = bits & -bits
+            facts.append(self.facts[low.bit_length() - 1])
+            bits ^= low
+        return facts
+
+    # The names whose facts an edge with these effects kills, for the facts that are about a name
+    def killed_names(self, effects):
+        return ()
+
+    # Gets the analysis ready for set_edge
+    def track(self):
+        if self.bit_of is None:
+            self.bit_of = {fact: 1 << i for i, fact in enumerate(self.facts)}
+        graph = self.graph
+        effects = action_effects(graph)
+        self.killers = {}
+        for edge, action_id in enumerate(graph.action_ids):
+            for name in self.killed_names(effects[action_id]):
+                self.killers.setdefault(name, set()).add(edge)
+        self.edge_actions = [graph.actions[action_id] for action_id in graph.action_ids]
+
+    # Bit of a fact about the given names. A new fact is numbered after the others and killed by every edge that
+    # kills the facts about one of the names.
+    def new_fact(self, fact, names):
+        bit = self.bit_of.get(fact)
+        if bit is None:
+            bit = self.bit_of[fact] = 1 << len(self.facts)
+            self.facts.append(fact)
+            keep = self.keep
+            # Edges that shared a mask keep sharing one: id of the old mask -> (old mask, new mask)
+            masks = {}
+            for name in names:
+                for edge in self.killers.get(name, ()):
+                    old = keep[edge]
+                    shared = masks.get(id(old))
+                    if shared is None:
+                        shared = masks[id(old)] = (old, old & ~bit)
+                    keep[edge] = shared[1]
+        return bit
+
+    # Gives edge source --action--> target the transfer function of action; an edge numbered past the last one is
+    # added, action None removes it. The masks of the other edges are brought up to date with the new facts.
+    def set_edge(self, edge, source, action, target):
+        if edge == len(self.keep):
+            self.keep.append(-1)
+            self.gen.append(0)
+            self.edge_actions.append(None)
+        names = self.graph.names
+        old = self.edge_actions[edge]
+        if old is not None:
+            for name in self.killed_names(action_effect(old, names)):
+                self.killers[name].discard(edge)
+        self.edge_actions[edge] = action
+        if action is None:
+            self.keep[edge], self.gen[edge] = -1, 0
+            return
+        effects = action_effect(action, names)
+        self.keep[edge], self.gen[edge] = self.edge_masks(source, action, target, effects)
+        for name in self.killed_names(effects):
+            self.killers.setdefault(name, set()).add(edge)
+
+    # (keep, gen) of an edge source --action--> target
+    def edge_masks(self, source, action, target, effects):
+        raise Exception('{} can not update its edges'.format(type(self).__name__))
+
+
+class ReachingDefinitions(BitVectorAnalysis):
+    # Facts are definitions (variable, source, target); (variable, None, START) is the unknown initial value
+
+    def __init__(self, graph):
+        super().__init__(graph)
+        effects = action_effects(graph)
+        definitions_of = {}
+
+        for name in graph.names:
+            if name is not None:
+                definitions_of[name] = 1 << len(self.facts)
+                self.facts.append((name, None, START))
+        self.initial = self.full
+
+        edge_bits = []
+        for edge in range(graph.edge_count):
+            strong, weak, _ = effects[graph.action_ids[edge]]
+            bits = 0
+            for name in strong | weak:
+                bit = 1 << len(self.facts)
+                self.facts.append((name, graph.sources[edge], graph.targets[edge]))
+                definitions_of[name] = definitions_of.get(name, 0) | bit
+                bits |= bit
+            edge_bits.append(bits)
+
+        # Edges that define the same variables share their keep mask
+        keep_of = {}
+        for edge in range(graph.edge_count):
+            strong, _, _ = effects[graph.action_ids[edge]]
+            key = frozenset(strong)
+            if key not in keep_of:
+                kill = 0
+                for name in strong:
+                    kill |= definitions_of[name]
+                keep_of[key] = ~kill
+            self.keep.append(keep_of[key])
+            self.gen.append(edge_bits[edge])
+        self.definitions_of = definitions_of
+
+    def extremal_value(self):
+        return self.initial
+
+    def killed_names(self, effects):
+        return effects[0]
+
+    def edge_masks(self, source, action, target, effects):
+        strong, weak, _ = effects
+        definitions_of = self.definitions_of
+        gen = 0
+        for name in strong | weak:
+            if name not in definitions_of:
+                definitions_of[name] = self.new_fact((name, None, START), (name,))
+                self.initial |= definitions_of[name]
+            bit = self.new_fact((name, source, target), (name,))
+            definitions_of[name] |= bit
+            gen |= bit
+        kill = 0
+        for name in strong:
+            kill |= definitions_of[name]
+        return ~kill, gen
+
+
+class LiveVariables(BitVectorAnalysis):
+    # Facts are variable names
+    backward = True
+
+    def __init__(self, graph):
+        super().__init__(graph)
+        effects = action_effects(graph)
+        bit_of = {}
+        for strong, weak, used in effects:
+            for name in strong | weak | used:
+                if name not in bit_of:
+                    bit_of[name] = 1 << len(self.facts)
+                    self.facts.append(name)
+
+        masks = []
+        for strong, _, used in effects:
+            kill = gen = 0
+            for name in strong:
+                kill |= bit_of[name]
+            for name in used:
+                gen |= bit_of[name]
+            masks.append((~kill, gen))
+        for action_id in graph.action_ids:
+            keep, gen = masks[action_id]
+            self.keep.append(keep)
+            self.gen.append(gen)
+        self.bit_of = bit_of
+
+    def edge_masks(self, source, action, target, effects):
+        strong, _, used = effects
+        kill = gen = 0
+        for name in strong:
+            kill |= self.new_fact(name, ())
+        for name in used:
+            gen |= self.new_fact(name, ())
+        return ~kill, gen
+
+
+class AvailableExpressions(BitVectorAnalysis):
+    # Facts are the texts of the non trivial arithmetic expressions of the program
+    must = True
+
+    def __init__(self, graph):
+        super().__init__(graph)
+        effects = action_effects(graph)
+        bit_of = {}
+        # bit of a variable -> bits of the expressions that read it
+        reading = {}
+        masks = []
+
+        for action, (strong, weak, _) in zip(graph.actions, effects):
+            computed = 0
+            if action.kind == ACTION_ASSIGN or action.kind == ACTION_TEST:
+                for text, variables in self.expressions(action.node, graph.names):
+                    if text not in bit_of:
+                        bit_of[text] = 1 << len(self.facts)
+                        self.facts.append(text)
+                    for name in variables:
+                        reading[name] = reading.get(name, 0) | bit_of[text]
+                    # An expression is only available afterwards if the action does not change what it reads
+                    if not variables & (strong | weak):
+                        computed |= bit_of[text]
+            masks.append((computed, strong | weak))
+
+        action_masks = []
+        for computed, defined in masks:
+            kill = 0
+            for name in defined:
+                kill |= reading.get(name, 0)
+            action_masks.append((~kill, computed))
+        for action_id in graph.action_ids:
+            keep, gen = action_masks[action_id]
+            self.keep.append(keep)
+            self.gen.append(gen)
+        self.bit_of = bit_of
+        self.reading = reading
+
+    def killed_names(self, effects):
+        return effects[0] | effects[1]
+
+    def edge_masks(self, source, action, target, effects):
+        strong, weak, _ = effects
+        defined = strong | weak
+        reading = self.reading
+        computed = 0
+        if action.kind == ACTION_ASSIGN or action.kind == ACTION_TEST:
+            for text, variables in self.expressions(action.node, self.graph.names):
+                bit = self.new_fact(text, variables)
+                for name in variables:
+                    reading[name] = reading.get(name, 0) | bit
+                if not variables & defined:
+                    computed |= bit
+        kill = 0
+        for name in defined:
+            kill |= reading.get(name, 0)
+        return ~kill, computed
+
+    # (text, variables read) of every arithmetic operation in node that has no assignment inside
+    @staticmethod
+    def expressions(node, names):
+        found = []
+        expression_text(node, names, found)
+        # Post order, so the variables of every node are known before its parent's
+        variables = {}
+        with_assign = set()
+        expressions = []
+        for node, text in found:
+            node_type = type(node)
+            reads = set()
+            has_assign = node_type is Assign
+            for child in node.child_nodes():
+                child_type = type(child)
+                if child_type is Variable:
+                    reads.add(names[child.slot])
+                elif child_type is not Integer and child_type is not ZeroNode:
+                    reads |= variables[id(child)]
+                    has_assign = has_assign or id(child) in with_assign
+            variables[id(node)] = reads
+            if has_assign:
+                with_assign.add(id(node))
+            elif node_type is BinOp or (node_type is UnaryOp and node.operation.type != TT_NOT):
+                expressions.append((text, reads))
+        return expressions
+
+
+ANALYSES = {
+    'rd': ReachingDefinitions,
+    'lv': LiveVariables,
+    'ae': AvailableExpressions,
+}
+
+
+class Solution:
+
+    def __init__(self, analysis, values, stats):
+        self.analysis = analysis
+        # node -> bit set of the facts that hold there
+        self.values = values
+        self.stats = stats
+
+    def facts(self, node):
+        return self.analysis.describe(self.values[node])
+
+
+# The smallest solution of the constraints of the analysis. worklist is a Worklist or one of the names in WORKLISTS.
+def solve(analysis, worklist='rr'):
+    graph = analysis.graph
+    backward = analysis.backward
+    if not isinstance(worklist, Worklist):
+        worklist = WORKLISTS[worklist](graph, analysis.extremal_node, backward)
+    if backward:
+        offsets, edges, ends = graph.pred_offsets, graph.pred_edges, graph.sources
+    else:
+        offsets, edges, ends = graph.succ_offsets, graph.succ_edges, graph.targets
+    keep, gen, must = analysis.keep, analysis.gen, analysis.must
+    insert, extract, is_empty = worklist.insert, worklist.extract, worklist.is_empty
+
+    values = [analysis.bottom()] * graph.node_count
+    values[analysis.extremal_node] = analysis.extremal_value()
+    W = worklist.empty()
+    for node in range(graph.node_count):
+        W = insert(node, W)
+    inserts = graph.node_count
+    extracts = transfers = 0
+
+    while not is_empty(W):
+        node, W = extract(W)
+        extracts += 1
+        value = values[node]
+        for i in range(offsets[node], offsets[node + 1]):
+            edge = edges[i]
+            transfers += 1
+            new = (value & keep[edge]) | gen[edge]
+            end = ends[edge]
+            old = values[end]
+            joined = old & new if must else old | new
+            if joined != old:
+                values[end] = joined
+                W = insert(end, W)
+                inserts += 1
+
+    return Solution(analysis, values, {'transfers': transfers, 'inserts': inserts, 'extracts': extracts})
+
+
+# Solves the analysis with every worklist and returns their stats, with how many more transfer function
+# evaluations each one needs than the best of them
+def compare_worklists(analysis, worklists=WORKLISTS):
+    stats = {name: solve(analysis, name).stats for name in worklists}
+    fewest = min(stat['transfers'] for stat in stats.values())
+    for stat in stats.values():
+        stat['extra_transfers'] = stat['transfers'] - fewest
+    return stats
+
+
+# Keeps the solution of an analysis up to date while edges of its program graph are added, removed or changed:
+#     solver = IncrementalSolver(ReachingDefinitions(graph), 'scc')
+#     q = solver.add_node()
+#     solver.update(added=[(source, action, q), (q, skip, target)], removed=[edge], changed=[(other, action)])
+#     solver.solution().facts(node)
+#
+# An update starts from the last fixpoint instead of from bottom. Facts that an edge lets through now and did not
+# before only need the nodes at the start of the new and changed edges back on the worklist. Facts that it let
+# through before and does not now (the definitions of a removed assignment, a variable that is no longer read) may
+# still be held by the nodes after it. Those are cleared first, following the edges from the changed ones as far
+# as the facts went without being generated again, and the edges into the cleared nodes are evaluated again.
+# A must analysis is cleared the same way on the complement of its sets, where the facts that come back are the
+# ones no longer killed. The work is proportional to the part of the graph the changed facts reach, plus one pass
+# over the graph for an update that brings facts new to a must analysis.
+class IncrementalSolver:
+
+    def __init__(self, analysis, worklist='rr'):
+        graph = analysis.graph
+        analysis.track()
+        if not isinstance(worklist, Worklist):
+            worklist = WORKLISTS[worklist](graph, analysis.extremal_node, analysis.backward)
+        solution = solve(analysis, worklist)
+        self.analysis = analysis
+        self.worklist = worklist
+        self.values = solution.values
+        self.stats = solution.stats
+        self.node_count = graph.node_count
+        # Edges in the direction of the program graph, a removed edge has source and target -1
+        self.sources = list(graph.sources)
+        self.targets = list(graph.targets)
+        # tails[edge] is where the facts along the edge come from and heads[edge] where they go
+        if analysis.backward:
+            self.tails, self.heads = self.targets, self.sources
+        else:
+            self.tails, self.heads = self.sources, self.targets
+        self.outgoing = [[] for _ in range(graph.node_count)]
+        self.incoming = [[] for _ in range(graph.node_count)]
+        for edge in range(graph.edge_count):
+            self.outgoing[self.tails[edge]].append(edge)
+            self.incoming[self.heads[edge]].append(edge)
+
+    def solution(self):
+        return Solution(self.analysis, self.values, self.stats)
+
+    def add_node(self):
+        node = self.node_count
+        self.node_count += 1
+        self.values.append(self.analysis.bottom())
+        self.outgoing.append([])
+        self.incoming.append([])
+        self.worklist.add_node(node)
+        return node
+
+    # The bits of a value as a may analysis has them: for a must analysis, the facts that do not hold
+    def may_bits(self, value, full):
+        return ~value & full if self.analysis.must else value
+
+    # What an edge passes on from the current value of its tail, and what it passes on whatever that is, as may bits
+    def passed(self, edge, full):
+        analysis = self.analysis
+        value = self.values[self.tails[edge]]
+        return self.may_bits((value & analysis.keep[edge]) | analysis.gen[edge], full)
+
+    def generated(self, edge, full):
+        analysis = self.analysis
+        if analysis.must:
+            return ~analysis.keep[edge] & ~analysis.gen[edge] & full
+        return analysis.gen[edge]
+
+    def check_edge(self, edge):
+        if not 0 <= edge < len(self.sources) or self.sources[edge] == -1:
+            raise Exception('There is no edge {}'.format(edge))
+
+    # Applies the changes to the program graph: added is a list of (source, action, target), removed a list of edges
+    # and changed a list of (edge, action). Returns the numbers of the added edges.
+    def update(self, added=(), removed=(), changed=()):
+        analysis = self.analysis
+        values = self.values
+        must = analysis.must
+        full = analysis.full
+        extremal_node = analysis.extremal_node
+        extremal = analysis.extremal_value()
+        # (node, may bits that may have lost what they came from)
+        lost = []
+        seeds = set()
+
+        for edge in removed:
+            self.check_edge(edge)
+            tail, head = self.tails[edge], self.heads[edge]
+            lost.append((head, self.passed(edge, full)))
+            self.outgoing[tail].remove(edge)
+            self.incoming[head].remove(edge)
+            self.sources[edge] = self.targets[edge] = -1
+            analysis.set_edge(edge, -1, None, -1)
+        changed_edges = []
+        for edge, action in changed:
+            self.check_edge(edge)
+            before = self.passed(edge, full)
+            old_keep, old_gen = analysis.keep[edge], analysis.gen[edge]
+            analysis.set_edge(edge, self.sources[edge], action, self.targets[edge])
+            # Only the facts the edge treats differently now, and does not generate
+            differ = (old_keep ^ analysis.keep[edge]) | (old_gen ^ analysis.gen[edge])
+            lost.append((self.heads[edge], before & differ & ~self.generated(edge, full)))
+            seeds.add(self.tails[edge])
+            changed_edges.append(edge)
+        added_edges = []
+        for source, action, target in added:
+            edge = len(self.sources)
+            self.sources.append(source)
+            self.targets.append(target)
+            analysis.set_edge(edge, source, action, target)
+            self.outgoing[self.tails[edge]].append(edge)
+            self.incoming[self.heads[edge]].append(edge)
+            seeds.add(self.tails[edge])
+            added_edges.append(edge)
+
+        # The facts that are new to a must analysis start out holding everywhere, as in solve, but at the extremal
+        # node. They stop holding after the extremal node and after the edges that kill them, and from there on.
+        new_facts = analysis.full & ~full
+        full = analysis.full
+        if must and new_facts:
+            for node in range(self.node_count):
+                values[node] |= new_facts
+            values[extremal_node] &= analysis.extremal_value() | ~new_facts
+            seeds.add(extremal_node)
+            for edge, tail in enumerate(self.tails):
+                if tail != -1 and new_facts & ~analysis.keep[edge] & ~analysis.gen[edge]:
+                    seeds.add(tail)
+        if analysis.extremal_value() != extremal:
+            extremal = analysis.extremal_value()
+            values[extremal_node] = values[extremal_node] & extremal if must else values[extremal_node] | extremal
+            seeds.add(extremal_node)
+
+        # Clears what may have lost its support, as far as it went
+        keep, gen = analysis.keep, analysis.gen
+        heads, tails = self.heads, self.tails
+        outgoing = self.outgoing
+        extremal_bits = self.may_bits(extremal, full)
+        cleared = {}
+        while lost:
+            node, bits = lost.pop()
+            bits &= self.may_bits(values[node], full) & ~cleared.get(node, 0)
+            if node == extremal_node:
+                bits &= ~extremal_bits
+            if not bits:
+                continue
+            cleared[node] = cleared.get(node, 0) | bits
+            for edge in outgoing[node]:
+                # Bits an edge generates (in a must analysis: kills) hold after it whatever came before
+                bits_after = bits & keep[edge] & ~gen[edge]
+                if bits_after:
+                    lost.append((heads[edge], bits_after))
+        for node, bits in cleared.items():
+            values[node] = values[node] | bits if must else values[node] & ~bits
+            for edge in self.incoming[node]:
+                seeds.add(tails[edge])
+
+        worklist = self.worklist
+        insert, extract, is_empty = worklist.insert, worklist.extract, worklist.is_empty
+        W = worklist.empty()
+        for node in seeds:
+            W = insert(node, W)
+        inserts = len(seeds)
+        extracts = transfers = 0
+
+        while not is_empty(W):
+            node, W = extract(W)
+            extracts += 1
+            value = values[node]
+            for edge in outgoing[node]:
+                transfers += 1
+                new = (value & keep[edge]) | gen[edge]
+                end = heads[edge]
+                old = values[end]
+                joined = old & new if must else old | new
+                if joined != old:
+                    values[end] = joined
+                    W = insert(end, W)
+                    inserts += 1
+
+        self.stats = {'transfers': transfers, 'inserts': inserts, 'extracts': extracts, 'cleared': len(cleared)}
+        return added_edges
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Run a dataflow analysis on a Micro-C program.')
+    argparser.add_argument('source', help='Micro-C file')
+    argparser.add_argument('--analysis', choices=sorted(ANALYSES), default='rd',
+                           help='reaching definitions, live variables or available expressions')
+    argparser.add_argument('--worklist', choices=sorted(WORKLISTS), default='scc')
+    argparser.add_argument('--compare', action='store_true', help='compare the worklists instead of printing facts')
+    args = argparser.parse_args()
+
+    with open(args.source, encoding='utf-8') as source:
+        text = source.read()
+    graph = build_program_graph(Parser(FastLexer(text, detect_records=True)).parse())
+    analysis = ANALYSES[args.analysis](graph)
+
+    if args.compare:
+        print('{:<6} {:>12} {:>12} {:>12} {:>12}'.format('', 'transfers', 'extra', 'inserts', 'extracts'))
+        for name, stat in compare_worklists(analysis).items():
+            print('{:<6} {:>12} {:>12} {:>12} {:>12}'.format(
+                name, stat['transfers'], stat['extra_transfers'], stat['inserts'], stat['extracts']))
+        return 0
+
+    solution = solve(analysis, args.worklist)
+    for node in range(graph.node_count):
+        print('q{}: {}'.format(node, solution.facts(node)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
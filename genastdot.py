@@ -1,24 +1,100 @@
 # -*- coding: utf-8 -*-
+########################################################################################################################
+#   AST visualizer:
+#
+#   Writes the AST of a program as a DOT graph. gendot writes to any writable text stream (a file, a pipe, a
+#   socket's makefile()) and returns the number of characters written; without a stream it returns the DOT text.
+#
+#   The output goes through a DotWriter, which collects lines until BUFFER_LINES of them are waiting and then hands
+#   them to the stream in one write, so memory does not grow with the size of the graph. The tree is walked
+#   without recursion: every visit_ method writes the label of its node and returns the tasks that follow it (visit
+#   a child, write an edge), and gendot keeps a stack of those task iterators, one per level of the tree.
+#
+#   python genastdot.py program.mc | dot -Tpng -o ast.png
+#
+#   Level of detail: for programs too big to lay out, the visualizer can draw only part of the tree.
+#       max_nodes       the most nodes to draw. The tree is expanded breadth first, so the upper levels are
+#                       drawn before any deeper one, and whatever does not fit is collapsed.
+#       max_depth       the levels below the root to draw, the nodes on the last one are collapsed
+#       path            draw only the subtree at this path of child indices from the root, e.g. (3, 1)
+#       source_range    draw only the smallest Compound, Record, If or While holding the text between these offsets
+#   A collapsed node with children is drawn as one summary node, e.g. "Compound (1,240 nodes)", and the children of
+#   a wide node that do not fit as "... 310 more (9,512 nodes)". The subtree sizes are only counted for the
+#   summaries and cached, so drawing again with another budget only walks what is drawn.
+#
+#   python genastdot.py big.mc --max-nodes 500 --path 12.1 | dot -Tsvg -o part.svg
+########################################################################################################################
 import argparse
+import io
+import sys
 import textwrap
+from collections import deque
 
 from compiler.lexer import Lexer
-from compiler.parser import Parser, Traversal
+from compiler.parser import Parser, Traversal, AST, Compound, Record, If, While, VariableDeclaration, ArrayDeclaration
 
+BUFFER_LINES = 4096
 
-class ASTVisualizer(Traversal):
-    def __init__(self, parser):
-        self.parser = parser
-        self.ncount = 1
-        self.dot_header = [textwrap.dedent("""\
+DOT_HEADER = textwrap.dedent("""\
         digraph astgraph {
           node [shape=circle, fontsize=12, fontname="Courier", height=.1];
           ranksep=.3;
           edge [arrowsize=.5]
-        """)]
-        self.dot_body = []
-        self.dot_footer = ['}']
-        
+        """)
+DOT_FOOTER = '}'
+
+# The tasks returned by the visit_ methods are a node (visit it), (parent, child) (write the edge between them) or
+# (LABEL, node, text) (number the node again, with a label of its own)
+LABEL = 'label'
+
+# What source_range selects
+BLOCKS = (Compound, Record, If, While)
+
+# Nodes drawn with more than one label
+LABELS = {ArrayDeclaration: 2, Record: 2}
+
+
+class DotWriter:
+
+    def __init__(self, stream, buffer_lines=BUFFER_LINES):
+        self.stream = stream
+        self.buffer_lines = buffer_lines
+        self.parts = []
+        # Only queues the line, gendot flushes every buffer_lines lines
+        self.write = self.parts.append
+        # Characters written so far
+        self.written = 0
+
+    def flush(self):
+        if self.parts:
+            chunk = ''.join(self.parts)
+            self.stream.write(chunk)
+            self.written += len(chunk)
+            self.parts.clear()
+
+
+# The children of a node that do not fit in the budget, drawn as one summary node
+class Elided(AST):
+    __slots__ = ('nodes',)
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+
+class ASTVisualizer(Traversal):
+    def __init__(self, parser, max_nodes=None, max_depth=None, path=None, source_range=None):
+        self.parser = parser
+        self.ncount = 1
+        self.writer = None
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.path = path
+        self.source_range = source_range
+        # id(node) -> how many of its children are drawn, None when everything is
+        self.shown = None
+        # id(node) -> number of nodes in its subtree, filled in as the summaries need them
+        self.sizes = {}
+
     # def bfs(self, node):
     #     ncount = 1
     #     queue = []
@@ -39,174 +115,274 @@ class ASTVisualizer(Traversal):
     #             self.dot_body.append(s)
     #             queue.append(child_node)
 
-    def visit_Integer(self, node):
-        s = '  node{} [label="{}"]\n'.format(self.ncount, node.token.value)
-        self.dot_body.append(s)
+    # Parses the program first, unless the tree is given. Returns the DOT text, or the number of characters written
+    # when a stream is given.
+    def gendot(self, tree=None, stream=None):
+        if stream is None:
+            buffer = io.StringIO()
+            self.gendot(tree, buffer)
+            return buffer.getvalue()
+
+        if tree is None:
+            tree = self.parser.parse()
+        # Sizes are kept by id, which a node of an earlier tree may have had
+        self.sizes.clear()
+        tree = self.select(tree)
+        shown = self.shown = self.plan(tree)
+        self.writer = writer = DotWriter(stream)
+        write, parts, buffer_lines = writer.write, writer.parts, writer.buffer_lines
+        write(DOT_HEADER)
+        dispatch = self.dispatch
+        stack = [iter((tree,))]
+        while stack:
+            task = next(stack[-1], None)
+            if task is None:
+                stack.pop()
+            elif type(task) is not tuple:
+                if shown is not None and id(task) not in shown and self.display_children(task):
+                    self.summary(task)
+                else:
+                    visitor = dispatch.get(type(task)) or self.resolve(type(task))
+                    tasks = visitor(self, task)
+                    if tasks:
+                        stack.append(iter(tasks))
+            elif len(task) == 2:
+                write('  node{} -> node{}\n'.format(task[0]._num, task[1]._num))
+            else:
+                self.label(task[1], task[2])
+            if len(parts) >= buffer_lines:
+                writer.flush()
+        write(DOT_FOOTER)
+        writer.flush()
+        return writer.written
+
+    # Numbers the node and writes its label
+    def label(self, node, text):
+        self.writer.write('  node{} [label="{}"]\n'.format(self.ncount, text))
         node._num = self.ncount
         self.ncount += 1
 
-    def visit_BinOp(self, node):
-        s = '  node{} [label="{}"]\n'.format(self.ncount, node.operation.value)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
-
-        self.visit_node(node.left)
-        self.visit_node(node.right)
+    # The children as they are drawn, VariableDeclaration shows its assignment and ArrayDeclaration a label
+    @staticmethod
+    def display_children(node):
+        node_type = type(node)
+        if node_type is VariableDeclaration:
+            return node.type_node, node.assign_node
+        if node_type is ArrayDeclaration:
+            return ()
+        return node.child_nodes()
+
+    def subtree_size(self, node):
+        size = self.sizes.get(id(node))
+        if size is None:
+            size = 0
+
+            def count(_):
+                nonlocal size
+                size += 1
+
+            Traversal.walk(node, count)
+            self.sizes[id(node)] = size
+        return size
+
+    # The subtree asked for by path or source_range, the whole tree otherwise
+    def select(self, tree):
+        node = tree
+        if self.path is not None:
+            for index in self.path:
+                children = self.display_children(node)
+                if not 0 <= index < len(children):
+                    raise Exception('{} has no child {}'.format(type(node).__name__, index))
+                node = children[index]
+        if self.source_range is not None:
+            start, end = self.source_range
+            block = node
+            while True:
+                for child in self.display_children(node):
+                    first, last = self.span(child)
+                    if first is not None and first <= start and end <= last:
+                        node = child
+                        if isinstance(node, BLOCKS):
+                            block = node
+                        break
+                else:
+                    break
+            node = block
+        return node
+
+    # (first, last) offset of the text of a node, from the tokens below it (None when they carry no offsets)
+    @staticmethod
+    def span(node):
+        first = last = None
+
+        def pre(node):
+            nonlocal first, last
+            token = getattr(node, 'token', None)
+            if token is not None and token.start is not None:
+                if first is None or token.start < first:
+                    first = token.start
+                if last is None or token.end > last:
+                    last = token.end
+
+        Traversal.walk(node, pre)
+        return first, last
+
+    # Breadth first, the nodes that fit in max_nodes and max_depth: id(node) -> how many of its children are drawn.
+    # A node that does not get all its children draws the rest as one Elided node, which is counted as well.
+    def plan(self, tree):
+        if self.max_nodes is None and self.max_depth is None:
+            return None
+        budget = self.max_nodes if self.max_nodes is not None else float('inf')
+        max_depth = self.max_depth if self.max_depth is not None else float('inf')
+        shown = {}
+        count = 1
+        queue = deque([(tree, 0)])
+        while queue and count < budget:
+            node, depth = queue.popleft()
+            if depth >= max_depth:
+                continue
+            children = self.display_children(node)
+            room = budget - count
+            drawn = used = 0
+            for child in children:
+                if used + LABELS.get(type(child), 1) > room:
+                    break
+                used += LABELS.get(type(child), 1)
+                drawn += 1
+            if drawn < len(children):
+                # Room for the Elided node
+                while drawn and used + 1 > room:
+                    drawn -= 1
+                    used -= LABELS.get(type(children[drawn]), 1)
+                used += 1
+            if children and drawn < 1:
+                continue
+            shown[id(node)] = drawn
+            count += used
+            queue.extend((child, depth + 1) for child in children[:drawn])
+        return shown
+
+    # The children of node that are drawn, the others as one Elided node (even when it is only one, which may draw
+    # more than one label itself)
+    def visible(self, node, children):
+        if self.shown is None:
+            return children
+        drawn = self.shown.get(id(node), 0)
+        if drawn >= len(children):
+            return children
+        rest = children[drawn:]
+        return tuple(children[:drawn]) + (Elided(rest),)
+
+    # Each child is followed by the edge to it
+    def interleaved(self, node, children):
+        for child in self.visible(node, children):
+            yield child
+            yield node, child
+
+    # Both children, then both edges
+    def children_first(self, node, left, right):
+        if self.shown is None:
+            return left, right, (node, left), (node, right)
+        children = self.visible(node, (left, right))
+        return children + tuple((node, child) for child in children)
+
+    def summary(self, node):
+        self.label(node, '{} ({:,} nodes)'.format(type(node).__name__, self.subtree_size(node)))
+
+    def visit_Elided(self, node):
+        size = sum(self.subtree_size(child) for child in node.nodes)
+        self.label(node, '... {:,} more ({:,} nodes)'.format(len(node.nodes), size))
 
-        for child_node in (node.left, node.right):
-            s = '  node{} -> node{}\n'.format(node._num, child_node._num)
-            self.dot_body.append(s)
-            
-    def visit_UnaryOp(self, node):
-        s = '  node{} [label="(1) {}"]\n'.format(self.ncount, node.operation.value)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
-
-        self.visit_node(node.expression)
-        s = '  node{} -> node{}\n'.format(node._num, node.expression._num)
-        self.dot_body.append(s)
+    def visit_Integer(self, node):
+        self.label(node, node.token.value)
 
-    def gendot(self):
-        tree = self.parser.parse()
-        self.visit_node(tree)
-        return ''.join(self.dot_header + self.dot_body + self.dot_footer)
+    def visit_BinOp(self, node):
+        self.label(node, node.operation.value)
+        return self.children_first(node, node.left, node.right)
 
+    def visit_UnaryOp(self, node):
+        self.label(node, '(1) {}'.format(node.operation.value))
+        return self.interleaved(node, (node.expression,))
 
     def visit_Compound(self, node):
-        s = '  node{} [label="Scope"]\n'.format(self.ncount)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
-
-        for child in node.children:
-            self.visit_node(child)
-            s = '  node{} -> node{}\n'.format(node._num, child._num)
-            self.dot_body.append(s)
+        self.label(node, 'Scope')
+        return self.interleaved(node, node.children)
 
     def visit_Assign(self, node):
-        s = '  node{} [label="{}"]\n'.format(self.ncount, node.operation.value)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
-
-        self.visit_node(node.left)
-        self.visit_node(node.right)
-
-        for child_node in (node.left, node.right):
-            s = '  node{} -> node{}\n'.format(node._num, child_node._num)
-            self.dot_body.append(s)
+        self.label(node, node.operation.value)
+        return self.children_first(node, node.left, node.right)
 
     def visit_Variable(self, node):
-        s = '  node{} [label="{}"]\n'.format(self.ncount, node.value)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
+        self.label(node, node.value)
 
     def visit_NoOp(self, node):
-        s = '  node{} [label="NoOp"]\n'.format(self.ncount)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
-        
+        self.label(node, 'NoOp')
+
     def visit_VariableDeclaration(self, node):
-        s = '  node{} [label="VarDecl"]\n'.format(self.ncount)
-        self.dot_body.append(s)
-        node._num = self.ncount
+        self.label(node, 'VarDecl')
+        return self.interleaved(node, (node.type_node, node.assign_node))
+
+    def visit_ArrayDeclaration(self, node):
+        self.label(node, 'ArrayDecl')
+        self.writer.write('  node{} [label="{}[{}] {}"]\n'.format(
+            self.ncount, node.type_node.value, node.size, node.var_node.value))
+        self.writer.write('  node{} -> node{}\n'.format(node._num, self.ncount))
         self.ncount += 1
-        
-        self.visit_node(node.type_node)
-        s = '  node{} -> node{}\n'.format(node._num, node.type_node._num)
-        self.dot_body.append(s)
-
-
-        # self.visit_node(node.var_node)
-        # s = '  node{} -> node{}\n'.format(node._num, node.var_node._num)
-        # self.dot_body.append(s)
-        
-        self.visit_node(node.assign_node)
-        s = '  node{} -> node{}\n'.format(node._num, node.assign_node._num)
-        self.dot_body.append(s)
 
+    def visit_ArrayElement(self, node):
+        self.label(node, '[ ]')
+        return self.interleaved(node, (node.var_node, node.index))
 
     def visit_Type(self, node):
-        s = '  node{} [label="{}"]\n'.format(self.ncount, node.token.value)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
-        
+        self.label(node, node.token.value)
+
     def visit_ZeroNode(self, node):
-        s = '  node{} [label="{}"]\n'.format(self.ncount, node.token.value)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
-        
-    def visit_Record(self, node):
-        s = '  node{} [label="Record"]\n'.format(self.ncount)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
+        self.label(node, node.token.value)
 
-        for child in node.children:
-            self.visit_node(child)
-            s = '  node{} -> node{}\n'.format(node._num, child._num)
-            self.dot_body.append(s)
-            
-        s = '  node{} [label="{}"]\n'.format(self.ncount, node.token)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
+    def visit_Record(self, node):
+        self.label(node, 'Record')
+        # The node after the fields is the one the parent links to
+        return list(self.interleaved(node, node.children)) + [(LABEL, node, node.token)]
 
     def visit_Condition(self, node):
-        s = '  node{} [label="{}"]\n'.format(self.ncount, node.operation.value)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
-
-        self.visit_node(node.left)
-        self.visit_node(node.right)
-
-        for child_node in (node.left, node.right):
-            s = '  node{} -> node{}\n'.format(node._num, child_node._num)
-            self.dot_body.append(s)
-
+        self.label(node, node.operation.value)
+        return self.children_first(node, node.left, node.right)
 
+    def visit_If(self, node):
+        self.label(node, 'If')
+        return self.interleaved(node, (node.condition, node.children))
 
+    def visit_While(self, node):
+        self.label(node, 'While')
+        return self.interleaved(node, (node.condition, node.children))
 
-    def visit_If(self, node):
-        s = '  node{} [label="If"]\n'.format(self.ncount)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
 
-        for child in node.children:
-            self.visit_node(child)
-            s = '  node{} -> node{}\n'.format(node._num, child._num)
-            self.dot_body.append(s)
+def int_tuple(text, separator):
+    return tuple(int(value) for value in text.split(separator))
 
-        s = '  node{} [label="{}"]\n'.format(self.ncount, node.token)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
 
 def main():
-    # argparser = argparse.ArgumentParser(
-    #     description='Generate an AST DOT file.'
-    # )
-    # argparser.add_argument(
-    #     'text',
-    #     help='Arithmetic expression (in quotes): "1 + 2 * 3"'
-    # )
-    # args = argparser.parse_args()
-    text = "{ int a; if(a > 1){ a:=10 } }"
-
-    lexer = Lexer(text)
+    argparser = argparse.ArgumentParser(description='Generate an AST DOT file.')
+    argparser.add_argument('source', nargs='?', help='Micro-C file, an example program when left out')
+    argparser.add_argument('--max-nodes', type=int, default=None, help='draw at most this many nodes')
+    argparser.add_argument('--max-depth', type=int, default=None, help='draw this many levels below the root')
+    argparser.add_argument('--path', type=lambda text: int_tuple(text, '.'), default=None,
+                           help='draw only the subtree at these child indices, e.g. 3.1')
+    argparser.add_argument('--range', type=lambda text: int_tuple(text, ':'), default=None, dest='source_range',
+                           help='draw only the smallest block holding the text between offsets START:END')
+    args = argparser.parse_args()
+    if args.source is None:
+        text = "{ int a; if(a > 1){ a:=10 } }"
+    else:
+        with open(args.source, encoding='utf-8') as source:
+            text = source.read()
+
+    lexer = Lexer(text, detect_records=True)
     parser = Parser(lexer)
-    viz = ASTVisualizer(parser)
-    content = viz.gendot()
-    print(content)
+    viz = ASTVisualizer(parser, args.max_nodes, args.max_depth, args.path, args.source_range)
+    viz.gendot(stream=sys.stdout)
+    print()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -3,11 +3,18 @@
 #
 #   This file runs the program in the intended format
 ########################################################################################################################
-from compiler.lexer import Lexer
+import sys
+
+from compiler.lexer import FastLexer, tokenize_file
 
 if __name__ == '__main__':
 
-    file_name = "Console"
+    # python main.py program.mc lexes a file as a stream instead of the inline program below
+    if len(sys.argv) > 1:
+        for token in tokenize_file(sys.argv[1]):
+            print(token)
+        sys.exit()
+
     micro_c_code = """
     { int i;
         {int fst; int snd} R;
@@ -33,7 +40,7 @@ if __name__ == '__main__':
 
     print(micro_c_code)
 
-    lexer = Lexer(file_name, micro_c_code)
+    lexer = FastLexer(micro_c_code)
     tokens, error = lexer.make_tokens()
 
     if error:
@@ -1,57 +1,264 @@
 # -*- coding: utf-8 -*-
+########################################################################################################################
+#   Worklists:
+#
+#   The worklist strategies of a fixpoint solver. They keep the textbook interface
+#       W = worklist.empty()
+#       W = worklist.insert(q, W)
+#       q, W = worklist.extract(W)
+#   but W is a mutable structure that insert and extract update in place instead of copying, and every worklist
+#   keeps the set of nodes it holds, so inserting a node that is already waiting does nothing. insert and extract
+#   are O(1) for LIFO and FIFO and O(log n) for ImprovedRoundRobin and SCCWorklist.
+#
+#   ImprovedRoundRobin works in passes: the nodes inserted during a pass wait until the pass is over, then the next
+#   pass takes them in reverse postorder of the program graph. SCCWorklist stabilizes the strongly connected
+#   components of the graph one at a time, in topological order, each with passes like ImprovedRoundRobin.
+########################################################################################################################
+from collections import deque
+from heapq import heapify, heappop, heappush
+
 
 class Worklist(object):
-    def empty(self, ):
+    def empty(self):
+        pass
+
+    def is_empty(self, W):
         pass
-    
+
     def insert(self, q, W):
         pass
-    
+
     def extract(self, W):
         pass
-    
-# W = (V, P)
+
+    # A node added to the program graph after the worklist was made for it
+    def add_node(self, q):
+        pass
+
+
+# W = (stack, members)
 class LIFO(Worklist):
 
     def empty(self):
-        return []
-    
+        return deque(), set()
+
+    def is_empty(self, W):
+        return not W[0]
+
     def insert(self, q, W):
-        return [q] + W
-            
-    def extract(self, ):
-        return (W[0], W[1:]) 
-    
+        if q not in W[1]:
+            W[1].add(q)
+            W[0].append(q)
+        return W
+
+    def extract(self, W):
+        q = W[0].pop()
+        W[1].discard(q)
+        return q, W
+
+
+# W = (queue, members)
 class FIFO(Worklist):
 
     def empty(self):
-        return []
-    
-    def insert(q, W):
-        return W + [q]
-            
-    def extract(W):
-        return (W[0], W[1:])
-    
+        return deque(), set()
+
+    def is_empty(self, W):
+        return not W[0]
+
+    def insert(self, q, W):
+        if q not in W[1]:
+            W[1].add(q)
+            W[0].append(q)
+        return W
+
+    def extract(self, W):
+        q = W[0].popleft()
+        W[1].discard(q)
+        return q, W
+
+
+# Nodes of a program graph in reverse postorder of a depth first search from start; the nodes it cannot reach come
+# last, in the order of their numbers. backward searches the graph with its edges reversed (for backward analyses).
+def reverse_postorder(graph, start=0, backward=False):
+    visited = bytearray(graph.node_count)
+    postorder = []
+    if backward:
+        succ_offsets, succ_edges, targets = graph.pred_offsets, graph.pred_edges, graph.sources
+    else:
+        succ_offsets, succ_edges, targets = graph.succ_offsets, graph.succ_edges, graph.targets
+
+    visited[start] = 1
+    # (node, index of its next edge in succ_edges)
+    stack = [(start, succ_offsets[start])]
+    while stack:
+        node, i = stack[-1]
+        if i == succ_offsets[node + 1]:
+            stack.pop()
+            postorder.append(node)
+            continue
+        stack[-1] = node, i + 1
+        target = targets[succ_edges[i]]
+        if not visited[target]:
+            visited[target] = 1
+            stack.append((target, succ_offsets[target]))
+
+    postorder.reverse()
+    postorder.extend(node for node in range(graph.node_count) if not visited[node])
+    return postorder
+
+
+# W = (current pass as a heap of ranks, pending nodes, members)
 class ImprovedRoundRobin(Worklist):
-    
+
+    def __init__(self, graph, start=0, backward=False):
+        self.order = reverse_postorder(graph, start, backward)
+        self.rank = [0] * graph.node_count
+        for rank, node in enumerate(self.order):
+            self.rank[node] = rank
+
+    # New nodes come last
+    def add_node(self, q):
+        self.rank.append(len(self.order))
+        self.order.append(q)
+
     def empty(self):
-        return []
-    
+        return [], [], set()
+
+    def is_empty(self, W):
+        return not W[0] and not W[1]
+
     def insert(self, q, W):
-        if q in W[0]:
-            return W
-        else:
-            return (W[0], W[1] + [q])
-            
+        if q not in W[2]:
+            W[2].add(q)
+            W[1].append(q)
+        return W
+
+    def extract(self, W):
+        current, pending, members = W
+        if not current:
+            # A new pass over everything that was inserted during the last one
+            rank = self.rank
+            current.extend(rank[q] for q in pending)
+            pending.clear()
+            heapify(current)
+        q = self.order[heappop(current)]
+        members.discard(q)
+        return q, W
+
+
+# Tarjan's algorithm without recursion, on the nodes for which inside(node) holds. successors[node] lists the nodes
+# an edge goes to from node. The depth first searches start from the nodes in the given order. Returns the strongly
+# connected components as lists of nodes, in topological order (no edge goes from a component to an earlier one).
+def strongly_connected_components(nodes, successors, inside):
+    index = {}
+    low = {}
+    on_stack = set()
+    stack = []
+    components = []
+
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        # (node, iterator over the rest of its successors)
+        calls = [(root, iter(successors[root]))]
+        while calls:
+            node, targets = calls[-1]
+            for target in targets:
+                if not inside(target):
+                    continue
+                if target not in index:
+                    index[target] = low[target] = len(index)
+                    stack.append(target)
+                    on_stack.add(target)
+                    calls.append((target, iter(successors[target])))
+                    break
+                if target in on_stack and index[target] < low[node]:
+                    low[node] = index[target]
+            else:
+                calls.pop()
+                if calls and low[node] < low[calls[-1][0]]:
+                    low[calls[-1][0]] = low[node]
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+
+    # Tarjan completes a component only after every component it reaches, so they come out last to first
+    components.reverse()
+    return components
+
+
+# successors[node] lists the nodes an edge goes to from node, in the direction of the analysis
+def successor_lists(graph, backward=False):
+    tails, heads = (graph.targets, graph.sources) if backward else (graph.sources, graph.targets)
+    successors = [[] for _ in range(graph.node_count)]
+    for tail, head in zip(tails, heads):
+        successors[tail].append(head)
+    return successors
+
+
+# Stabilizes one strongly connected component at a time, in topological order, with a round robin worklist of its
+# own: the passes of ImprovedRoundRobin, but only over the nodes of the component. Nodes of later components that
+# are inserted meanwhile wait until every component before them is stable, so they are evaluated once with the
+# final facts coming in instead of once per pass of every loop before them.
+# W = (heap of the ranks in the current pass, component -> nodes waiting for its next pass, heap of those
+#      components, members)
+class SCCWorklist(Worklist):
+
+    def __init__(self, graph, start=0, backward=False):
+        order = reverse_postorder(graph, start, backward)
+        components = strongly_connected_components(order, successor_lists(graph, backward), lambda node: True)
+        self.component = [0] * graph.node_count
+        for number, nodes in enumerate(components):
+            for node in nodes:
+                self.component[node] = number
+        self.components = len(components)
+        # sorted is stable, so within a component the nodes stay in reverse postorder
+        self.order = sorted(order, key=self.component.__getitem__)
+        self.rank = [0] * graph.node_count
+        for rank, node in enumerate(self.order):
+            self.rank[node] = rank
+
+    # New nodes come last, each in a component of its own
+    def add_node(self, q):
+        self.component.append(self.components)
+        self.components += 1
+        self.rank.append(len(self.order))
+        self.order.append(q)
+
+    def empty(self):
+        return [], {}, [], set()
+
+    def is_empty(self, W):
+        return not W[0] and not W[2]
+
+    def insert(self, q, W):
+        if q not in W[3]:
+            W[3].add(q)
+            component = self.component[q]
+            waiting = W[1].get(component)
+            if waiting is None:
+                waiting = W[1][component] = []
+                heappush(W[2], component)
+            waiting.append(q)
+        return W
+
     def extract(self, W):
-        if W[0] is None:
-            VrP = sorted(W[1])
-            q = VrP[1:]
-            V1 = VrP[:-1]
-            return (q, (V1, []))
-        else:
-            q = W[0][1:]
-            V1 = W[0][:-1]
-            return (q, (V1, W[1]))
-    
\ No newline at end of file
+        current, waiting, components, members = W
+        if not current:
+            # The next pass, over the first component that has nodes waiting
+            rank = self.rank
+            current.extend(rank[q] for q in waiting.pop(heappop(components)))
+            heapify(current)
+        q = self.order[heappop(current)]
+        members.discard(q)
+        return q, W